@@ -0,0 +1,259 @@
+"""
+Benchmarks of the layout generation.
+
+Two kinds of benchmark are run:
+    components - grating_coupler, spiral_winding and asymmetric_spiral_mzi on their own,
+                 across ranges of their parameters
+    populate   - populate_gds end to end on synthetic sweeps of 50, 500 and 5000 devices
+
+Every benchmark records the time, the peak memory, the size of the written GDS file and the
+number of polygons in it. Components are timed cold, with the shared grating and glyph cells
+built from scratch, and warm, with those cells already cached as for every device but the
+first. Each populate run happens in a fresh process, so that its peak memory is its own.
+
+Results are compared with benchmark_baseline.json. Runs which got slower or bigger than the
+baseline by more than the threshold are reported as regressions and the exit status is 1.
+Timings depend on the machine, so no baseline is kept in the repository: save one with
+--save-baseline on the machine the benchmarks run on. Without it, or for benchmarks missing
+from it, the output says that nothing was compared.
+
+Usage:
+    python benchmark.py                       run everything and compare with the baseline
+    python benchmark.py --only components     run one kind of benchmark
+    python benchmark.py --sizes 50 500        populate runs of the given sizes only
+    python benchmark.py --save-baseline       store the results as the new baseline
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from profiling import _geometry_counts, _max_rss
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+# Relative increase over the baseline which counts as a regression
+TIME_THRESHOLD = 0.2
+MEMORY_THRESHOLD = 0.1
+
+POPULATE_SIZES = (50, 500, 5000)
+
+# Parameter ranges of the component benchmarks
+SPIRAL_NUMBERS = range(1, 11)
+SPIRAL_INNER_GAPS = (5, 10, 20, 40)
+MZI_UPPER_SPIRAL_NUMBERS = (1, 2, 3)
+MZI_COUPLING_LENGTHS = (5, 15, 25)
+
+
+def component_jobs():
+    """
+    (benchmark name, job) of every component benchmark, jobs as taken by design_space._build_device.
+    """
+    from components import asymmetric_spiral_mzi, grating_coupler, spiral_winding
+    from parameters import coupler_parameters
+
+    yield 'grating_coupler', (grating_coupler, {'coupler_parameters': coupler_parameters}, 'BENCH_GC', None)
+
+    for number in SPIRAL_NUMBERS:
+        for inner_gap in SPIRAL_INNER_GAPS:
+            kwargs = {'coupler_parameters': coupler_parameters, 'number': number, 'gap_size': 5,
+                      'inner_gap_size': inner_gap}
+            yield ('spiral_winding/num={}/inner_gap={}'.format(number, inner_gap),
+                   (spiral_winding, kwargs, 'BENCH_SW', None))
+
+    for upper in MZI_UPPER_SPIRAL_NUMBERS:
+        for length in MZI_COUPLING_LENGTHS:
+            kwargs = {'coupler_parameters': coupler_parameters, 'coupling_length': length, 'coupling_gap': 0.3,
+                      'upper_spiral_no': upper, 'lower_spiral_no': 1, 'spiral_gap': 5, 'spiral_inner_gap': 8}
+            yield ('asymmetric_spiral_mzi/upper_spiral_no={}/coupling_length={}'.format(upper, length),
+                   (asymmetric_spiral_mzi, kwargs, 'BENCH_MZI', 'BENCH_MZI'))
+
+
+def _cell_polygons(cell):
+    """
+    Number of polygons stored for cell and the cells it references, each unique cell counted once.
+    """
+    seen = {}
+
+    def walk(c):
+        if c.name not in seen:
+            seen[c.name] = _geometry_counts(c)[0]
+            for ref in c.cells:
+                walk(ref['cell'])
+
+    walk(cell)
+    return sum(seen.values())
+
+
+def run_component(job, repeats=3):
+    """
+    Builds one device repeatedly, each time with empty and then with filled grating and glyph caches.
+    :return: Result dict, the cold and warm times are the fastest of the repeats
+    """
+    from components import clear_cached_cells
+    from design_space import _build_device
+
+    times, warm_times = [], []
+    for _ in range(repeats):
+        clear_cached_cells()
+        start = time.perf_counter()
+        device = _build_device(job)
+        times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        _build_device(job)
+        warm_times.append(time.perf_counter() - start)
+
+    # Memory in a separate run, tracemalloc would distort the times
+    clear_cached_cells()
+    tracemalloc.start()
+    _build_device(job)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'device.gds')
+        device.save(filename)
+        size = os.path.getsize(filename)
+
+    return {'time_s': min(times), 'warm_time_s': min(warm_times), 'memory_bytes': peak, 'gds_bytes': size,
+            'polygons': _cell_polygons(device)}
+
+
+def synthetic_sweep(n, row_length=25):
+    """
+    Sweep description of n routable asymmetric_spiral_mzi devices, in rows of row_length.
+    """
+    points = [{'coupling_length': 5 + (i % 10) * 2, 'coupling_gap': round(0.25 + (i % 7) * 0.01, 3),
+               'upper_spiral_no': 1 + (i % 3), 'spiral_inner_gap': 5 + (i % 4)} for i in range(n)]
+    rows = []
+    for start in range(0, n, row_length):
+        rows.append({'device': 'asymmetric_spiral_mzi',
+                     'name': 'BENCH_{}_{{i}}'.format(start // row_length),
+                     'label': '{name}',
+                     'fixed': {'lower_spiral_no': 1, 'spiral_gap': 5},
+                     'sweep': {'mode': 'list', 'points': points[start:start + row_length]}})
+    return {'rows': rows}
+
+
+def run_populate(n):
+    """
+    populate_gds on a synthetic sweep of n devices, meant to run in a process of its own.
+    :return: Result dict
+    """
+    import design_space
+
+    with tempfile.TemporaryDirectory() as directory:
+        sweep_file = os.path.join(directory, 'sweep.json')
+        with open(sweep_file, 'w') as f:
+            json.dump(synthetic_sweep(n), f)
+        gds_file = os.path.join(directory, design_space.GDS_FILE)
+
+        layout_cell, polygon = design_space.generate_blank_gds()
+        start = time.perf_counter()
+        cell = design_space.populate_gds(layout_cell, polygon, sweep_file=sweep_file, gds_file=gds_file)
+        elapsed = time.perf_counter() - start
+
+        size = os.path.getsize(gds_file)
+
+    return {'time_s': elapsed, 'memory_bytes': _max_rss(), 'gds_bytes': size, 'polygons': _cell_polygons(cell)}
+
+
+def run_benchmarks(only=None, sizes=POPULATE_SIZES, repeats=3):
+    """
+    :param only: 'components' or 'populate' to run one kind of benchmark only
+    :param sizes: Device counts of the populate benchmarks
+    :param repeats: Repeats of every component benchmark
+    :return: Dict of benchmark name to result dict
+    """
+    results = {}
+    if only in (None, 'components'):
+        for name, job in component_jobs():
+            results['components/' + name] = run_component(job, repeats)
+            print('{:<70} {:8.3f} s, warm {:.3f} s'.format(name, results['components/' + name]['time_s'],
+                                                           results['components/' + name]['warm_time_s']))
+
+    if only in (None, 'populate'):
+        # A fresh process per run, peak memory is per process
+        context = multiprocessing.get_context('spawn')
+        for n in sizes:
+            with context.Pool(1) as pool:
+                results['populate/{}'.format(n)] = pool.apply(run_populate, (n,))
+            print('{:<70} {:8.3f} s'.format('populate_gds {} devices'.format(n),
+                                            results['populate/{}'.format(n)]['time_s']))
+
+    return results
+
+
+def compare(results, baseline, time_threshold=TIME_THRESHOLD, memory_threshold=MEMORY_THRESHOLD):
+    """
+    Compares results with a baseline.
+    :return: List of (benchmark, measure, baseline value, new value) which regressed
+    """
+    limits = {'time_s': time_threshold, 'warm_time_s': time_threshold, 'memory_bytes': memory_threshold,
+              'gds_bytes': 0, 'polygons': 0}
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for measure, threshold in limits.items():
+            old, new = baseline[name].get(measure), result.get(measure)
+            if old and new is not None and new > old * (1 + threshold):
+                regressions.append((name, measure, old, new))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the layout generation')
+    parser.add_argument('--only', choices=('components', 'populate'), help='Run one kind of benchmark only')
+    parser.add_argument('--sizes', type=int, nargs='+', default=POPULATE_SIZES,
+                        help='Device counts of the populate benchmarks')
+    parser.add_argument('--repeats', type=int, default=3, help='Repeats of every component benchmark')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='Baseline file to compare with')
+    parser.add_argument('--save-baseline', action='store_true', help='Store the results as the baseline')
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.only, args.sizes, args.repeats)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        # Keep the baseline of benchmarks which were not run this time
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print('Baseline written to {}'.format(args.baseline))
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print('NOT COMPARED: no baseline at {}, none of the results were checked for regressions. '
+              'Run with --save-baseline first.'.format(args.baseline))
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    for name in sorted(set(results) - set(baseline)):
+        print('NOT COMPARED {}: not in the baseline'.format(name))
+    regressions = compare(results, baseline)
+    for name, measure, old, new in regressions:
+        print('REGRESSION {} {}: {:.4g} -> {:.4g} ({:+.0%})'.format(name, measure, old, new, new / old - 1))
+    if not regressions:
+        compared = len(set(results) & set(baseline))
+        print('No regressions against {} in {} of {} benchmarks'.format(args.baseline, compared, len(results)))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
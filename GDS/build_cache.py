@@ -0,0 +1,156 @@
+"""
+On-disk cache of built device cells.
+
+Every device job (see design_space._build_device) is hashed from the component function
+name, its arguments, the device name and label, the constants in parameters.py, the source
+of every module which shapes a device cell (GEOMETRY_MODULES) and the versions of gdshelpers
+and shapely. The finished, polygonized device cell is pickled under that hash, so a rebuild
+only regenerates devices whose inputs changed.
+
+Entries are never overwritten, every change of the inputs adds new ones. BuildCache.prune
+keeps the directory below MAX_CACHE_BYTES by deleting the least recently used entries.
+"""
+
+import hashlib
+import importlib
+import os
+import pickle
+import tempfile
+
+import gdshelpers
+import shapely
+
+import parameters
+from components import share_cached_cells
+
+# Bump when the way a job is turned into a cell changes outside GEOMETRY_MODULES
+CACHE_VERSION = 2
+
+# Modules whose source decides the geometry of a built device: the components and everything
+# they place (labels, channel positions, port checks) and design_space._build_device itself
+GEOMETRY_MODULES = ('parameters', 'components', 'spiral_geometry', 'labels', 'fibre_array', 'port_alignment',
+                    'design_space')
+
+# Size the cache directory is pruned to, in bytes. A whole design space takes about 40 MB.
+MAX_CACHE_BYTES = 512 * 1024 ** 2
+
+
+def _parameters_fingerprint():
+    """
+    repr of every public constant in parameters.py, in a stable order.
+    """
+    constants = {key: value for key, value in vars(parameters).items()
+                 if not key.startswith('_') and isinstance(value, (int, float, str, tuple, list, dict))}
+    return repr(sorted(constants.items()))
+
+
+def _source_fingerprint():
+    """
+    Hash of the source of GEOMETRY_MODULES, so that changing any of them invalidates the cached devices.
+    """
+    digest = hashlib.sha256()
+    for name in GEOMETRY_MODULES:
+        with open(importlib.import_module(name).__file__, 'rb') as f:
+            digest.update(name.encode() + b'\0' + f.read())
+    return digest.hexdigest()
+
+
+class BuildCache:
+    """
+    Directory of pickled device cells, keyed on the inputs of the job which built them.
+    """
+
+    def __init__(self, directory):
+        """
+        :param directory: Directory holding the cache, created if needed
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._salt = '{}|{}|{}|{}|{}'.format(CACHE_VERSION, gdshelpers.__version__, shapely.__version__,
+                                             _parameters_fingerprint(), _source_fingerprint())
+        self.hits = 0
+        self.misses = 0
+        # Keys loaded or stored by this instance, which prune keeps
+        self._used = set()
+
+    def key(self, job):
+        """
+        :param job: Tuple of (component function, keyword arguments, device name, label text)
+        :return: Hex digest identifying the cell built by job
+        """
+        factory, kwargs, device_name, label = job
+        description = repr((factory.__name__, sorted(kwargs.items()), device_name, label))
+        return hashlib.sha256((self._salt + '|' + description).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def load(self, key):
+        """
+        :return: The cached cell for key, or None if it has not been built before
+        """
+        try:
+            with open(self._path(key), 'rb') as f:
+                cell = pickle.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception:
+            # Truncated, or pickled against classes which have since changed: drop it and build again
+            self.misses += 1
+            self._remove(key)
+            return None
+
+        self.hits += 1
+        self._used.add(key)
+        # The modification time marks the last use, for prune
+        os.utime(self._path(key))
+        # The gratings and glyphs in the pickle are copies, use the ones shared by the layout instead
+        return share_cached_cells(cell)
+
+    def store(self, key, cell):
+        """
+        Writes cell to the cache. The file is moved into place so a crash never leaves a partial entry.
+        """
+        with tempfile.NamedTemporaryFile('wb', dir=self.directory, delete=False) as tmp:
+            pickle.dump(cell, tmp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp.name, self._path(key))
+        self._used.add(key)
+
+    def _remove(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def prune(self, max_bytes=MAX_CACHE_BYTES):
+        """
+        Deletes the least recently used cells until the cache takes at most max_bytes.
+        Cells loaded or stored by this instance are kept, even beyond max_bytes.
+
+        :return: Number of deleted cells
+        """
+        entries = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.pkl'):
+                stat = os.stat(os.path.join(self.directory, filename))
+                entries.append((stat.st_mtime, stat.st_size, filename[:-len('.pkl')]))
+
+        total = sum(size for _, size, _ in entries)
+        deleted = 0
+        for _, size, key in sorted(entries):
+            if total <= max_bytes:
+                break
+            if key not in self._used:
+                self._remove(key)
+                total -= size
+                deleted += 1
+        return deleted
+
+    def clear(self):
+        """
+        Deletes every cached cell.
+        """
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.pkl'):
+                os.remove(os.path.join(self.directory, filename))
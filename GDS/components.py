@@ -1,16 +1,62 @@
 from math import pi
+import hashlib
+import warnings
 from gdshelpers.geometry.chip import Cell
 from gdshelpers.parts.waveguide import Waveguide
 from gdshelpers.parts.coupler import GratingCoupler
+from gdshelpers.parts.port import Port
 from gdshelpers.parts.spiral import Spiral
 from gdshelpers.parts.splitter import DirectionalCoupler
-from gdshelpers.parts.text import Text
 
 from parameters import *
+from port_alignment import TOLERANCE, pitch_error
+from fibre_array import mzi_output_channel, spiral_winding_channel
+from profiling import profiled
+from labels import add_label, clear_glyph_cells, share_glyph_cells
+from spiral_geometry import spiral_footprint, spiral_outer_radius
+
+# Unique grating cells built so far, keyed on their content-addressed name
+# (see _grating_cell_name). Each cell is drawn with its port at (0, 0).
+_GRATING_CELL_CACHE = {}
+
+
+def _grating_cell_name(coupler_params, angle):
+    """
+    Builds a cell name which is unique to a coupler parameter dict and coupler angle.
+    Floats are rounded to 9 decimals so numerically equal parameters share a cell.
+    """
+    def _normalise(value):
+        return round(float(value), 9) if isinstance(value, (float, np.floating)) else value
+
+    key = tuple(sorted((key, _normalise(value)) for key, value in coupler_params.items())) + (_normalise(angle),)
+    return "GC_period_{}_{}".format(coupler_params['grating_period'],
+                                    hashlib.sha1(repr(key).encode()).hexdigest()[:10])
+
+
+def share_cached_cells(cell):
+    """
+    Makes every grating and label glyph referenced by a device cell point at the single
+    cached instance of that cell, so that cells built in another process (and unpickled here)
+    do not add duplicate cell names to the layout.
+    :param cell: Device cell returned by one of the component functions
+    :return: The same cell
+    """
+    for ref in cell.cells:
+        name = ref['cell'].name
+        if name.startswith('GC_period_'):
+            ref['cell'] = _GRATING_CELL_CACHE.setdefault(name, ref['cell'])
+
+    return share_glyph_cells(cell)
+
+
+def clear_cached_cells():
+    """
+    Forgets the cached grating and glyph cells, so that the next devices build them again,
+    e.g. to time a device from scratch (see benchmark.py). Cells built before keep theirs.
+    """
+    _GRATING_CELL_CACHE.clear()
+    clear_glyph_cells()
 
-# Do not delete or change!
-# TODO: Find a less hacky fix SC
-CORNERSTONE_GRATING_IDENTIFIER = 0
 
 class CornerstoneGratingCoupler:
     """Class for linear grating coupler design
@@ -27,35 +73,47 @@ class CornerstoneGratingCoupler:
         self.port = None
         self.cell = None
 
+    @profiled
     def create_coupler(self, origin, coupler_params, name=None):
         """
         Function to create the Cornerstone compliant grating cell.
+
+        Each unique (coupler_params, angle) combination is built once at (0, 0) and shared
+        between all instances, so the returned cell must be placed with
+        ``parent.add_cell(grating.cell, origin=grating.origin)``.
         """
-        GC_proto = GratingCoupler.make_traditional_coupler(origin=origin,
-                                                           extra_triangle_layer=False,
-                                                           **coupler_params)
-        GC_proto_shape_obj = GC_proto.get_shapely_object()
-        GC_outline = GC_proto_shape_obj.convex_hull
-        GC_teeth = GratingCoupler.make_traditional_coupler(origin=origin,
-                                                           extra_triangle_layer=True,
-                                                           **teeth_coupler_parameters)
-        global CORNERSTONE_GRATING_IDENTIFIER
-        cell = Cell("GC_period_{}_coords_{}_{}_{}".format(coupler_params['grating_period'],
-                                                          origin[0],
-                                                          origin[1], CORNERSTONE_GRATING_IDENTIFIER))
-        CORNERSTONE_GRATING_IDENTIFIER += 1
-
-        # add outline to draw layer
-        cell.add_to_layer(WAVEGUIDE_LAYER, GC_outline)
-        cell.add_to_layer(GRATING_LAYER, GC_teeth)
-
-        self.cell = cell
-        self.port = GC_proto.port
+        params = dict(coupler_params)
+        angle = params.pop('angle', -pi / 2)
+        name = _grating_cell_name(params, angle)
+
+        if name not in _GRATING_CELL_CACHE:
+            GC_proto = GratingCoupler.make_traditional_coupler(origin=(0, 0),
+                                                               extra_triangle_layer=False,
+                                                               angle=angle,
+                                                               **params)
+            GC_proto_shape_obj = GC_proto.get_shapely_object()
+            GC_outline = GC_proto_shape_obj.convex_hull
+            GC_teeth = GratingCoupler.make_traditional_coupler(origin=(0, 0),
+                                                               extra_triangle_layer=True,
+                                                               **teeth_coupler_parameters)
+            cell = Cell(name)
+
+            # add outline to draw layer
+            cell.add_to_layer(WAVEGUIDE_LAYER, GC_outline)
+            cell.add_to_layer(GRATING_LAYER, GC_teeth)
+
+            _GRATING_CELL_CACHE[name] = cell
+
+        self.coupler_params = coupler_params
+        self.origin = (origin[0], origin[1])
+        self.cell = _GRATING_CELL_CACHE[name]
+        # Same as GratingCoupler.port, but for the translated coupler
+        self.port = Port(self.origin, angle, params['width']).inverted_direction
 
         return self
 
     @classmethod
-    def create_cornerstone_coupler_at_port(self, port, **kwargs):
+    def create_cornerstone_coupler_at_port(cls, port, **kwargs):
         """
         SC 20/01/22
         Make a grating coupler at a port.
@@ -67,7 +125,7 @@ class CornerstoneGratingCoupler:
         :type port: Port
         :param kwargs: Keyword arguments passed to :func:`make_traditional_coupler`.
         :return: The constructed traditional grating coupler.
-        :rtype: GratingCoupler
+        :rtype: CornerstoneGratingCoupler
         """
 
         if 'width' not in kwargs:
@@ -78,15 +136,16 @@ class CornerstoneGratingCoupler:
 
         coup_params = kwargs
 
-        return self.create_coupler(self,
-                                   origin=port.origin,
-                                   coupler_params=coup_params)
+        return cls().create_coupler(origin=port.origin,
+                                    coupler_params=coup_params)
 
 
 def grating_checker(gratings):
     """
     Utility function which checks that grating couplers are
     appropriately placed. SC 20/01/22.
+    Misplaced gratings raise a warning rather than printing; port_alignment.check_grating_alignment
+    reports every grating of a layout at once.
     :param gratings: List of all the gratings in the device
     :return: x_diff, y_diff so these can be used to adjust position of gratings
     """
@@ -94,15 +153,16 @@ def grating_checker(gratings):
     y_diff = np.around(gratings[0].port.origin[1], 9) - np.around(gratings[1].port.origin[1], 9)
     x_diff = np.around(gratings[0].port.origin[0], 9) - np.around(gratings[1].port.origin[0], 9)
 
-    if y_diff != 0:
-        print(" \n \n WARNING: The gratings being checked have a y separation of {}  \n \n ".format(y_diff))
-    if (np.abs(x_diff) % GRATING_PITCH) !=0:
-        print(" \n \n WARNING: The gratings being checked have a x separation of {}. Recommended is {} \n \n "
-              .format(np.abs(x_diff), GRATING_PITCH))
+    if np.abs(y_diff) > TOLERANCE:
+        warnings.warn('The gratings being checked have a y separation of {}'.format(y_diff), stacklevel=2)
+    if np.abs(pitch_error(x_diff)) > TOLERANCE:
+        warnings.warn('The gratings being checked have a x separation of {}. Recommended is {}'
+                      .format(np.abs(x_diff), GRATING_PITCH), stacklevel=2)
 
     return x_diff, y_diff
 
 
+@profiled
 def grating_coupler(coupler_parameters, position=(0, 0), name='grating_coupler'):
     """
     Function which returns a cell containing
@@ -117,10 +177,7 @@ def grating_coupler(coupler_parameters, position=(0, 0), name='grating_coupler')
     grating_coupler_cell = Cell(name)
 
     # Create Text
-    grating_coupler_cell.add_to_layer(LABEL_LAYER,
-                                     Text(origin=LABEL_ORIGIN, height=LABEL_HEIGHT,angle=LABEL_ANGLE_VERTICAL,
-                                          text=name)
-                                      )
+    add_label(grating_coupler_cell, name)
 
     # Create the left hand side grating
     left_grating = CornerstoneGratingCoupler().create_coupler(
@@ -128,7 +185,7 @@ def grating_coupler(coupler_parameters, position=(0, 0), name='grating_coupler')
         coupler_params=coupler_parameters)
 
     # Add the left grating coupler cell to our loopback cell
-    grating_coupler_cell.add_cell(left_grating.cell)
+    grating_coupler_cell.add_cell(left_grating.cell, origin=left_grating.origin)
 
     # Join our grating couplers together
     wg = Waveguide.make_at_port(port=left_grating.port)  # Create waveguide at the left grating port location
@@ -144,7 +201,7 @@ def grating_coupler(coupler_parameters, position=(0, 0), name='grating_coupler')
         port=wg.current_port,
         **coupler_parameters)
     # Add the right grating to the loopback cell
-    grating_coupler_cell.add_cell(right_grating.cell)
+    grating_coupler_cell.add_cell(right_grating.cell, origin=right_grating.origin)
 
     # Grating checker
     grating_checker([left_grating, right_grating])
@@ -152,16 +209,33 @@ def grating_coupler(coupler_parameters, position=(0, 0), name='grating_coupler')
     return grating_coupler_cell
 
 
+def spiral_bounds(port, number, gap_size, inner_gap_size):
+    """
+    Bounds of the Spiral which Spiral.make_at_port(port, ...) would create, without building it.
+    Matches the polygon bounds to a few nm for ports along the x or y axis and at least half
+    a turn, otherwise it is a box which contains the spiral.
+
+    :param port: Port at which the spiral starts
+    :return: (min_x, min_y, max_x, max_y), like shapely's bounds
+    """
+    across, along = spiral_footprint(number, gap_size, inner_gap_size, width=port.width)
+    centre = port.parallel_offset(-spiral_outer_radius(number, gap_size, inner_gap_size, port.width)).origin
+
+    c, s = np.abs(np.cos(port.angle)), np.abs(np.sin(port.angle))
+    half_x = (c * along + s * across) / 2
+    half_y = (s * along + c * across) / 2
+
+    return centre[0] - half_x, centre[1] - half_y, centre[0] + half_x, centre[1] + half_y
+
+
+@profiled
 def spiral_winding(coupler_parameters, number, gap_size, inner_gap_size, position=(0,0), name='SPIRAL'):
     # Create the cell
     spiral_winding_cell = Cell(name)
 
     # Create Text
-    spiral_winding_cell.add_to_layer(LABEL_LAYER,
-                                     Text(origin=LABEL_ORIGIN, height=LABEL_HEIGHT,angle=LABEL_ANGLE_VERTICAL,
-                                          text=name+'\nNo_loops_'+str(number)+'\nGapbetween_waveguides_'+str(gap_size)+
-                                          '\nInner_circle_radius_'+str(inner_gap_size))
-                                     )
+    add_label(spiral_winding_cell, name+'\nNo_loops_'+str(number)+'\nGapbetween_waveguides_'+str(gap_size)+
+              '\nInner_circle_radius_'+str(inner_gap_size))
 
     # Create the left hand side grating
     left_grating = CornerstoneGratingCoupler().create_coupler(origin=(position[0], position[1]),
@@ -174,20 +248,20 @@ def spiral_winding(coupler_parameters, number, gap_size, inner_gap_size, positio
 
     # Add the spiral
     spiral = Spiral.make_at_port(port=wg1.current_port, num=number, gap=gap_size, inner_gap=inner_gap_size)
-    spiral_length = spiral.length
-    spiral_obj = spiral.get_shapely_object()
-    spiral_size = abs(spiral_obj.bounds[1] - spiral_obj.bounds[3])
+    spiral_box = spiral_bounds(wg1.current_port, number, gap_size, inner_gap_size)
+    spiral_size = abs(spiral_box[1] - spiral_box[3])
+
+    # Output grating on the first fibre array channel clear of the spiral
+    channel = int(spiral_winding_channel(spiral_box[2] - position[0]))
+    if channel >= VGA_NUM_CHANNELS:
+        raise ValueError('The spiral of {} needs {} fibre array channels, there are {}'
+                         .format(name, channel + 1, VGA_NUM_CHANNELS))
 
     # Add waveguide at output
     wg2 = Waveguide.make_at_port(port=spiral.out_port)
     wg2.add_straight_segment(length=GRATING_TAPER_ROUTE)
     wg2.add_bend(angle=-pi, radius=BEND_RADIUS)
-
-    # Routing to the next multiple of 127
-    for j in range(VGA_NUM_CHANNELS):
-        if (spiral_size/2) < j * GRATING_PITCH:
-            wg2.add_straight_segment(length=j*GRATING_PITCH+GRATING_TAPER_ROUTE)
-            break
+    wg2.add_straight_segment(length=channel*GRATING_PITCH+GRATING_TAPER_ROUTE)
 
     # Add right hand bend
     wg2.add_bend(angle=-pi / 2, radius=BEND_RADIUS)
@@ -197,8 +271,8 @@ def spiral_winding(coupler_parameters, number, gap_size, inner_gap_size, positio
     right_grating = CornerstoneGratingCoupler().create_cornerstone_coupler_at_port(port=wg2.current_port,
                                                                                    **coupler_parameters, angle=wg2.angle)
 
-    spiral_winding_cell.add_cell(left_grating.cell)
-    spiral_winding_cell.add_cell(right_grating.cell)
+    spiral_winding_cell.add_cell(left_grating.cell, origin=left_grating.origin)
+    spiral_winding_cell.add_cell(right_grating.cell, origin=right_grating.origin)
     spiral_winding_cell.add_to_layer(WAVEGUIDE_LAYER, wg1)
     spiral_winding_cell.add_to_layer(WAVEGUIDE_LAYER, wg2)
     spiral_winding_cell.add_to_layer(WAVEGUIDE_LAYER, spiral)
@@ -210,6 +284,7 @@ def spiral_winding(coupler_parameters, number, gap_size, inner_gap_size, positio
 
 
 
+@profiled
 def asymmetric_spiral_mzi(coupler_parameters, coupling_length, coupling_gap, upper_spiral_no, lower_spiral_no, spiral_gap,
                           spiral_inner_gap, position=(0,0), name='ASYMMETRIC SPIRAL-ARM MZI'):
 
@@ -221,7 +296,7 @@ def asymmetric_spiral_mzi(coupler_parameters, coupling_length, coupling_gap, upp
                                                               coupler_params=coupler_parameters)
 
     # Create the second left hand side grating
-    left_grating2 = CornerstoneGratingCoupler().create_coupler(origin=(GRATING_PITCH, position[1]),
+    left_grating2 = CornerstoneGratingCoupler().create_coupler(origin=(position[0]+GRATING_PITCH, position[1]),
                                                               coupler_params=coupler_parameters)
 
     # Route the second left-hand grating coupler to DC
@@ -258,13 +333,9 @@ def asymmetric_spiral_mzi(coupler_parameters, coupling_length, coupling_gap, upp
 
     # Add the lower spiral
     low_spiral = Spiral.make_at_port(port=wg3.current_port.rotated(0), num=lower_spiral_no, gap=spiral_gap, inner_gap=spiral_inner_gap)
-    spiral_obj = low_spiral.get_shapely_object()
-    spiral_size = abs(spiral_obj.bounds[1] - spiral_obj.bounds[3])
 
     # Add the upper spiral
     high_spiral = Spiral.make_at_port(port=wg4.current_port.rotated(0), num=upper_spiral_no, gap=spiral_gap, inner_gap=spiral_inner_gap)
-    spiral_obj = high_spiral.get_shapely_object()
-    spiral_size = abs(spiral_obj.bounds[1] - spiral_obj.bounds[3])
 
     # Add waveguide at upper spiral output
     wg6 = Waveguide.make_at_port(port=high_spiral.out_port)
@@ -282,20 +353,26 @@ def asymmetric_spiral_mzi(coupler_parameters, coupling_length, coupling_gap, upp
     DC2 = DirectionalCoupler.make_at_port(port=wg5.current_port, length=coupling_length, gap=coupling_gap,
                                           bend_radius=BEND_RADIUS)
 
+    # Output gratings on the first two fibre array channels clear of the DC
+    channel = int(mzi_output_channel(DC2.right_ports[0].origin[0] - position[0]))
+    if channel + 1 >= VGA_NUM_CHANNELS:
+        raise ValueError('{} needs {} fibre array channels, there are {}'.format(name, channel + 2, VGA_NUM_CHANNELS))
+    output_x = position[0] + channel*GRATING_PITCH
+
     # Route the DC to first right-hand grating coupler
     wg7 = Waveguide.make_at_port(port=DC2.right_ports[0])
-    wg7.add_straight_segment_until_x(3*GRATING_PITCH-BEND_RADIUS)
+    wg7.add_straight_segment_until_x(output_x-BEND_RADIUS)
     wg7.add_bend(angle=-pi/2, radius=BEND_RADIUS)
     wg7.add_straight_segment(length=GRATING_TAPER_ROUTE)
 
     # Route the DC to the second right-hand grating coupler
     wg8 = Waveguide.make_at_port(port=DC2.right_ports[1])
-    wg8.add_straight_segment_until_x(4*GRATING_PITCH-BEND_RADIUS)
+    wg8.add_straight_segment_until_x(output_x+GRATING_PITCH-BEND_RADIUS)
     wg8.add_bend(angle=-pi/2, radius=BEND_RADIUS)
     wg8.add_straight_segment_until_y(wg7.current_port.origin[1])
 
     # Create the first right-hand grating coupler
-    right_grating1 = CornerstoneGratingCoupler().create_coupler(origin=((3*GRATING_PITCH), position[1]),
+    right_grating1 = CornerstoneGratingCoupler().create_coupler(origin=(output_x, position[1]),
                                                               coupler_params=coupler_parameters)
 
     # Create the second right-hand grating coupler
@@ -303,8 +380,8 @@ def asymmetric_spiral_mzi(coupler_parameters, coupling_length, coupling_gap, upp
                                                                                     **coupler_parameters, angle=wg8.angle)
 
     # Add sub-components to respective cell and layers
-    asymmetric_spiral_mzi_cell.add_cell(left_grating1.cell)
-    asymmetric_spiral_mzi_cell.add_cell(left_grating2.cell)
+    asymmetric_spiral_mzi_cell.add_cell(left_grating1.cell, origin=left_grating1.origin)
+    asymmetric_spiral_mzi_cell.add_cell(left_grating2.cell, origin=left_grating2.origin)
     asymmetric_spiral_mzi_cell.add_to_layer(WAVEGUIDE_LAYER, wg1)
     asymmetric_spiral_mzi_cell.add_to_layer(WAVEGUIDE_LAYER, wg2)
     asymmetric_spiral_mzi_cell.add_to_layer(WAVEGUIDE_LAYER, DC)
@@ -317,8 +394,8 @@ def asymmetric_spiral_mzi(coupler_parameters, coupling_length, coupling_gap, upp
     asymmetric_spiral_mzi_cell.add_to_layer(WAVEGUIDE_LAYER, wg6)
     asymmetric_spiral_mzi_cell.add_to_layer(WAVEGUIDE_LAYER, wg7)
     asymmetric_spiral_mzi_cell.add_to_layer(WAVEGUIDE_LAYER, wg8)
-    asymmetric_spiral_mzi_cell.add_cell(right_grating1.cell)
-    asymmetric_spiral_mzi_cell.add_cell(right_grating2.cell)
+    asymmetric_spiral_mzi_cell.add_cell(right_grating1.cell, origin=right_grating1.origin)
+    asymmetric_spiral_mzi_cell.add_cell(right_grating2.cell, origin=right_grating2.origin)
 
     # Grating checker
     grating_checker([left_grating1, left_grating2])
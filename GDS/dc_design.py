@@ -0,0 +1,200 @@
+"""
+Directional coupler lengths and gaps for a target split ratio.
+
+A coupler crosses sin(kappa * (L + L_bend))**2 of the power, kappa = pi * delta_n / wavelength (see
+mzi_model.dc_coupling_phase), so the straight coupling length for a split ratio r at a given gap is
+
+    L = arcsin(sqrt(r)) * wavelength / (pi * delta_n(gap)) - L_bend(gap)
+
+which is solved for all gaps of a sweep at once. delta_n comes from a ModeTable (see mode_table.py)
+if one is given, from the analytic model of mzi_model otherwise. For a given length, the gap is found
+by bisection on all couplers at the same time, as the length above grows monotonically with the gap.
+
+dc_sweep_rows writes sweep rows (see sweeps.py) of coupler sweeps for several stacks or split ratios,
+bracketing the nominal stack like the hand-tuned DC sweep rows of grating_sweep.json.
+
+Usage:
+    python dc_design.py [--table DIR] [--wavelength L] lengths gap [gap ...] [--split R] [--etch-depth D]
+                        [--si-thickness T]
+    python dc_design.py [--table DIR] [--wavelength L] sweep out.json --gaps START STOP STEP
+                        --stack T D [--stack T D ...] [--split R ...]
+"""
+
+import argparse
+import json
+
+import numpy as np
+
+from mzi_model import bend_coupling_length, supermode_index_difference
+from parameters import *
+
+# Gap range searched by coupling_gaps without a mode table
+GAP_RANGE = (0.05, 1.0)
+
+# Bisection steps of coupling_gaps, which narrow the gap range to below 1e-12 um
+BISECTION_STEPS = 40
+
+# Template of the rows written by dc_sweep_rows
+DC_ROW = {
+    'device': 'asymmetric_spiral_mzi',
+    'name': 'JMO_YTY_DC_sweep_Si_{si_nm}nm_etch_{etch_nm}nm{split_tag}_{{i}}',
+    'label': '{name}\nDC_Length_{coupling_length}um Gap_{coupling_gap}um',
+    'fixed': {'upper_spiral_no': 3, 'lower_spiral_no': 1, 'spiral_gap': 5, 'spiral_inner_gap': 8.3},
+}
+
+
+def _stack_values(etch_depth, si_thickness, wavelength, table):
+    """
+    Stack values of a query, where None means the only value of the table or the default of parameters.py.
+    """
+    if table is not None:
+        return table.query_values(etch_depth, si_thickness, wavelength)
+    return {'etch_depth': ETCH_DEPTH if etch_depth is None else etch_depth,
+            'si_thickness': SI_THICKNESS if si_thickness is None else si_thickness,
+            'wavelength': WAVELENGTH if wavelength is None else wavelength}
+
+
+def _coupling_lengths(gaps, split, values, table):
+    """
+    coupling_lengths without the check, negative where the bends alone couple more than split.
+    """
+    if table is None:
+        delta_n = supermode_index_difference(gaps, values['wavelength'], values['etch_depth'], values['si_thickness'])
+        decay_length = DC_DECAY_LENGTH
+    else:
+        delta_n = table.delta_n(gaps, **values)
+        decay_length = table.decay_length(gaps, **values)
+    coupled_length = np.arcsin(np.sqrt(split)) * values['wavelength'] / (np.pi * delta_n)
+    return coupled_length - bend_coupling_length(decay_length=decay_length)
+
+
+def coupling_lengths(gaps, split=0.5, etch_depth=None, si_thickness=None, wavelength=None, table=None):
+    """
+    Straight coupling lengths of DirectionalCouplers which split as given. All arguments but table
+    broadcast against each other.
+
+    :param gaps: Coupling gaps
+    :param split: Fraction of the power coupled across, between 0 and 1
+    :param etch_depth: Etch depth, see ModeTable.supermode_indices
+    :param si_thickness: Si thickness
+    :param wavelength: Wavelength
+    :param table: ModeTable, the analytic model of mzi_model if None
+    :return: Coupling lengths
+    :raises ValueError: If the bends alone couple at least the split ratio at a gap, so that no
+        positive length splits as given
+    """
+    split = np.asarray(split, dtype=float)
+    if np.any((split < 0) | (split > 1)):
+        raise ValueError('Split ratios must be between 0 and 1')
+    lengths = _coupling_lengths(gaps, split, _stack_values(etch_depth, si_thickness, wavelength, table), table)
+
+    too_short = lengths <= 0
+    if np.any(too_short):
+        gap, ratio = [np.broadcast_to(np.asarray(value, dtype=float), lengths.shape)[too_short][0]
+                      for value in (gaps, split)]
+        raise ValueError('No positive coupling length splits {:g} at a gap of {:g} um, the bends alone couple '
+                         'as much ({} of {} couplers)'.format(ratio, gap, np.count_nonzero(too_short), too_short.size))
+    return lengths
+
+
+def coupling_gaps(lengths, split=0.5, etch_depth=None, si_thickness=None, wavelength=None, table=None):
+    """
+    Coupling gaps of DirectionalCouplers of the given straight lengths which split as given, the
+    inverse of coupling_lengths. Lengths which need a gap outside of the mode table, or of GAP_RANGE
+    without a table, give NaN.
+
+    :return: Coupling gaps, broadcast over all arguments but table
+    """
+    lengths, split = np.broadcast_arrays(np.asarray(lengths, dtype=float), np.asarray(split, dtype=float))
+    values = _stack_values(etch_depth, si_thickness, wavelength, table)
+    shape = np.broadcast(lengths, *[np.asarray(value) for value in values.values()]).shape
+    low, high = (GAP_RANGE if table is None else (table.axes['gap'][0], table.axes['gap'][-1]))
+    low, high = np.full(shape, float(low)), np.full(shape, float(high))
+
+    def excess(gap):
+        return _coupling_lengths(gap, split, values, table) - lengths
+
+    solvable = (excess(low) <= 0) & (excess(high) >= 0)
+    for _ in range(BISECTION_STEPS):
+        middle = (low + high) / 2
+        longer = excess(middle) > 0
+        high = np.where(longer, middle, high)
+        low = np.where(longer, low, middle)
+    return np.where(solvable, (low + high) / 2, np.nan)
+
+
+def dc_sweep_rows(gaps, stacks, splits=(0.5,), wavelength=None, table=None, decimals=1, template=DC_ROW):
+    """
+    Sweep rows of couplers over the given gaps, one per stack and split ratio, with the coupling
+    lengths of all rows from one coupling_lengths call.
+
+    :param gaps: Coupling gaps of every row
+    :param stacks: List of (Si thickness, etch depth)
+    :param splits: Target split ratios
+    :param wavelength: Design wavelength, WAVELENGTH by default
+    :param table: ModeTable, the analytic model of mzi_model if None
+    :param decimals: Decimals of the coupling lengths, 1 as in the hand-tuned rows
+    :param template: Row template, its name is formatted with si_nm, etch_nm and split_tag
+    :return: List of sweep rows
+    """
+    gaps = np.asarray(gaps, dtype=float)
+    si_thickness, etch_depth = np.array(stacks, dtype=float).reshape(-1, 2).T
+    splits = np.asarray(splits, dtype=float)
+    lengths = coupling_lengths(gaps, splits[:, np.newaxis, np.newaxis], etch_depth[:, np.newaxis],
+                               si_thickness[:, np.newaxis], wavelength, table)
+
+    rows = []
+    for split, split_lengths in zip(splits, lengths):
+        split_tag = '' if len(splits) == 1 else '_split_{}'.format(int(round(100 * split)))
+        for t, d, row_lengths in zip(si_thickness, etch_depth, split_lengths):
+            row = json.loads(json.dumps(template))
+            row['name'] = row['name'].format(si_nm=int(round(1e3 * t)), etch_nm=int(round(1e3 * d)),
+                                             split_tag=split_tag)
+            row['stack'] = {'etch_depth': round(float(d), 9), 'si_thickness': round(float(t), 9)}
+            row['sweep'] = {'mode': 'zip', 'parameters': {
+                'coupling_length': [round(float(length), decimals) for length in row_lengths],
+                'coupling_gap': [round(float(gap), 9) for gap in gaps]}}
+            rows.append(row)
+    return rows
+
+
+def main(argv=None):
+    from mode_table import load_table
+
+    parser = argparse.ArgumentParser(description='Directional couplers for a target split ratio')
+    parser.add_argument('--table', help='ModeTable directory, the analytic model if not given')
+    parser.add_argument('--wavelength', type=float)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    lengths = commands.add_parser('lengths', help='Coupling lengths of the given gaps')
+    lengths.add_argument('gap', type=float, nargs='+', help='Coupling gaps')
+    lengths.add_argument('--split', type=float, default=0.5)
+    lengths.add_argument('--etch-depth', type=float)
+    lengths.add_argument('--si-thickness', type=float)
+
+    sweep = commands.add_parser('sweep', help='Write a sweep file of coupler rows')
+    sweep.add_argument('output', help='JSON sweep file to write')
+    sweep.add_argument('--gaps', type=float, nargs=3, required=True, metavar=('START', 'STOP', 'STEP'),
+                       help='Gap range, including STOP')
+    sweep.add_argument('--stack', type=float, nargs=2, action='append', required=True,
+                       metavar=('SI_THICKNESS', 'ETCH_DEPTH'), help='Stack of a row, can be repeated')
+    sweep.add_argument('--split', type=float, nargs='+', default=[0.5], help='Split ratios')
+    sweep.add_argument('--decimals', type=int, default=1)
+
+    args = parser.parse_args(argv)
+    table = None if args.table is None else load_table(args.table)
+    if args.command == 'lengths':
+        values = coupling_lengths(args.gap, args.split, args.etch_depth, args.si_thickness, args.wavelength, table)
+        for gap, value in zip(args.gap, values):
+            print('gap {:.3f} um: {:.3f} um'.format(gap, value))
+    else:
+        start, stop, step = args.gaps
+        gaps = np.round(start + step * np.arange(int(round((stop - start) / step)) + 1), 9)
+        rows = dc_sweep_rows(gaps, args.stack, args.split, args.wavelength, table, args.decimals)
+        with open(args.output, 'w') as f:
+            json.dump({'rows': rows}, f, indent=2)
+        print('{} rows of {} couplers written to {}'.format(len(rows), len(gaps), args.output))
+
+
+if __name__ == '__main__':
+    main()
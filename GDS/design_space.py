@@ -3,17 +3,32 @@ JieQing MO, Tung Yan YEUNG
 2023-24 University of Bristol - MSc Optoelectronic and Quantum Technologies
 EENGM0026 Nanofabrication for Quantum Engineering
 
-This is the main file to compile the program
+This is the main file to compile the program, as a library (build) or from the command line.
+The geometry libraries are only imported once something is built, so listing the devices of
+a sweep takes a fraction of a second.
+
+Usage:
+    python design_space.py [sweep_file] [-o FILE] [--rows PATTERN ...] [--devices PATTERN ...]
+                           [--list] [--parallel] [--workers N] [--cache-dir DIR | --no-cache] [--stream]
+                           [--grating-report CSV] [--drc-report CSV] [--ebeam-report CSV]
+
+Patterns are shell-style, e.g. --rows "*etch_120nm*" 3 --devices "*_DC_sweep_*_1?". A row
+matches by its index, name template or row_label, see sweeps.py.
 """
 
-from shapely.geometry import Polygon
-from gdshelpers.layout import GridLayout
+import argparse
+import os
+import sys
+from collections import deque
+from contextlib import nullcontext
 
-from components import *
 from parameters import *
+from sweeps import iter_sweep_devices, iter_sweep_jobs, load_sweep
+from profiling import stage
 
-# Path where you want your GDS to be saved to
-savepath = r"./"
+# File the GDS is saved to, and the directory of the build cache of the command line
+GDS_FILE = 'JMO_YTY_Nanofab_2024_UoB.gds'
+BUILD_CACHE_DIR = '.build_cache'
 
 
 def generate_blank_gds(d_height=3000,
@@ -22,6 +37,9 @@ def generate_blank_gds(d_height=3000,
     Function which creates the appropriately sized blank design space.
     :return:
     """
+    from shapely.geometry import Polygon
+    from gdshelpers.layout import GridLayout
+
     # Define a design bounding box as a guide for our eyes
     outer_corners = [(0, 0), (d_width, 0), (d_width, d_height), (0, d_height)]
     polygon = Polygon(outer_corners)
@@ -42,163 +60,348 @@ def generate_blank_gds(d_height=3000,
     return layout, polygon
 
 
-def grating_sweep(layout_cell):
+# Sweep file describing the devices placed by grating_sweep
+GRATING_SWEEP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'grating_sweep.json')
+
+
+def _build_device(job):
     """
-    Function which takes a layout cell as an argument
-    and adds a sweep of grating coupler loopbacks
-    with different periods.
-    """
-
-    # ============================================================================================
-    # for spiral gap sweep
-    # initialize parameters
-    dc_length = 13.8
-    dc_gap = 0.3
-    up_no = 1
-    low_no = 1
-    gap_size = 5
-    inner_gap_size = 5
-
-    # for each period create a grating loop back and add to the loopback row
-    for i in range(11):
-        device_name = 'JMO_YTY_Spiral_gap_sweep_' + str(i)
-        asymmetric_spiral_mzi_loopback = asymmetric_spiral_mzi(coupler_parameters, dc_length, dc_gap, up_no, low_no,
-                                                               gap_size, inner_gap_size, name=device_name)
+    Builds a single labelled device. This lives at module level so that
+    it can be sent to worker processes.
+    :param job: Tuple of (component function, keyword arguments, device name, label text or None)
+    :return: The device cell
+    """
+    from labels import add_label
 
-        # Create Label
-        asymmetric_spiral_mzi_loopback.add_to_layer(LABEL_LAYER, Text(origin=LABEL_ORIGIN, height=LABEL_HEIGHT,
-                                                     angle=LABEL_ANGLE_VERTICAL,
-                                                     text=device_name + '\nSpiral_Up_Loop_'
-                                                          + str(up_no) + 'Low_Loop_'
-                                                          + str(low_no)))
-
-        layout_cell.add_to_row(asymmetric_spiral_mzi_loopback)
-        up_no += 0.5
-
-    # ============================================================================================
-    # for spiral inner gap sweep
-    # add a new row in the layout cell
-    layout_cell.begin_new_row()
-
-    up_no = 5
-    inner_gap_size = 5
-    # for each period create a grating loop back and add to the loopback row
-    for i in range(11):
-        device_name = 'JMO_YTY_Spiral_inner_gap_sweep_' + str(i)
-        asymmetric_spiral_mzi_loopback = asymmetric_spiral_mzi(coupler_parameters, dc_length, dc_gap, up_no, low_no,
-                                                               gap_size, inner_gap_size, name=device_name)
+    factory, kwargs, device_name, label = job
+    with stage('build_device', device=device_name):
+        device = factory(name=device_name, **kwargs)
 
         # Create Label
-        asymmetric_spiral_mzi_loopback.add_to_layer(LABEL_LAYER, Text(origin=LABEL_ORIGIN, height=LABEL_HEIGHT,
-                                                     angle=LABEL_ANGLE_VERTICAL,
-                                                     text=device_name + '\nSpiral_inner_gap_'
-                                                          + str(round(inner_gap_size, 3)) + 'um'))
-
-        layout_cell.add_to_row(asymmetric_spiral_mzi_loopback)
-        inner_gap_size += 0.3
-
-    # ============================================================================================
-    # for DC sweep with silicon lay = 220nm ; etching depth 110nm
-    layout_cell.begin_new_row()
-
-    up_no = 3
-    dc_lengths = [10.3, 10.4, 10.5, 10.6, 10.7, 10.9, 11.5, 11.6, 11.7, 11.9, 12.0]
-    dc_gaps = [0.290, 0.292, 0.294, 0.296, 0.298, 0.300, 0.302, 0.304, 0.306, 0.308, 0.310]
-
-    for i in range(len(dc_lengths)):
-        device_name = 'JMO_YTY_DC_sweep_Si_220nm_etch_110nm_' + str(i)
-        asymmetric_spiral_mzi_loopback = asymmetric_spiral_mzi(coupler_parameters, dc_lengths[i], dc_gaps[i], up_no, low_no,
-                                                               gap_size, inner_gap_size, name=device_name)
-        # Create Label
-        asymmetric_spiral_mzi_loopback.add_to_layer(LABEL_LAYER, Text(origin=LABEL_ORIGIN, height=LABEL_HEIGHT,
-                                                     angle=LABEL_ANGLE_VERTICAL,
-                                                     text=device_name + '\nDC_Length_' + str(dc_lengths[i]) + 'um Gap_'
-                                                          + str(dc_gaps[i]) + 'um'))
-        layout_cell.add_to_row(asymmetric_spiral_mzi_loopback)
-
-    # ============================================================================================
-    # for DC sweep with silicon lay = 220nm ; etching depth 120nm
-    layout_cell.begin_new_row()
-
-    dc_lengths = [11.5, 11.6, 11.7, 11.8, 11.9, 12.2, 12.8, 13.0, 13.1, 13.3, 13.4]
-
-    for i in range(len(dc_lengths)):
-        device_name = 'JMO_YTY_DC_sweep_Si_220nm_etch_120nm_' + str(i)
-        asymmetric_spiral_mzi_loopback = asymmetric_spiral_mzi(coupler_parameters, dc_lengths[i], dc_gaps[i], up_no, low_no,
-                                                               gap_size, inner_gap_size, name=device_name)
-        # Create Label
-        asymmetric_spiral_mzi_loopback.add_to_layer(LABEL_LAYER, Text(origin=LABEL_ORIGIN, height=LABEL_HEIGHT,
-                                                     angle=LABEL_ANGLE_VERTICAL,
-                                                     text=device_name + '\nDC_Length_' + str(dc_lengths[i]) + 'um Gap_'
-                                                          + str(dc_gaps[i]) + 'um'))
-        layout_cell.add_to_row(asymmetric_spiral_mzi_loopback)
-
-    # ============================================================================================
-    # for DC sweep with silicon lay = 220nm ; etching depth 130nm
-    layout_cell.begin_new_row()
-
-    dc_lengths = [13.0, 13.1, 13.2, 13.3, 13.5, 13.8, 14.5, 14.7, 15.0, 15.2, 15.3]
-
-    for i in range(len(dc_lengths)):
-        device_name = 'JMO_YTY_DC_sweep_Si_220nm_etch_130nm_' + str(i)
-        asymmetric_spiral_mzi_loopback = asymmetric_spiral_mzi(coupler_parameters, dc_lengths[i], dc_gaps[i], up_no, low_no,
-                                                               gap_size, inner_gap_size, name=device_name)
-        # Create Label
-        asymmetric_spiral_mzi_loopback.add_to_layer(LABEL_LAYER, Text(origin=LABEL_ORIGIN, height=LABEL_HEIGHT,
-                                                     angle=LABEL_ANGLE_VERTICAL,
-                                                     text=device_name + '\nDC_Length_' + str(dc_lengths[i]) + 'um Gap_'
-                                                          + str(dc_gaps[i]) + 'um'))
-        layout_cell.add_to_row(asymmetric_spiral_mzi_loopback)
-
-    # ============================================================================================
-    # for DC sweep with silicon lay = 240nm ; etching depth 130nm
-    layout_cell.begin_new_row()
-
-    dc_lengths = [12.1, 12.2, 12.3, 12.4, 12.6, 12.9, 13.4, 13.6, 13.8, 14.0, 14.2]
-    dc_gaps = [0.290, 0.292, 0.294, 0.296, 0.298, 0.300, 0.302, 0.304, 0.306, 0.308, 0.310]
-
-    for i in range(len(dc_lengths)):
-        device_name = 'JMO_YTY_DC_sweep_Si_240nm_etch_130nm_' + str(i)
-        asymmetric_spiral_mzi_loopback = asymmetric_spiral_mzi(coupler_parameters, dc_lengths[i], dc_gaps[i], up_no, low_no,
-                                                               gap_size, inner_gap_size, name=device_name)
-        # Create Label
-        asymmetric_spiral_mzi_loopback.add_to_layer(LABEL_LAYER, Text(origin=LABEL_ORIGIN, height=LABEL_HEIGHT,
-                                                     angle=LABEL_ANGLE_VERTICAL,
-                                                     text=device_name + '\nDC_Length_' + str(dc_lengths[i]) + 'um Gap_'
-                                                          + str(dc_gaps[i]) + 'um'))
-        layout_cell.add_to_row(asymmetric_spiral_mzi_loopback)
+        if label:
+            add_label(device, label)
+
+        # Polygonize the parts here, once, and cache the bounds, so that neither
+        # GridLayout nor save() has to repeat the work (in the main process)
+        for layer, geometries in device.layer_dict.items():
+            device.layer_dict[layer] = [geometry.get_shapely_object() if hasattr(geometry, 'get_shapely_object')
+                                        else geometry for geometry in geometries]
+        device.bounds
+
+    return device
+
+
+def build_devices(jobs, parallel=False, max_workers=None, cache=None):
+    """
+    Generator which builds the device cells described by jobs, in the order of jobs.
+    Jobs are only taken from the iterable shortly before they are needed.
+
+    :param jobs: Iterable of jobs as taken by _build_device
+    :param parallel: Build the devices in a pool of worker processes
+    :param max_workers: If parallel is True, limits the number of worker processes
+    :param cache: Optional BuildCache. Cached devices are loaded instead of built,
+        newly built devices are added to it
+    :return: Device cells, in the same order as jobs
+    """
+    from gdshelpers.geometry.chip import Cell
+    from components import share_cached_cells
+
+    if parallel:
+        from concurrent.futures import ProcessPoolExecutor
+        pool = ProcessPoolExecutor(max_workers=max_workers)
+        # Keep a bounded number of devices in flight, so long sweeps are not all submitted at once
+        max_in_flight = 4 * (max_workers or os.cpu_count() or 1)
+    else:
+        pool = None
+        max_in_flight = 1
+
+    # (cache key or None, device cell or future) of every job which has not been yielded yet
+    in_flight = deque()
+
+    def finish_next():
+        key, device = in_flight.popleft()
+        if not isinstance(device, Cell):
+            # Swap the unpickled grating and glyph copies for the ones shared by the whole layout
+            device = share_cached_cells(device.result())
+        if key is not None:
+            with stage('cache_store'):
+                cache.store(key, device)
+        return device
+
+    with pool or nullcontext():
+        for job in jobs:
+            key = cache.key(job) if cache is not None else None
+            with stage('cache_load'):
+                device = cache.load(key) if key is not None else None
+            if device is not None:
+                in_flight.append((None, device))
+            elif pool is None:
+                in_flight.append((key, _build_device(job)))
+            else:
+                in_flight.append((key, pool.submit(_build_device, job)))
+
+            if len(in_flight) >= max_in_flight:
+                yield finish_next()
+
+        while in_flight:
+            yield finish_next()
+
+
+def add_sweep_to_layout(layout_cell, spec, parallel=False, max_workers=None, cache=None, writer=None, rows=None,
+                        devices=None):
+    """
+    Builds the devices of a sweep description and adds them to the layout, one row per sweep row.
+    Jobs are generated lazily and every device goes to the layout as soon as it is built, rows
+    with a "fibre_array" entry go as cells of devices which share a fibre array (see fibre_array.py).
+
+    :param layout_cell: The layout cell
+    :param spec: Sweep description, see sweeps.py
+    :param parallel: Build the devices in a pool of worker processes.
+        The devices are placed in the same order as in a serial build.
+    :param max_workers: If parallel is True, limits the number of worker processes
+    :param cache: Optional BuildCache, only devices whose inputs changed are rebuilt
+    :param writer: Optional StreamingGDSWriter. Each device is written as soon as it is built
+        and only a geometry-free stand-in is kept in the layout
+    :param rows: Optional row patterns, only the matching rows are built (see sweeps.iter_sweep_devices)
+    :param devices: Optional device name patterns, only the matching devices are built
+    :return: The layout cell
+    """
+    from fibre_array import FibreArrayCells, row_fibre_array
+
+    # Row index of every job handed to build_devices which has not come back yet
+    pending_rows = deque()
+
+    def jobs():
+        for row_id, job in iter_sweep_jobs(spec, rows, devices):
+            pending_rows.append(row_id)
+            yield job
+
+    def place(cell):
+        if writer is not None:
+            with stage('write_cell'):
+                cell = writer.write_cell(cell)
+        layout_cell.add_to_row(cell)
+
+    def finish_arrays():
+        cell = arrays.finish() if arrays is not None else None
+        if cell is not None:
+            place(cell)
+
+    current_row = None
+    arrays = None
+    for device in build_devices(jobs(), parallel=parallel, max_workers=max_workers, cache=cache):
+        row_id = pending_rows.popleft()
+        if row_id != current_row:
+            finish_arrays()
+            layout_cell.begin_new_row(spec['rows'][row_id].get('row_label'))
+            current_row = row_id
+            settings = row_fibre_array(spec['rows'][row_id], row_id)
+            arrays = None if settings is None else FibreArrayCells(settings[0], **settings[1])
+
+        if arrays is not None:
+            # Devices of the row share fibre arrays, the array cells go to the layout once full
+            device = arrays.add(device)
+            if device is None:
+                continue
+        place(device)
+
+    finish_arrays()
 
     return layout_cell
 
 
-def populate_gds(layout_cell, polygon):
+def grating_sweep(layout_cell, sweep_file=GRATING_SWEEP_FILE, parallel=False, max_workers=None, cache=None,
+                  writer=None, rows=None, devices=None):
+    """
+    Function which takes a layout cell as an argument
+    and adds the sweep of asymmetric spiral MZIs described in sweep_file
+    (spiral gap, spiral inner gap and directional coupler sweeps).
+
+    :param sweep_file: JSON/YAML/CSV sweep description, see sweeps.py
+    :param parallel: Build the devices in a pool of worker processes.
+        The devices are placed in the same order as in a serial build.
+    :param max_workers: If parallel is True, limits the number of worker processes
+    :param cache: Optional BuildCache, only devices whose inputs changed are rebuilt
+    :param writer: Optional StreamingGDSWriter, see add_sweep_to_layout
+    :param rows: Optional row patterns, see add_sweep_to_layout
+    :param devices: Optional device name patterns, see add_sweep_to_layout
+    """
+    return add_sweep_to_layout(layout_cell, load_sweep(sweep_file), parallel=parallel, max_workers=max_workers,
+                               cache=cache, writer=writer, rows=rows, devices=devices)
+
+
+def estimate_write_time(design_space_cell, ebeam_report, sweep_file=GRATING_SWEEP_FILE, rows=None, devices=None):
+    """
+    Estimates the e-beam write time of every device in a populated design space (see ebeam.py)
+    and writes the estimates to a CSV file.
+
+    :param ebeam_report: CSV file for the estimates
+    :param sweep_file: Sweep description the design space was built from, for the rows of the devices
+    :param rows: Row patterns the design space was built with
+    :param devices: Device name patterns the design space was built with
+    :return: Human readable write times per row and the vertex-heavy cells
+    """
+    from ebeam import WriteTimeEstimator, format_summary, write_estimates_csv
+
+    spec = load_sweep(sweep_file)
+    device_rows = {name: row_id for row_id, _, name, _ in iter_sweep_devices(spec, rows, devices)}
+    with stage('ebeam'):
+        estimator = WriteTimeEstimator()
+        estimates = estimator.estimate_layout(design_space_cell, device_rows)
+        heavy = estimator.heavy_cells(design_space_cell)
+    write_estimates_csv(estimates, ebeam_report)
+    return format_summary(estimates, heavy, spec)
+
+
+def populate_gds(layout_cell, polygon, parallel=False, max_workers=None, cache_dir=None, stream=False,
+                 grating_report=None, drc_report=None, sweep_file=GRATING_SWEEP_FILE, gds_file=GDS_FILE, rows=None,
+                 devices=None, ebeam_report=None):
     """
     Function which takes in the blank design space and populates it
 
     :param polygon: Shape of bounding box
     :param layout_cell: The blank layout cell
+    :param parallel: Build the devices in a pool of worker processes
+    :param max_workers: If parallel is True, limits the number of worker processes
+    :param cache_dir: If given, built devices are cached in this directory and
+        only devices whose parameters changed are rebuilt on the next run. Afterwards the least
+        recently used entries are pruned, see BuildCache.prune.
+    :param stream: Write every device to the GDS file as soon as it is placed and free it,
+        so peak memory scales with the largest device rather than the whole design space.
+        The returned cell then only holds references to geometry-free stand-ins.
+    :param grating_report: If given, the grating positions of all devices are checked and
+        the problems are written to this CSV file. Not available with stream=True.
+    :param drc_report: If given, the layout is checked against the design rules (see drc.py) and
+        the violations are written to this CSV file. Not available with stream=True.
+    :param sweep_file: Sweep description of the devices, see sweeps.py
+    :param gds_file: Path the GDS is saved to
+    :param rows: Optional row patterns, only the matching rows are built (see sweeps.iter_sweep_devices)
+    :param devices: Optional device name patterns, only the matching devices are built
+    :param ebeam_report: If given, the e-beam write time of every device is estimated (see
+        estimate_write_time) and written to this CSV file. Not available with stream=True.
     :return: Populated design space
     """
+    from build_cache import BuildCache
+    from gds_stream import StreamingGDSWriter, save_gds
+
+    if stream and (grating_report or drc_report or ebeam_report):
+        raise ValueError('Streamed layouts can not be checked, the written devices are freed')
+
+    cache = BuildCache(cache_dir) if cache_dir else None
+
+    with StreamingGDSWriter(gds_file) if stream else nullcontext() as writer:
+        # Stamp out devices, every sweep row starts a new row in the layout cell
+        with stage('grating_sweep'):
+            layout_cell = grating_sweep(layout_cell, sweep_file=sweep_file, parallel=parallel,
+                                        max_workers=max_workers, cache=cache, writer=writer, rows=rows,
+                                        devices=devices)
+
+        # Generate the design space populated with the devices
+        with stage('generate_layout'):
+            design_space_cell, mapping = layout_cell.generate_layout(cell_name='Cell0_JMO_YTY_Nanofab_2024_UoB')
+
+        # Add our bounding box
+        design_space_cell.add_to_layer(CELL_OUTLINE_LAYER, polygon)
+
+        # Check all grating positions at once
+        if grating_report:
+            from port_alignment import check_grating_alignment, write_report_csv
+            with stage('grating_report'):
+                report = check_grating_alignment(design_space_cell)
+            write_report_csv(report, grating_report)
+            if report:
+                print('{} grating placement problems, see {}'.format(len(report), grating_report))
+
+        # Design rule check, every unique cell is checked once
+        if drc_report:
+            from drc import DesignRuleChecker, write_violations_csv
+            with stage('drc'):
+                violations = DesignRuleChecker().check_layout(design_space_cell)
+            write_violations_csv(violations, drc_report)
+            if violations:
+                print('{} design rule violations, see {}'.format(len(violations), drc_report))
+
+        # Fracture and write time, every unique cell is fractured once
+        if ebeam_report:
+            estimate_write_time(design_space_cell, ebeam_report, sweep_file, rows, devices)
+
+        # Save our GDS
+        with stage('save'):
+            if stream:
+                writer.close(design_space_cell)
+            else:
+                save_gds(design_space_cell, gds_file)
+        # design_space_cell.show()
+
+    if cache is not None:
+        cache.prune()
 
-    # Add a new row to the layout cell and stamp out devices
-    layout_cell.begin_new_row()
-    layout_cell = grating_sweep(layout_cell)
-
-    # Generate the design space populated with the devices
-    design_space_cell, mapping = layout_cell.generate_layout(cell_name='Cell0_JMO_YTY_Nanofab_2024_UoB')
-
-    # Add our bounding box
-    design_space_cell.add_to_layer(CELL_OUTLINE_LAYER, polygon)
+    return design_space_cell
 
-    # Save our GDS
-    design_space_cell.save('{0}JMO_YTY_Nanofab_2024_UoB.gds'.format(savepath))
-    # design_space_cell.show()
 
-    return design_space_cell
+def build(sweep_file=GRATING_SWEEP_FILE, gds_file=GDS_FILE, rows=None, devices=None, **kwargs):
+    """
+    Builds the design space of a sweep and saves it.
 
+    :param sweep_file: Sweep description of the devices, see sweeps.py
+    :param gds_file: Path the GDS is saved to
+    :param rows: Optional row patterns, only the matching rows are built (see sweeps.iter_sweep_devices)
+    :param devices: Optional device name patterns, only the matching devices are built
+    :param kwargs: Further arguments of populate_gds
+    :return: Populated design space
+    """
+    blank_design_space, bounding_box = generate_blank_gds()
+    return populate_gds(blank_design_space, bounding_box, sweep_file=sweep_file, gds_file=gds_file, rows=rows,
+                        devices=devices, **kwargs)
 
-# Call the function which generates a blank design space
-blank_design_space, bounding_box = generate_blank_gds()
 
-# Populate the blank gds with all of our devices
-populate_gds(blank_design_space, bounding_box)
+def list_devices(sweep_file=GRATING_SWEEP_FILE, rows=None, devices=None):
+    """
+    Devices a build would place, without importing any geometry.
+    :return: List of (row index, device type, device name)
+    """
+    spec = load_sweep(sweep_file)
+    return [(row_id, spec['rows'][row_id]['device'], name)
+            for row_id, _, name, _ in iter_sweep_devices(spec, rows, devices)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Builds the design space GDS')
+    parser.add_argument('sweep', nargs='?', default=GRATING_SWEEP_FILE, help='Sweep file, see sweeps.py')
+    parser.add_argument('-o', '--output', default=GDS_FILE, help='GDS file to write')
+    parser.add_argument('--rows', nargs='+', metavar='PATTERN', help='Only build the matching rows')
+    parser.add_argument('--devices', nargs='+', metavar='PATTERN', help='Only build the matching devices')
+    parser.add_argument('--list', '--dry-run', action='store_true', dest='list',
+                        help='List the selected devices instead of building them')
+    parser.add_argument('--parallel', action='store_true', help='Build the devices in worker processes')
+    parser.add_argument('--workers', type=int, help='Number of worker processes')
+    parser.add_argument('--cache-dir', default=BUILD_CACHE_DIR, help='Build cache directory')
+    parser.add_argument('--no-cache', action='store_true', help='Build every device')
+    parser.add_argument('--stream', action='store_true', help='Write the devices to the GDS as they are built')
+    parser.add_argument('--grating-report', help='CSV file for the grating placement check')
+    parser.add_argument('--drc-report', help='CSV file for the design rule check')
+    parser.add_argument('--ebeam-report', help='CSV file for the e-beam write time estimate')
+    args = parser.parse_args(argv)
+
+    if args.list:
+        selected = list_devices(args.sweep, args.rows, args.devices)
+        for row_id, device, name in selected:
+            print('{:>3} {:<22} {}'.format(row_id, device, name))
+        print('{} devices in {} rows'.format(len(selected), len({row_id for row_id, _, _ in selected})))
+        return 0
+
+    if args.stream and args.ebeam_report:
+        parser.error('--ebeam-report can not be used with --stream, the written devices are freed')
+
+    design_space_cell = build(args.sweep, args.output, args.rows, args.devices, parallel=args.parallel,
+                              max_workers=args.workers, cache_dir=None if args.no_cache else args.cache_dir,
+                              stream=args.stream, grating_report=args.grating_report, drc_report=args.drc_report)
+    # Estimated here rather than by populate_gds, which leaves printing the summary to its caller
+    if args.ebeam_report:
+        print(estimate_write_time(design_space_cell, args.ebeam_report, args.sweep, args.rows, args.devices))
+    return 0
+
+
+# Guarded so that worker processes of a parallel build can import this file
+if __name__ == '__main__':
+    sys.exit(main())
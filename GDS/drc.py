@@ -0,0 +1,407 @@
+"""
+Design rule check of the generated cell hierarchy.
+
+Rules:
+    spacing          - waveguides closer than DRC_MIN_SPACING to each other or to themselves, inside a device
+                       and between devices, once for every place they approach
+    bend_radius      - waveguide bends tighter than DRC_MIN_BEND_RADIUS
+    grating_overlap  - waveguides of a device running over one of its gratings
+    device_overlap   - placed devices overlapping each other
+    frame            - placed devices crossing a line of the CELL_OUTLINE_LAYER (layout frame, design space)
+
+Every unique cell is checked once, in its own coordinates, and its result is reused for every
+placement of that cell. Candidate pairs for the spacing and overlap rules are found with an
+STRtree, so only neighbouring shapes are compared. Cells without geometry of their own, such as
+fibre array groups, are looked through: the devices inside them are checked against all others.
+"""
+
+import csv
+from collections import namedtuple
+
+import numpy as np
+from shapely.affinity import affine_transform
+from shapely.geometry import JOIN_STYLE, LineString, box
+from shapely.geometry.polygon import orient
+from shapely.ops import nearest_points, unary_union
+from shapely.prepared import prep
+
+from parameters import *
+from shapes import polygons, query, shapely_object, strtree
+
+# One violation, at (x, y) in the coordinates of the checked top cell. value is the measured
+# gap, radius, overlap area or crossing length, limit the value the rule requires.
+Violation = namedtuple('Violation', ['rule', 'cell', 'x', 'y', 'value', 'limit'])
+
+# Overlaps below this area (um^2) are rounding where parts touch
+AREA_TOLERANCE = 1e-6
+
+# Parts closer than this (um) touch and are connected, the union just did not merge them
+TOUCH_TOLERANCE = 1e-6
+
+# Vertices turning further than this are corners (waveguide ends, tapers), not part of a bend
+MAX_BEND_TURN = np.deg2rad(30)
+
+# Edges compared at a time by gaps_within, which bounds the memory of the edge pairs
+EDGE_BLOCK = 256
+
+
+def _transform(geometry, origin, angle):
+    c, s = np.cos(angle), np.sin(angle)
+    return affine_transform(geometry, [c, -s, s, c, origin[0], origin[1]])
+
+
+def _transform_point(x, y, origin, angle):
+    c, s = np.cos(angle), np.sin(angle)
+    return c * x - s * y + origin[0], s * x + c * y + origin[1]
+
+
+def ring_bend_radii(coords, max_turn=MAX_BEND_TURN):
+    """
+    Radius of curvature of a polygon outline at every vertex, from the circle through each
+    vertex and its neighbours. Corners and straight parts give inf. As the joint of two
+    differently discretised arcs gives a meaningless circle, each radius is the largest of three
+    neighbouring vertices, which a genuine bend (many vertices) passes unchanged.
+
+    :param coords: (N, 2) array of a closed ring, the last point repeating the first
+    :return: Array of N - 1 radii
+    """
+    p = np.asarray(coords)[:-1]
+    before, after = np.roll(p, 1, axis=0), np.roll(p, -1, axis=0)
+    e1, e2 = p - before, after - p
+    cross = e1[:, 0] * e2[:, 1] - e1[:, 1] * e2[:, 0]
+    turn = np.arctan2(cross, np.sum(e1 * e2, axis=1))
+
+    lengths = np.linalg.norm(e1, axis=1) * np.linalg.norm(e2, axis=1) * np.linalg.norm(after - before, axis=1)
+    with np.errstate(divide='ignore'):
+        radii = np.where((cross != 0) & (np.abs(turn) < max_turn), lengths / (2 * np.abs(cross)), np.inf)
+
+    return np.maximum(np.maximum(np.roll(radii, 1), radii), np.roll(radii, -1))
+
+
+def gaps_between(first, second, min_spacing, first_halo=None, second_halo=None):
+    """
+    Places where two separate geometries come closer than min_spacing. Every connected region in
+    which their min_spacing / 2 neighbourhoods overlap is one place, so that two approaches of the
+    same pair of waveguides, such as the two couplers of an MZI, are found separately.
+
+    :param first_halo: first.buffer(min_spacing / 2), if it is already known
+    :param second_halo: second.buffer(min_spacing / 2), if it is already known
+    :return: List of (gap, x, y), (x, y) halfway between the closest points of each place
+    """
+    first_halo = first.buffer(min_spacing / 2) if first_halo is None else first_halo
+    second_halo = second.buffer(min_spacing / 2) if second_halo is None else second_halo
+
+    found = []
+    for region in polygons(first_halo.intersection(second_halo)):
+        if region.geom_type != 'Polygon' or region.area == 0:
+            continue
+        # The closest points of a place lie within min_spacing / 2 of its region
+        near = region.buffer(min_spacing / 2)
+        a, b = first.intersection(near), second.intersection(near)
+        gap = a.distance(b)
+        if TOUCH_TOLERANCE < gap < min_spacing:
+            p, q = nearest_points(a, b)
+            found.append((gap, (p.x + q.x) / 2, (p.y + q.y) / 2))
+    return found
+
+
+def _closest_points(a0, a1, b0, b1):
+    """
+    Closest points of pairs of segments which do not cross, as (N, 2) arrays.
+    """
+    def onto(point, start, end):
+        direction = end - start
+        t = np.sum((point - start) * direction, axis=1) / np.maximum(np.sum(direction ** 2, axis=1), 1e-30)
+        return start + np.clip(t, 0, 1)[:, np.newaxis] * direction
+
+    p = np.stack([a0, a1, onto(b0, a0, a1), onto(b1, a0, a1)])
+    q = np.stack([onto(a0, b0, b1), onto(a1, b0, b1), b0, b1])
+    k = np.argmin(np.linalg.norm(q - p, axis=2), axis=0)
+    n = np.arange(len(a0))
+    return p[k, n], q[k, n]
+
+
+def _outline(ring):
+    """
+    Vertices of a ring without the repeated last point, repeated vertices and zero width spikes
+    which run out and back along the same line, so that consecutive vertices are neighbouring edges.
+    """
+    p = np.asarray(ring.coords)[:-1]
+    while len(p) > 3:
+        repeated = np.linalg.norm(p - np.roll(p, 1, axis=0), axis=1) < TOUCH_TOLERANCE
+        spikes = np.linalg.norm(np.roll(p, 1, axis=0) - np.roll(p, -1, axis=0), axis=1) < TOUCH_TOLERANCE
+        # Dropping the tip of a spike repeats its base, which the next pass drops
+        drop = repeated | (spikes & ~np.roll(spikes, 1))
+        if not drop.any():
+            break
+        p = p[~drop]
+    return p
+
+
+def gaps_within(polygon, min_spacing):
+    """
+    Places where the outline of one polygon comes back closer than min_spacing to itself, such as
+    the arms of a hairpin or the turns of a tight spiral.
+
+    The candidates are the regions a closing by min_spacing adds to the polygon. Mitred joins give
+    the straight edges of curved outlines back exactly, so that the closing only adds gaps and concave
+    corners, not slivers along every bend.
+    In each, the edges of the outline are measured pairwise, skipping neighbouring edges and edges
+    which do not face each other: their outward normals must be more than 90 degrees apart and each
+    must lie on the outer side of the other. Concave corners, which the closing fills as well, have
+    no such pairs.
+
+    :return: List of (gap, x, y) as gaps_between, one per region
+    """
+    closed = (polygon.buffer(min_spacing / 2, join_style=JOIN_STYLE.mitre)
+              .buffer(-min_spacing / 2, join_style=JOIN_STYLE.mitre))
+    # The overlay is by far the slowest step, and most outlines have nothing to fill
+    if closed.area - polygon.area <= AREA_TOLERANCE:
+        return []
+    filled = closed.difference(polygon)
+    regions = [region for region in polygons(filled)
+               if region.geom_type == 'Polygon' and region.area > AREA_TOLERANCE]
+    if not regions:
+        return []
+
+    # Outlines with the polygon on the left of every edge, outward normals on the right
+    polygon = orient(polygon)
+    rings = [_outline(ring) for ring in [polygon.exterior] + list(polygon.interiors)]
+    starts = np.concatenate(rings)
+    ends = np.concatenate([np.roll(ring, -1, axis=0) for ring in rings])
+    ring_sizes = np.array([len(ring) for ring in rings])
+    ring_ids = np.repeat(np.arange(len(rings)), ring_sizes)
+    positions = np.concatenate([np.arange(size) for size in ring_sizes])
+    direction = ends - starts
+    normals = np.stack([direction[:, 1], -direction[:, 0]], axis=1) / np.linalg.norm(direction, axis=1)[:, np.newaxis]
+    low, high = np.minimum(starts, ends), np.maximum(starts, ends)
+
+    found = []
+    for region in regions:
+        x_min, y_min, x_max, y_max = region.bounds
+        near = np.flatnonzero((high[:, 0] >= x_min - min_spacing) & (low[:, 0] <= x_max + min_spacing)
+                              & (high[:, 1] >= y_min - min_spacing) & (low[:, 1] <= y_max + min_spacing))
+        best = None
+        for block in range(0, len(near), EDGE_BLOCK):
+            i, j = [index.ravel() for index in np.meshgrid(near[block:block + EDGE_BLOCK], near, indexing='ij')]
+            step = (positions[j] - positions[i]) % ring_sizes[ring_ids[i]]
+            neighbours = (ring_ids[i] == ring_ids[j]) & ((step == 1) | (step == ring_sizes[ring_ids[i]] - 1))
+            keep = (i < j) & ~neighbours & (np.sum(normals[i] * normals[j], axis=1) < 0)
+            i, j = i[keep], j[keep]
+
+            p, q = _closest_points(starts[i], ends[i], starts[j], ends[j])
+            gap = np.linalg.norm(q - p, axis=1)
+            facing = ((np.sum((q - p) * normals[i], axis=1) > 0) & (np.sum((q - p) * normals[j], axis=1) < 0)
+                      & (gap > TOUCH_TOLERANCE) & (gap < min_spacing))
+            if facing.any():
+                k = np.flatnonzero(facing)[np.argmin(gap[facing])]
+                if best is None or gap[k] < best[0]:
+                    best = (gap[k], *((p[k] + q[k]) / 2))
+        if best is not None:
+            found.append(best)
+    return found
+
+
+class DesignRuleChecker:
+    """
+    Checks cells against the design rules. Results of every cell are cached by name,
+    so a checker must not be reused after cells have been changed.
+    """
+
+    def __init__(self, min_spacing=DRC_MIN_SPACING, min_bend_radius=DRC_MIN_BEND_RADIUS,
+                 waveguide_width=WAVEGUIDE_WIDTH):
+        """
+        :param min_spacing: Smallest allowed gap between separate waveguides
+        :param min_bend_radius: Smallest allowed bend radius of the waveguide centre line
+        :param waveguide_width: Width of the waveguides, to get from the outline to the centre line
+        """
+        self.min_spacing = min_spacing
+        self.min_bend_radius = min_bend_radius
+        self.waveguide_width = waveguide_width
+        self._violations = {}
+        self._layers = {}
+        self._geometry = {}
+
+    def _own_layer(self, cell, layer):
+        """
+        Union of the geometry cell itself has on layer, cached per cell.
+        """
+        if (cell.name, layer) not in self._layers:
+            geometries = [shapely_object(geometry) for geometry in cell.layer_dict.get(layer, [])]
+            self._layers[cell.name, layer] = geometries[0] if len(geometries) == 1 else unary_union(geometries)
+        return self._layers[cell.name, layer]
+
+    def _grating_footprint(self, cell):
+        """
+        Area covered by a grating cell, the outline and the teeth, cached per cell.
+        """
+        if (cell.name, 'footprint') not in self._layers:
+            self._layers[cell.name, 'footprint'] = unary_union([self._own_layer(cell, WAVEGUIDE_LAYER),
+                                                                self._own_layer(cell, GRATING_LAYER)])
+        return self._layers[cell.name, 'footprint']
+
+    def _flat_geometry(self, cell):
+        """
+        Waveguide layer and list of the geometries on all layers of cell, including everything
+        it references, in cell coordinates. The layers are not merged, that is rarely needed.
+        """
+        if cell.name not in self._geometry:
+            waveguides = [self._own_layer(cell, WAVEGUIDE_LAYER)]
+            everything = [self._own_layer(cell, layer) for layer in cell.layer_dict]
+            for ref in cell.cells:
+                child_waveguides, child_everything = self._flat_geometry(ref['cell'])
+                waveguides.append(_transform(child_waveguides, ref['origin'], ref['angle'] or 0))
+                everything += [_transform(geometry, ref['origin'], ref['angle'] or 0) for geometry in child_everything]
+            self._geometry[cell.name] = unary_union(waveguides), everything
+        return self._geometry[cell.name]
+
+    def _spacing(self, name, parts):
+        violations = []
+        halos = [part.buffer(self.min_spacing / 2) for part in parts]
+        tree = strtree(halos)
+        for i, part in enumerate(parts):
+            places = gaps_within(part, self.min_spacing)
+            # A prepared intersects is much cheaper than the overlap, which is only worked out for hits
+            prepared = prep(halos[i])
+            for j in query(tree, halos[i]):
+                if j > i and prepared.intersects(halos[j]):
+                    places += gaps_between(part, parts[j], self.min_spacing, halos[i], halos[j])
+            violations += [Violation('spacing', name, x, y, gap, self.min_spacing) for gap, x, y in places]
+        return violations
+
+    def _bends(self, name, parts):
+        violations = []
+        for part in parts:
+            for ring in [part.exterior] + list(part.interiors):
+                coords = np.asarray(ring.coords)
+                radii = ring_bend_radii(coords)
+                i = np.argmin(radii)
+                # The inner edge of a bend lies half a waveguide inside the centre line
+                radius = radii[i] + self.waveguide_width / 2
+                if radius < self.min_bend_radius - 1e-6:
+                    violations.append(Violation('bend_radius', name, *coords[i], radius, self.min_bend_radius))
+        return violations
+
+    def _grating_overlaps(self, cell, parts):
+        violations = []
+        if not parts:
+            return violations
+        tree = strtree(parts)
+        for ref in cell.cells:
+            if GRATING_LAYER not in ref['cell'].layer_dict:
+                continue
+            footprint = _transform(self._grating_footprint(ref['cell']), ref['origin'], ref['angle'] or 0)
+            for j in query(tree, footprint):
+                overlap = footprint.intersection(parts[j])
+                if overlap.area > AREA_TOLERANCE:
+                    violations.append(Violation('grating_overlap', cell.name, overlap.centroid.x,
+                                                overlap.centroid.y, overlap.area, 0))
+        return violations
+
+    def check_cell(self, cell):
+        """
+        Checks the geometry of cell itself against the rules, once per cell name.
+        Referenced cells are checked separately, see check_layout.
+
+        :return: List of Violation in the coordinates of cell
+        """
+        if cell.name not in self._violations:
+            parts = polygons(self._own_layer(cell, WAVEGUIDE_LAYER))
+            self._violations[cell.name] = (self._spacing(cell.name, parts) + self._bends(cell.name, parts)
+                                           + self._grating_overlaps(cell, parts))
+        return self._violations[cell.name]
+
+    def _check_placements(self, cell, origin, angle, violations):
+        for violation in self.check_cell(cell):
+            x, y = _transform_point(violation.x, violation.y, origin, angle)
+            violations.append(violation._replace(x=x, y=y))
+        for ref in cell.cells:
+            self._check_placements(ref['cell'], _transform_point(*ref['origin'], origin, angle),
+                                   angle + (ref['angle'] or 0), violations)
+
+    def _device_placements(self, cell, origin=(0, 0), angle=0):
+        """
+        Devices placed in cell, as (cell, origin, angle) in the coordinates of cell. Referenced cells
+        without geometry of their own, such as the fibre array groups of fibre_array.py, only group
+        devices and are looked through.
+        """
+        placements = []
+        for ref in cell.cells:
+            ref_origin = _transform_point(*ref['origin'], origin, angle)
+            ref_angle = angle + (ref['angle'] or 0)
+            if ref['cell'].cells and not any(ref['cell'].layer_dict.values()):
+                placements += self._device_placements(ref['cell'], ref_origin, ref_angle)
+            else:
+                placements.append((ref['cell'], ref_origin, ref_angle))
+        return placements
+
+    def _check_devices(self, top_cell):
+        """
+        Spacing, overlap and frame rules between the devices placed in top_cell.
+        """
+        devices = self._device_placements(top_cell)
+        if not devices:
+            return []
+
+        boxes = []
+        for cell, origin, angle in devices:
+            bounds = cell.bounds
+            boxes.append(_transform(box(*bounds), origin, angle) if bounds else box(0, 0, 0, 0))
+        tree = strtree(boxes)
+
+        def placed(i):
+            cell, origin, angle = devices[i]
+            waveguides, everything = self._flat_geometry(cell)
+            return _transform(waveguides, origin, angle), [_transform(geometry, origin, angle)
+                                                           for geometry in everything]
+
+        violations = []
+        for i, device_box in enumerate(boxes):
+            for j in query(tree, device_box.buffer(self.min_spacing)):
+                if j <= i:
+                    continue
+                (waveguides_i, all_i), (waveguides_j, all_j) = placed(i), placed(j)
+                overlap = unary_union([a.intersection(b) for a in all_i for b in all_j
+                                       if a.envelope.intersects(b.envelope)])
+                if overlap.area > AREA_TOLERANCE:
+                    violations.append(Violation('device_overlap', devices[i][0].name, overlap.centroid.x,
+                                                overlap.centroid.y, overlap.area, 0))
+                elif not waveguides_i.is_empty and not waveguides_j.is_empty:
+                    violations += [Violation('spacing', devices[i][0].name, x, y, gap, self.min_spacing)
+                                   for gap, x, y in gaps_between(waveguides_i, waveguides_j, self.min_spacing)]
+
+        # Query the frame edge by edge, the envelope of a whole frame covers every device
+        frame = self._own_layer(top_cell, CELL_OUTLINE_LAYER)
+        edges = [LineString(ring.coords[k:k + 2]) for polygon in polygons(frame)
+                 for ring in [polygon.exterior] + list(polygon.interiors) for k in range(len(ring.coords) - 1)]
+        for edge in edges:
+            for i in query(tree, edge):
+                crossing = unary_union([geometry.intersection(edge) for geometry in placed(i)[1]])
+                if crossing.length > 0:
+                    violations.append(Violation('frame', devices[i][0].name, crossing.centroid.x,
+                                                crossing.centroid.y, crossing.length, 0))
+
+        return violations
+
+    def check_layout(self, top_cell):
+        """
+        Checks a whole layout: every unique cell once, then the placed devices against each other
+        and against the frame.
+
+        :param top_cell: Layout cell, e.g. from GridLayout.generate_layout. The devices need their
+            geometry, so streamed layouts (see gds_stream.py) can not be checked.
+        :return: List of Violation in the coordinates of top_cell
+        """
+        violations = []
+        self._check_placements(top_cell, (0, 0), 0, violations)
+        return violations + self._check_devices(top_cell)
+
+
+def write_violations_csv(violations, filename):
+    """
+    Writes violations to a CSV file, one row per violation.
+    """
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(Violation._fields)
+        writer.writerows(violations)
@@ -0,0 +1,305 @@
+"""
+E-beam write time of a generated layout.
+
+The geometry on the written layers (WAVEGUIDE_LAYER and GRATING_LAYER by default) is fractured into
+trapezoids with two horizontal sides, as pattern generators do: every polygon is cut into slabs at
+the y of its vertices, and the pieces of neighbouring slabs bounded by the same two edges are merged
+into one trapezoid. Every trapezoid is exposed in shots on a grid of BEAM_STEP, so the write time is
+
+    shots * shot period + trapezoids * FIGURE_SETTLING + write fields * FIELD_SETTLING
+
+where the shot period is the dwell time for DOSE at BEAM_CURRENT, or the period of MAX_SHOT_FREQUENCY
+if that is longer. The write fields of a device are those its bounds cover.
+
+Every unique cell is fractured once, in its own coordinates, and counted once per placement, so the
+grating couplers of a full layout are fractured once. Rotated placements reuse the fracture of the
+unrotated cell. Cells with more than MAX_CELL_VERTICES vertices of their own, or a polygon with more
+than MAX_POLYGON_VERTICES, are reported as vertex-heavy: they dominate the fracture and the shot count
+and are the first place to coarsen the polygon resolution.
+"""
+
+import csv
+from collections import namedtuple
+
+import numpy as np
+
+from parameters import *
+from shapes import polygons
+
+# Writer settings, dose in uC/cm^2, current in nA, beam step and field size in um, frequency in MHz,
+# settling times in s
+DOSE = 300.
+BEAM_CURRENT = 2.
+BEAM_STEP = 0.005
+MAX_SHOT_FREQUENCY = 50.
+FIGURE_SETTLING = 1e-6
+FIELD_SIZE = 500.
+FIELD_SETTLING = 0.05
+
+EBEAM_LAYERS = (WAVEGUIDE_LAYER, GRATING_LAYER)
+
+# Vertex counts from which a cell is reported as vertex-heavy. GDSII boundaries hold at most 8190 points.
+MAX_CELL_VERTICES = 20000
+MAX_POLYGON_VERTICES = 8190
+
+# Fracture of a cell. vertices and max_polygon_vertices count the polygon outlines, area is in um^2
+FractureStats = namedtuple('FractureStats', ['vertices', 'max_polygon_vertices', 'trapezoids', 'shots', 'area'])
+
+# One placed device. row is None for devices outside the sweep, write_time is in s
+DeviceEstimate = namedtuple('DeviceEstimate', ['device', 'row', 'placements', 'vertices', 'trapezoids', 'shots',
+                                               'area', 'fields', 'write_time'])
+
+# A vertex-heavy cell with its own vertex count and the number of times it is placed in the layout
+HeavyCell = namedtuple('HeavyCell', ['cell', 'vertices', 'max_polygon_vertices', 'placements'])
+
+
+def _combine(stats, weights=None):
+    """
+    Sum of FractureStats, weighted by their number of placements.
+    """
+    weights = [1] * len(stats) if weights is None else weights
+    return FractureStats(sum(w * s.vertices for s, w in zip(stats, weights)),
+                         max([s.max_polygon_vertices for s in stats], default=0),
+                         sum(w * s.trapezoids for s, w in zip(stats, weights)),
+                         sum(w * s.shots for s, w in zip(stats, weights)),
+                         sum(w * s.area for s, w in zip(stats, weights)))
+
+
+def trapezoids(polygon):
+    """
+    Fractures a polygon, holes included, into trapezoids with two horizontal sides.
+
+    :param polygon: Shapely Polygon
+    :return: (N, 6) array of y0, y1, x of the left and right side at y0, x of the left and right side at y1
+    """
+    rings = [np.asarray(polygon.exterior.coords)] + [np.asarray(ring.coords) for ring in polygon.interiors]
+    edges = np.concatenate([np.hstack([ring[:-1], ring[1:]]) for ring in rings])
+    edges = edges[edges[:, 1] != edges[:, 3]]
+    if not len(edges):
+        return np.zeros((0, 6))
+    # Edges pointing up, from (xa, ya) to (xb, yb)
+    down = edges[:, 1] > edges[:, 3]
+    edges[down] = edges[down][:, [2, 3, 0, 1]]
+    xa, ya, xb, yb = edges.T
+    slope = (xb - xa) / (yb - ya)
+
+    # Every edge crosses the slabs between the y of its ends
+    ys = np.unique(np.concatenate([ya, yb]))
+    first, last = np.searchsorted(ys, ya), np.searchsorted(ys, yb)
+    spans = last - first
+    edge = np.repeat(np.arange(len(edges)), spans)
+    slab = np.repeat(first, spans) + np.arange(spans.sum()) - np.repeat(np.cumsum(spans) - spans, spans)
+
+    # Crossings of a slab, from left to right, alternately enter and leave the polygon
+    x_middle = xa[edge] + ((ys[slab] + ys[slab + 1]) / 2 - ya[edge]) * slope[edge]
+    order = np.lexsort((x_middle, slab))
+    left, right, slab = edge[order[0::2]], edge[order[1::2]], slab[order[0::2]]
+
+    # Pieces between the same two edges in neighbouring slabs are one trapezoid
+    order = np.lexsort((slab, right, left))
+    left, right, slab = left[order], right[order], slab[order]
+    start = np.ones(len(slab), dtype=bool)
+    start[1:] = (left[1:] != left[:-1]) | (right[1:] != right[:-1]) | (slab[1:] != slab[:-1] + 1)
+    starts = np.flatnonzero(start)
+    ends = np.append(starts[1:], len(slab)) - 1
+    left, right = left[starts], right[starts]
+    y0, y1 = ys[slab[starts]], ys[slab[ends] + 1]
+
+    def x(edges, y):
+        return xa[edges] + (y - ya[edges]) * slope[edges]
+
+    return np.column_stack([y0, y1, x(left, y0), x(right, y0), x(left, y1), x(right, y1)])
+
+
+def trapezoid_shots(traps, beam_step=BEAM_STEP):
+    """
+    Shots which expose each trapezoid, its area in beam steps rounded up.
+    """
+    area = (traps[:, 1] - traps[:, 0]) * ((traps[:, 3] - traps[:, 2]) + (traps[:, 5] - traps[:, 4])) / 2
+    return np.ceil(area / beam_step ** 2 - 1e-9).astype(int), area
+
+
+class WriteTimeEstimator:
+    """
+    Fractures cells and estimates their write time. Results of every cell are cached by name,
+    so an estimator must not be reused after cells have been changed.
+    """
+
+    def __init__(self, layers=EBEAM_LAYERS, beam_step=BEAM_STEP, dose=DOSE, beam_current=BEAM_CURRENT,
+                 max_shot_frequency=MAX_SHOT_FREQUENCY, figure_settling=FIGURE_SETTLING, field_size=FIELD_SIZE,
+                 field_settling=FIELD_SETTLING):
+        """
+        :param layers: Layers which are written
+        :param beam_step: Distance between shots, in um
+        :param dose: Exposure dose, in uC/cm^2
+        :param beam_current: Beam current, in nA
+        :param max_shot_frequency: Highest shot frequency of the pattern generator, in MHz
+        :param figure_settling: Settling time of the beam per trapezoid, in s
+        :param field_size: Size of a write field, in um
+        :param field_settling: Time of a stage move to the next write field, in s
+        """
+        self.layers = layers
+        self.beam_step = beam_step
+        self.field_size = field_size
+        self.figure_settling = figure_settling
+        self.field_settling = field_settling
+        # uC/cm^2 * um^2 / nA gives 1e-5 s
+        self.shot_period = max(dose * beam_step ** 2 / beam_current * 1e-5, 1e-6 / max_shot_frequency)
+        self._own = {}
+        self._total = {}
+
+    def cell_stats(self, cell):
+        """
+        Fracture of the geometry of cell itself on the written layers, once per cell name.
+        """
+        if cell.name not in self._own:
+            vertices, largest, count, shots, area = 0, 0, 0, 0, 0.
+            for layer in self.layers:
+                for geometry in cell.layer_dict.get(layer, []):
+                    for polygon in polygons(geometry):
+                        n = sum(len(ring.coords) - 1 for ring in [polygon.exterior] + list(polygon.interiors))
+                        vertices, largest = vertices + n, max(largest, n)
+                        polygon_shots, polygon_area = trapezoid_shots(trapezoids(polygon), self.beam_step)
+                        count += len(polygon_shots)
+                        shots += polygon_shots.sum()
+                        area += polygon_area.sum()
+            self._own[cell.name] = FractureStats(vertices, largest, count, int(shots), float(area))
+        return self._own[cell.name]
+
+    def total_stats(self, cell):
+        """
+        Fracture of cell and everything it references, every referenced cell counted once per placement.
+        """
+        if cell.name not in self._total:
+            self._total[cell.name] = _combine([self.cell_stats(cell)] + [self.total_stats(ref['cell'])
+                                                                        for ref in cell.cells])
+        return self._total[cell.name]
+
+    def fields(self, cell):
+        """
+        Number of write fields the bounds of cell cover.
+        """
+        bounds = cell.bounds
+        if not bounds:
+            return 0
+        return int(np.ceil((bounds[2] - bounds[0]) / self.field_size - 1e-9)
+                   * np.ceil((bounds[3] - bounds[1]) / self.field_size - 1e-9))
+
+    def write_time(self, stats, fields=1):
+        """
+        Write time in s of the given FractureStats spread over fields write fields.
+        """
+        return stats.shots * self.shot_period + stats.trapezoids * self.figure_settling + fields * self.field_settling
+
+    def estimate_cell(self, cell, row=None, placements=1):
+        """
+        :return: DeviceEstimate of all placements of cell
+        """
+        stats = _combine([self.total_stats(cell)], [placements])
+        fields = placements * self.fields(cell)
+        return DeviceEstimate(cell.name, row, placements, stats.vertices, stats.trapezoids, stats.shots, stats.area,
+                              fields, self.write_time(stats, fields))
+
+    def estimate_layout(self, top_cell, rows=None):
+        """
+        Estimates of every device of a layout.
+
+        :param top_cell: Layout cell, e.g. from GridLayout.generate_layout. The devices need their
+            geometry, so streamed layouts (see gds_stream.py) can not be estimated.
+        :param rows: Optional dict of device name to row index. The devices are then the cells of those
+            names wherever they are placed, e.g. on fibre array cells. Without it, the devices are the
+            cells placed in top_cell.
+        :return: List of DeviceEstimate, in the order they are placed or of rows, and one for the
+            geometry of top_cell itself if it has any on the written layers
+        """
+        if rows is None:
+            devices = {}
+            for ref in top_cell.cells:
+                cell, count = devices.get(ref['cell'].name, (ref['cell'], 0))
+                devices[ref['cell'].name] = cell, count + 1
+        else:
+            placements = self._placements(top_cell)
+            devices = {name: placements[name] for name in rows if name in placements}
+        estimates = [self.estimate_cell(cell, (rows or {}).get(name), count) for name, (cell, count) in devices.items()]
+        if self.cell_stats(top_cell).trapezoids:
+            stats = self.cell_stats(top_cell)
+            estimates.append(DeviceEstimate(top_cell.name, None, 1, stats.vertices, stats.trapezoids, stats.shots,
+                                            stats.area, 0, self.write_time(stats, 0)))
+        return estimates
+
+    def _placements(self, top_cell):
+        """
+        Number of placements of every cell in the layout of top_cell.
+        :return: Dict of cell name to (cell, placements), parents before the cells they reference
+        """
+        # Cells after everything that references them, so each count is final before it is passed on
+        order, visited = [], set()
+
+        def visit(cell):
+            visited.add(cell.name)
+            for ref in cell.cells:
+                if ref['cell'].name not in visited:
+                    visit(ref['cell'])
+            order.append(cell)
+
+        visit(top_cell)
+        counts = {top_cell.name: 1}
+        for cell in reversed(order):
+            for ref in cell.cells:
+                counts[ref['cell'].name] = counts.get(ref['cell'].name, 0) + counts[cell.name]
+        return {cell.name: (cell, counts[cell.name]) for cell in reversed(order)}
+
+    def heavy_cells(self, top_cell, max_cell_vertices=MAX_CELL_VERTICES, max_polygon_vertices=MAX_POLYGON_VERTICES):
+        """
+        Unique cells of the layout with too many vertices of their own, the heaviest first.
+        :return: List of HeavyCell
+        """
+        heavy = []
+        for name, (cell, count) in self._placements(top_cell).items():
+            stats = self.cell_stats(cell)
+            if stats.vertices > max_cell_vertices or stats.max_polygon_vertices > max_polygon_vertices:
+                heavy.append(HeavyCell(name, stats.vertices, stats.max_polygon_vertices, count))
+        return sorted(heavy, key=lambda cell: -cell.vertices * cell.placements)
+
+
+def row_totals(estimates):
+    """
+    Sums of the device estimates of every row.
+    :return: Dict of row index (None for devices outside the sweep) to a DeviceEstimate named after the row
+    """
+    totals = {}
+    for estimate in estimates:
+        total = totals.get(estimate.row)
+        if total is None:
+            totals[estimate.row] = estimate._replace(device='row {}'.format(estimate.row))
+        else:
+            totals[estimate.row] = total._replace(**{field: getattr(total, field) + getattr(estimate, field)
+                                                     for field in DeviceEstimate._fields[2:]})
+    return totals
+
+
+def format_summary(estimates, heavy=(), spec=None):
+    """
+    Human readable write times per row and the vertex-heavy cells.
+    :param spec: Optional sweep description, for the row labels
+    """
+    lines = ['{:>4} {:<45} {:>8} {:>12} {:>14} {:>10}'.format('row', '', 'devices', 'trapezoids', 'shots', 'time')]
+    for row, total in sorted(row_totals(estimates).items(), key=lambda item: (item[0] is None, item[0] or 0)):
+        label = '' if row is None or spec is None else spec['rows'][row].get('row_label') or spec['rows'][row]['name']
+        lines.append('{:>4} {:<45} {:>8} {:>12} {:>14} {:>9.1f}s'.format(
+            '-' if row is None else row, label[:45], total.placements, total.trapezoids, total.shots,
+            total.write_time))
+    lines.append('Total write time {:.1f} min'.format(sum(estimate.write_time for estimate in estimates) / 60))
+    for cell in heavy:
+        lines.append('Vertex-heavy cell {}: {} vertices, largest polygon {}, placed {} times'.format(*cell))
+    return '\n'.join(lines)
+
+
+def write_estimates_csv(estimates, filename):
+    """
+    Writes estimates to a CSV file, one row per device.
+    """
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(DeviceEstimate._fields)
+        writer.writerows(estimates)
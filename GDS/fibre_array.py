@@ -0,0 +1,151 @@
+"""
+Grating positions on the fibre array.
+
+Devices are measured through a fibre array of VGA_NUM_CHANNELS fibres GRATING_PITCH apart, so all
+gratings of a device sit on one y, a whole number of pitches (channels) from its first grating.
+The output gratings go on the lowest channel which clears the routing in front of them, found in
+closed form from the size of that routing, so every device uses as few channels as it can.
+
+Devices can also share one alignment of the fibre array. FibreArrayPacker places them side by side,
+each moved by a whole number of pitches so that it is as close to the previous one as their bounds
+allow, and starts a new array when the channels run out. FibreArrayCells does the same with device
+cells and returns one cell per array. In a sweep file a row does this with
+
+    "fibre_array": {"name": "DC_array_{i}", "channels": 127, "spacing": 10}
+
+where every key is optional, "fibre_array": true takes the defaults.
+"""
+
+import numpy as np
+
+from parameters import *
+from port_alignment import TOLERANCE, collect_grating_ports
+
+
+def next_channel(x, pitch=GRATING_PITCH):
+    """
+    Smallest whole number of pitches which is at least x, works on arrays.
+    """
+    return np.ceil((np.asarray(x, dtype=float) - TOLERANCE) / pitch).astype(int)
+
+
+def spiral_winding_channel(spiral_right, pitch=GRATING_PITCH):
+    """
+    Channel of the output grating of spiral_winding. Its waveguide comes down to the grating on the
+    right of the spiral, DRC_MIN_SPACING clear of it.
+
+    :param spiral_right: Largest x of the spiral, relative to the input grating
+    """
+    return np.maximum(1, next_channel(spiral_right + WAVEGUIDE_WIDTH / 2 + DRC_MIN_SPACING, pitch))
+
+
+def mzi_output_channel(dc_end, pitch=GRATING_PITCH):
+    """
+    Channel of the first output grating of asymmetric_spiral_mzi, the second one is on the next channel.
+    The waveguides run from the second DC to a bend of BEND_RADIUS down to the gratings.
+
+    :param dc_end: x of the right ports of the second DC, relative to the first input grating
+    """
+    # Channels 0 and 1 hold the input gratings
+    return np.maximum(2, next_channel(dc_end + BEND_RADIUS, pitch))
+
+
+def row_fibre_array(row, row_id):
+    """
+    Settings of a sweep row's "fibre_array" entry.
+    :param row: Row description
+    :param row_id: Index of the row, for the default name of its array cells
+    :return: (name template of the array cells, FibreArrayPacker arguments), None if the row has no such entry
+    """
+    settings = row.get('fibre_array')
+    if not settings:
+        return None
+    settings = {} if settings is True else dict(settings)
+    name = settings.pop('name', 'ROW_{}_FIBRE_ARRAY_{{i}}'.format(row_id))
+    return name, settings
+
+
+class FibreArrayPacker:
+    """
+    Places devices side by side on shared fibre arrays, from their bounds and grating channels only.
+    """
+
+    def __init__(self, channels=VGA_NUM_CHANNELS, pitch=GRATING_PITCH, spacing=CELL_HORIZONTAL_SPACING):
+        """
+        :param channels: Number of channels of the fibre array
+        :param pitch: Pitch of the fibre array
+        :param spacing: Smallest distance between the bounds of neighbouring devices
+        """
+        self.channels = channels
+        self.pitch = pitch
+        self.spacing = spacing
+        self.arrays = 0
+        self._right = None
+
+    def place(self, left, right, highest):
+        """
+        Places the next device.
+
+        :param left: Smallest x of the device, relative to its first grating
+        :param right: Largest x of the device, relative to its first grating
+        :param highest: Channel of its last grating, counted from its first one
+        :return: (index of the array, channel of the first grating of the device on that array)
+        """
+        if highest >= self.channels:
+            raise ValueError('A device which needs {} channels does not fit on a fibre array of {}'
+                             .format(highest + 1, self.channels))
+        if self._right is not None:
+            channel = int(next_channel(self._right + self.spacing - left, self.pitch))
+            if channel + highest < self.channels:
+                self._right = channel * self.pitch + right
+                return self.arrays - 1, channel
+
+        self.arrays += 1
+        self._right = right
+        return self.arrays - 1, 0
+
+
+class FibreArrayCells:
+    """
+    Groups device cells into cells which each share one fibre array, see FibreArrayPacker.
+    """
+
+    def __init__(self, name, **kwargs):
+        """
+        :param name: Name template of the array cells, formatted with the array index i
+        :param kwargs: Arguments of FibreArrayPacker
+        """
+        self.name = name
+        self.packer = FibreArrayPacker(**kwargs)
+        self._cell = None
+        self._array = None
+
+    def add(self, device):
+        """
+        Adds a device cell, with its first grating on a channel of the current array.
+        :return: The previous array cell if it is full and device starts a new one, None otherwise
+        """
+        from gdshelpers.geometry.chip import Cell
+
+        gratings = collect_grating_ports(device)[2]
+        if not len(gratings):
+            raise ValueError('"{}" has no gratings to place on a fibre array'.format(device.name))
+        first = gratings[np.argmin(gratings[:, 0])]
+        highest = int(np.round((gratings[:, 0].max() - first[0]) / self.packer.pitch))
+        bounds = device.bounds
+
+        array, channel = self.packer.place(bounds[0] - first[0], bounds[2] - first[0], highest)
+        finished = None
+        if array != self._array:
+            finished = self.finish()
+            self._cell = Cell(self.name.format(i=array))
+            self._array = array
+        self._cell.add_cell(device, origin=(channel * self.packer.pitch - first[0], -first[1]))
+        return finished
+
+    def finish(self):
+        """
+        :return: The current array cell, None if it is empty
+        """
+        cell, self._cell = self._cell, None
+        return cell
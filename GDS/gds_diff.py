@@ -0,0 +1,594 @@
+"""
+Geometric diff of two GDS files, e.g. of a layout before and after a change of parameters.py.
+
+Both files are read into cells of polygons per layer. Every polygon is brought into a canonical form
+(integer coordinates, counter-clockwise, starting at its lowest-left vertex), so the hash of a layer
+of a cell does not depend on the order or starting point the polygons were written with. The hash
+of a layer of a cell includes the hashes of the same layer of the cells it places, with their
+transformations, so cells which did not change anywhere in their hierarchy are recognised from
+their hashes alone, without looking at their geometry.
+
+The devices are the cells placed in the top cell, looking through cells without geometry of their own
+such as fibre array cells (see fibre_array.py). They are matched by name and placement order and are
+    unchanged - same hashes, same position
+    moved     - same hashes, another position or orientation
+    changed   - XOR area above AREA_TOLERANCE on some layers
+    rewritten - different hashes, but no XOR area: the same geometry split into other polygons or cells
+    added     - only in the new file
+    removed   - only in the old file
+Only the layers whose hashes differ are compared, along their hierarchy (see LayoutDiff), so a
+changed cell placed in many devices is compared once. Polygons which are in both files are taken out,
+the rest is XORed using an STRtree, so only polygons which overlap are compared.
+The XOR can be written to a GDS file, on the layer of the geometry with ADDED_DATATYPE for new and
+REMOVED_DATATYPE for old geometry, placed where the device is in the new file.
+
+Usage: python gds_diff.py old.gds new.gds [--csv report.csv] [--diff-gds diff.gds] [--all]
+"""
+
+import argparse
+import csv
+import hashlib
+import sys
+from collections import Counter, namedtuple
+from struct import unpack
+
+import numpy as np
+
+# Datatypes of the diff GDS, on the layer of the geometry which differs
+ADDED_DATATYPE = 1
+REMOVED_DATATYPE = 2
+
+# XOR pieces below this area (um^2) are rounding of the database grid
+AREA_TOLERANCE = 1e-6
+
+# Change of one device. layers lists the layers whose geometry differs, rewritten_layers those which
+# only differ in how the same geometry is written, as 'layer/datatype'. The XOR area is in um^2 and
+# its bounds are in the coordinates of the device, both are 0 unless it changed
+DeviceChange = namedtuple('DeviceChange', ['device', 'placement', 'status', 'layers', 'rewritten_layers', 'xor_area',
+                                           'x_min', 'y_min', 'x_max', 'y_max'])
+
+_IDENTITY = (1., 0., 0., 1., 0., 0.)
+
+
+class GDSCell:
+    """
+    Cell of a GDS file. Coordinates are kept in database units.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        # (layer, datatype) to a list of (N, 2) int arrays, paths and texts are kept apart
+        self.polygons = {}
+        self.paths = {}
+        self.texts = {}
+        # (name of the placed cell, affine transformation (a, b, c, d, x, y))
+        self.refs = []
+
+    def layers(self):
+        return set(self.polygons) | set(self.paths) | set(self.texts)
+
+
+def _real8(data):
+    """
+    Value of a GDSII 8-byte real, excess-64 base-16.
+    """
+    value = int.from_bytes(data, 'big')
+    mantissa = (value & 0x00FFFFFFFFFFFFFF) / 2 ** 56
+    return (-1) ** (value >> 63) * mantissa * 16. ** (((value >> 56) & 0x7F) - 64)
+
+
+def _transform(x, y, angle=0., magnification=1., reflection=False):
+    """
+    Affine transformation (a, b, c, d, x, y) of a GDSII reference, mapping (u, v) to
+    (a u + b v + x, c u + d v + y).
+    """
+    c, s = magnification * np.cos(np.deg2rad(angle)), magnification * np.sin(np.deg2rad(angle))
+    flip = -1 if reflection else 1
+    return c, -s * flip, s, c * flip, float(x), float(y)
+
+
+def _compose(outer, inner):
+    a, b, c, d, x, y = outer
+    a2, b2, c2, d2, x2, y2 = inner
+    return (a * a2 + b * c2, a * b2 + b * d2, c * a2 + d * c2, c * b2 + d * d2,
+            a * x2 + b * y2 + x, c * x2 + d * y2 + y)
+
+
+def _apply(transform, points):
+    a, b, c, d, x, y = transform
+    return np.column_stack([a * points[:, 0] + b * points[:, 1] + x, c * points[:, 0] + d * points[:, 1] + y])
+
+
+def read_gds(filename):
+    """
+    Reads the cells of a GDS file. Boundaries, paths, texts and (array) references are read,
+    boxes and nodes are skipped.
+
+    :return: (dict of cell name to GDSCell, size of a database unit in um)
+    """
+    with open(filename, 'rb') as f:
+        data = f.read()
+
+    cells, cell, element, unit = {}, None, None, 1e-3
+    position = 0
+    while position < len(data):
+        length, record = unpack('>HH', data[position:position + 4])
+        if length < 4:
+            raise ValueError('Corrupt GDS file {}, record of length {} at byte {}'.format(filename, length, position))
+        body = data[position + 4:position + length]
+        position += length
+
+        if record == 0x0305:  # UNITS
+            unit = _real8(body[8:16]) * 1e6
+        elif record == 0x0606:  # STRNAME
+            cell = GDSCell(body.rstrip(b'\0').decode('ascii'))
+            cells[cell.name] = cell
+        elif record in (0x0800, 0x0900, 0x0A00, 0x0B00, 0x0C00):  # BOUNDARY, PATH, SREF, AREF, TEXT
+            element = {'kind': record, 'layer': 0, 'datatype': 0, 'width': 0, 'pathtype': 0, 'angle': 0.,
+                       'magnification': 1., 'reflection': False}
+        elif record == 0x2D00 or record == 0x1500:  # BOX, NODE
+            element = None
+        elif element is None:
+            continue
+        elif record == 0x0D02:  # LAYER
+            element['layer'] = unpack('>h', body[:2])[0]
+        elif record in (0x0E02, 0x1602):  # DATATYPE, TEXTTYPE
+            element['datatype'] = unpack('>h', body[:2])[0]
+        elif record == 0x0F03:  # WIDTH
+            element['width'] = unpack('>i', body[:4])[0]
+        elif record == 0x2102:  # PATHTYPE
+            element['pathtype'] = unpack('>h', body[:2])[0]
+        elif record == 0x1003:  # XY
+            element['xy'] = np.frombuffer(body, '>i4').reshape(-1, 2).astype(np.int64)
+        elif record == 0x1206:  # SNAME
+            element['sname'] = body.rstrip(b'\0').decode('ascii')
+        elif record == 0x1906:  # STRING
+            element['string'] = body.rstrip(b'\0').decode('ascii', 'replace')
+        elif record == 0x1A01:  # STRANS
+            element['reflection'] = bool(body[0] & 0x80)
+        elif record == 0x1B05:  # MAG
+            element['magnification'] = _real8(body[:8])
+        elif record == 0x1C05:  # ANGLE
+            element['angle'] = _real8(body[:8])
+        elif record == 0x1302:  # COLROW
+            element['columns'], element['rows'] = unpack('>hh', body[:4])
+        elif record == 0x1100:  # ENDEL
+            _add_element(cell, element)
+            element = None
+    return cells, unit
+
+
+def _add_element(cell, element):
+    key = element['layer'], element['datatype']
+    kind = element['kind']
+    if kind == 0x0800:
+        points = element['xy']
+        if len(points) > 1 and np.array_equal(points[0], points[-1]):
+            points = points[:-1]
+        cell.polygons.setdefault(key, []).append(points)
+    elif kind == 0x0900:
+        cell.paths.setdefault(key, []).append((element['xy'], element['width'], element['pathtype']))
+    elif kind == 0x0C00:
+        cell.texts.setdefault(key, []).append((element.get('string', ''), *element['xy'][0]))
+    else:
+        transform = (element['angle'], element['magnification'], element['reflection'])
+        origin = element['xy'][0]
+        if kind == 0x0A00:
+            cell.refs.append((element['sname'], _transform(*origin, *transform)))
+            return
+        columns, rows = element['columns'], element['rows']
+        column_step = (element['xy'][1] - origin) / columns
+        row_step = (element['xy'][2] - origin) / rows
+        for i in range(columns):
+            for j in range(rows):
+                cell.refs.append((element['sname'], _transform(*(origin + i * column_step + j * row_step), *transform)))
+
+
+def canonical_polygon(points):
+    """
+    Canonical form of a polygon, counter-clockwise and starting at its lowest-left vertex.
+    :param points: (N, 2) int array, not closed
+    :return: bytes
+    """
+    points = np.asarray(points, dtype=np.int64)
+    x, y = points[:, 0], points[:, 1]
+    if np.sum(x * np.roll(y, -1) - np.roll(x, -1) * y) < 0:
+        points = points[::-1]
+    first = np.lexsort((points[:, 1], points[:, 0]))[0]
+    return np.ascontiguousarray(np.roll(points, -first, axis=0)).tobytes()
+
+
+def _digest(items):
+    h = hashlib.sha256()
+    for item in sorted(items):
+        h.update(len(item).to_bytes(4, 'big'))
+        h.update(item)
+    return h.digest()
+
+
+def _transform_key(transform):
+    return np.round(np.asarray(transform), 6).tobytes()
+
+
+class LayoutHasher:
+    """
+    Per-layer hashes of the cells of a GDS file, including everything they place.
+    """
+
+    def __init__(self, cells):
+        """
+        :param cells: Dict of cell name to GDSCell, as returned by read_gds
+        """
+        self.cells = cells
+        self._own = {}
+        self._deep = {}
+
+    def own_hashes(self, name):
+        """
+        Hash of every layer of the geometry of a cell itself.
+        :return: Dict of (layer, datatype) to digest
+        """
+        if name not in self._own:
+            cell = self.cells[name]
+            hashes = {}
+            for layer in cell.layers():
+                items = [b'p' + canonical_polygon(points) for points in cell.polygons.get(layer, [])]
+                items += [b'w' + np.asarray([width, pathtype], dtype=np.int64).tobytes() + points.tobytes()
+                          for points, width, pathtype in cell.paths.get(layer, [])]
+                items += [b't' + repr(text).encode() for text in cell.texts.get(layer, [])]
+                hashes[layer] = _digest(items)
+            self._own[name] = hashes
+        return self._own[name]
+
+    def hashes(self, name):
+        """
+        Hash of every layer of a cell and the cells it places, with their transformations.
+        :return: Dict of (layer, datatype) to digest
+        """
+        if name not in self._deep:
+            own = self.own_hashes(name)
+            placed = {}
+            for child, transform in self.cells[name].refs:
+                for layer, digest in self.hashes(child).items():
+                    placed.setdefault(layer, []).append(_transform_key(transform) + digest)
+            self._deep[name] = {layer: _digest([b'o' + own.get(layer, b'')] + placed.get(layer, []))
+                                for layer in set(own) | set(placed)}
+        return self._deep[name]
+
+    def own_polygons(self, name, layer, transform=_IDENTITY):
+        """
+        Outlines of the geometry a cell itself has on layer, paths converted to polygons, in database units.
+        :return: List of (N, 2) float arrays
+        """
+        cell = self.cells[name]
+        polygons = [_apply(transform, points) for points in cell.polygons.get(layer, [])]
+        for points, width, pathtype in cell.paths.get(layer, []):
+            polygons += [_apply(transform, np.asarray(path.exterior.coords)[:-1])
+                         for path in _path_polygons(points, width, pathtype)]
+        return polygons
+
+    def flat_polygons(self, name, layer, transform=_IDENTITY):
+        """
+        Outlines of everything a cell has on layer, references resolved and paths converted
+        to polygons, in database units.
+        :return: List of (N, 2) float arrays
+        """
+        if layer not in self.hashes(name):
+            return []
+        cell = self.cells[name]
+        polygons = self.own_polygons(name, layer, transform)
+        for child, child_transform in cell.refs:
+            polygons += self.flat_polygons(child, layer, _compose(transform, child_transform))
+        return polygons
+
+
+def _path_polygons(points, width, pathtype):
+    from shapely.geometry import LineString
+
+    # Pathtype 0 ends flush with the points, 2 extends by half the width
+    outline = LineString(points).buffer(abs(width) / 2, cap_style=3 if pathtype == 2 else 2, join_style=2)
+    return list(outline.geoms) if hasattr(outline, 'geoms') else [outline]
+
+
+def top_cells(cells):
+    """
+    Names of the cells which are not placed in any other cell.
+    """
+    placed = {child for cell in cells.values() for child, _ in cell.refs}
+    return [name for name in cells if name not in placed]
+
+
+def devices(cells, top=None):
+    """
+    Devices placed in the top cell, looking through cells without geometry of their own.
+
+    :param cells: Dict of cell name to GDSCell
+    :param top: Name of the top cell, the only unplaced cell by default
+    :return: List of (cell name, placement index, transformation in the top cell)
+    """
+    if top is None:
+        tops = top_cells(cells)
+        if len(tops) != 1:
+            raise ValueError('The layout has {} top cells ({}), name the one to compare'
+                             .format(len(tops), ', '.join(tops[:5])))
+        top = tops[0]
+
+    found, count = [], Counter()
+
+    def visit(name, transform):
+        for child, child_transform in cells[name].refs:
+            placement = _compose(transform, child_transform)
+            if cells[child].layers() or not cells[child].refs:
+                found.append((child, count[child], placement))
+                count[child] += 1
+            else:
+                visit(child, placement)
+
+    visit(top, _IDENTITY)
+    return found
+
+
+def xor_polygons(old, new, unit):
+    """
+    Geometry which is only in old or only in new. Polygons which are in both are taken out first,
+    the remaining ones are only compared with those they overlap.
+
+    :param old: List of (N, 2) arrays in database units
+    :param new: List of (N, 2) arrays in database units
+    :param unit: Size of a database unit in um
+    :return: (removed, added), lists of shapely polygons in um
+    """
+    from shapely.geometry import Polygon
+    from shapely.ops import unary_union
+    from shapes import polygons, query, strtree
+
+    def keyed(polygons):
+        return {canonical_polygon(np.round(points)): points for points in polygons}
+
+    old, new = keyed(old), keyed(new)
+    shared = set(old) & set(new)
+    old = [Polygon(points * unit).buffer(0) for key, points in old.items() if key not in shared]
+    new = [Polygon(points * unit).buffer(0) for key, points in new.items() if key not in shared]
+
+    def difference(polygons, others):
+        if not others:
+            return polygons
+        tree = strtree(others)
+        pieces = []
+        for polygon in polygons:
+            near = [others[j] for j in query(tree, polygon)]
+            pieces.append(polygon.difference(unary_union(near)) if near else polygon)
+        return pieces
+
+    removed = polygons(unary_union(difference(old, new))) if old else []
+    added = polygons(unary_union(difference(new, old))) if new else []
+    return ([p for p in removed if p.area > AREA_TOLERANCE], [p for p in added if p.area > AREA_TOLERANCE])
+
+
+def _placed(polygons, transform, unit):
+    """
+    Polygons in um moved by a transformation in database units.
+    """
+    from shapely.affinity import affine_transform
+
+    a, b, c, d, x, y = transform
+    return [affine_transform(polygon, [a, b, c, d, x * unit, y * unit]) for polygon in polygons]
+
+
+def _placed_bounds(bounds, transform, unit):
+    """
+    Bounds in um of bounds in um moved by a transformation in database units.
+    """
+    corners = np.array([[bounds[0], bounds[1]], [bounds[2], bounds[1]], [bounds[0], bounds[3]],
+                        [bounds[2], bounds[3]]])
+    a, b, c, d, x, y = transform
+    corners = _apply((a, b, c, d, x * unit, y * unit), corners)
+    return (*corners.min(axis=0), *corners.max(axis=0))
+
+
+def _merge_bounds(bounds):
+    bounds = np.array(bounds).reshape(-1, 4)
+    if not len(bounds):
+        return None
+    return bounds[:, 0].min(), bounds[:, 1].min(), bounds[:, 2].max(), bounds[:, 3].max()
+
+
+# XOR of a pair of cells on one layer. removed and added are the shapely polygons (um) of the level
+# of the cells themselves, placements the (transformation, key) of changed pairs of placed cells.
+# area and bounds (um, None if there is no difference) include the placements.
+XorResult = namedtuple('XorResult', ['removed', 'added', 'placements', 'area', 'bounds'])
+
+
+class LayoutDiff:
+    """
+    XOR of cells of two layouts, following their hierarchies. Placements of the same transformation
+    are compared cell by cell, and skipped if their hashes agree, so a changed cell which is placed
+    many times is compared once. Geometry of a cell itself and of placements without a counterpart
+    is compared polygon by polygon, see xor_polygons. Overlaps between the levels of the hierarchy
+    are not merged, which only matters where changed geometry overlaps other geometry.
+    """
+
+    def __init__(self, old_cells, new_cells, unit):
+        """
+        :param old_cells: Dict of cell name to GDSCell before the change
+        :param new_cells: Dict of cell name to GDSCell after the change
+        :param unit: Size of a database unit in um
+        """
+        self.old = LayoutHasher(old_cells)
+        self.new = LayoutHasher(new_cells)
+        self.unit = unit
+        self._xor = {}
+        self._cells = {}
+
+    def xor(self, old_name, new_name, layer):
+        """
+        Geometry on layer which is only in the old or only in the new cell, in cell coordinates.
+        :return: XorResult, keyed (old_name, new_name, layer) for its placements
+        """
+        key = old_name, new_name, layer
+        if key in self._xor:
+            return self._xor[key]
+
+        old_loose = self.old.own_polygons(old_name, layer)
+        new_loose = self.new.own_polygons(new_name, layer)
+        counterparts = {}
+        for child, transform in self.new.cells[new_name].refs:
+            if layer in self.new.hashes(child):
+                counterparts.setdefault(_transform_key(transform), []).append((child, transform))
+
+        placements = []
+        for child, transform in self.old.cells[old_name].refs:
+            old_hash = self.old.hashes(child).get(layer)
+            if old_hash is None:
+                continue
+            matches = counterparts.get(_transform_key(transform))
+            if not matches:
+                old_loose += self.old.flat_polygons(child, layer, transform)
+            else:
+                new_child = matches.pop()[0]
+                if self.new.hashes(new_child)[layer] != old_hash:
+                    placements.append((transform, (child, new_child, layer)))
+        for matches in counterparts.values():
+            for child, transform in matches:
+                new_loose += self.new.flat_polygons(child, layer, transform)
+
+        removed, added = xor_polygons(old_loose, new_loose, self.unit)
+        children = [(transform, self.xor(*child_key)) for transform, child_key in placements]
+        area = sum(polygon.area for polygon in removed + added) + sum(result.area for _, result in children)
+        bounds = _merge_bounds([polygon.bounds for polygon in removed + added]
+                               + [_placed_bounds(result.bounds, transform, self.unit)
+                                  for transform, result in children if result.bounds is not None])
+        self._xor[key] = XorResult(removed, added, placements, area, bounds)
+        return self._xor[key]
+
+    def diff_cell(self, old_name, new_name, layer):
+        """
+        gdshelpers Cell of an XOR, with the differences of placed cells in cells of their own.
+        Removed geometry goes on REMOVED_DATATYPE and added geometry on ADDED_DATATYPE of layer.
+        """
+        from gdshelpers.geometry.chip import Cell
+
+        key = old_name, new_name, layer
+        if key not in self._cells:
+            result = self.xor(*key)
+            name = old_name if old_name == new_name else '{}_{}'.format(old_name, new_name)
+            cell = Cell('DIFF_{}_{}_{}'.format(name, *layer))
+            for polygons, datatype in ((result.removed, REMOVED_DATATYPE), (result.added, ADDED_DATATYPE)):
+                if polygons:
+                    cell.add_to_layer((layer[0], datatype), *polygons)
+            for transform, child_key in result.placements:
+                child = self.xor(*child_key)
+                a, b, c, d, x, y = transform
+                if np.isclose(a * d - b * c, 1):
+                    cell.add_cell(self.diff_cell(*child_key), origin=(x * self.unit, y * self.unit),
+                                  angle=np.arctan2(c, a))
+                else:
+                    # gdshelpers places cells without reflection or magnification
+                    for polygons, datatype in ((child.removed, REMOVED_DATATYPE), (child.added, ADDED_DATATYPE)):
+                        if polygons:
+                            cell.add_to_layer((layer[0], datatype), *_placed(polygons, transform, self.unit))
+            self._cells[key] = cell
+        return self._cells[key]
+
+
+def _layer_name(layer):
+    return '{}/{}'.format(*layer)
+
+
+def diff_layouts(old_file, new_file, top=None, diff_gds=None):
+    """
+    Compares the devices of two GDS files.
+
+    :param old_file: GDS file before the change
+    :param new_file: GDS file after the change
+    :param top: Name of the top cell, the only unplaced cell by default
+    :param diff_gds: If given, the XOR of the changed devices is written to this GDS file
+    :return: List of DeviceChange, in the order of the devices of the new file, removed devices last
+    """
+    (old_cells, old_unit), (new_cells, new_unit) = read_gds(old_file), read_gds(new_file)
+    if not np.isclose(old_unit, new_unit):
+        raise ValueError('The database units differ, {} and {} um'.format(old_unit, new_unit))
+    layout_diff = LayoutDiff(old_cells, new_cells, new_unit)
+    old_devices = {(name, i): transform for name, i, transform in devices(old_cells, top)}
+
+    changes, top_cell = [], None
+    if diff_gds:
+        from gdshelpers.geometry.chip import Cell
+        top_cell = Cell('DIFF')
+
+    for name, i, transform in devices(new_cells, top):
+        if (name, i) not in old_devices:
+            changes.append(DeviceChange(name, i, 'added', '', '', 0., 0., 0., 0., 0.))
+            continue
+        old_transform = old_devices.pop((name, i))
+        before, after = layout_diff.old.hashes(name), layout_diff.new.hashes(name)
+        differing = sorted(layer for layer in set(before) | set(after) if before.get(layer) != after.get(layer))
+        results = {layer: layout_diff.xor(name, name, layer) for layer in differing}
+        layers = [layer for layer in differing if results[layer].area > AREA_TOLERANCE]
+        rewritten = ' '.join(_layer_name(layer) for layer in differing if layer not in layers)
+        if not layers:
+            status = 'moved' if not np.allclose(old_transform, transform) else 'rewritten' if rewritten else 'unchanged'
+            changes.append(DeviceChange(name, i, status, '', rewritten, 0., 0., 0., 0., 0.))
+            continue
+
+        bounds = _merge_bounds([results[layer].bounds for layer in layers if results[layer].bounds is not None])
+        changes.append(DeviceChange(name, i, 'changed', ' '.join(_layer_name(layer) for layer in layers), rewritten,
+                                    sum(results[layer].area for layer in layers), *(bounds or (0., 0., 0., 0.))))
+        if top_cell is not None:
+            a, b, c, d, x, y = transform
+            for layer in layers:
+                top_cell.add_cell(layout_diff.diff_cell(name, name, layer), origin=(x * new_unit, y * new_unit),
+                                  angle=np.arctan2(c, a))
+
+    for name, i in old_devices:
+        changes.append(DeviceChange(name, i, 'removed', '', '', 0., 0., 0., 0., 0.))
+
+    if top_cell is not None:
+        top_cell.save(diff_gds)
+    return changes
+
+
+def write_changes_csv(changes, filename):
+    """
+    Writes device changes to a CSV file, one row per device.
+    """
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(DeviceChange._fields)
+        writer.writerows(changes)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Geometric diff of two GDS files')
+    parser.add_argument('old', help='GDS file before the change')
+    parser.add_argument('new', help='GDS file after the change')
+    parser.add_argument('--top', help='Top cell, the only unplaced cell by default')
+    parser.add_argument('--csv', help='CSV file for the report of every device')
+    parser.add_argument('--diff-gds', help='GDS file for the XOR of the changed devices')
+    parser.add_argument('--all', action='store_true', help='Also list the unchanged devices')
+    args = parser.parse_args(argv)
+
+    changes = diff_layouts(args.old, args.new, args.top, args.diff_gds)
+    for change in changes:
+        if args.all or change.status != 'unchanged':
+            line = '{:<9} {}'.format(change.status, change.device)
+            if change.placement:
+                line += ' #{}'.format(change.placement)
+            if change.status == 'changed':
+                line += ' layers {}, XOR {:.3f} um^2 in ({:.1f}, {:.1f}, {:.1f}, {:.1f})'.format(
+                    change.layers, change.xor_area, change.x_min, change.y_min, change.x_max, change.y_max)
+            if change.rewritten_layers:
+                line += ' rewritten layers {}'.format(change.rewritten_layers)
+            print(line)
+    counts = Counter(change.status for change in changes)
+    print('{} devices: '.format(len(changes)) + ', '.join('{} {}'.format(counts[status], status) for status in
+                                                          ('unchanged', 'moved', 'changed', 'rewritten', 'added',
+                                                           'removed')))
+    if args.csv:
+        write_changes_csv(changes, args.csv)
+    # Rewritten devices have the same geometry
+    return 0 if counts['unchanged'] + counts['rewritten'] == len(changes) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""
+Streaming GDSII output.
+
+Cell.save() needs the complete cell hierarchy in memory before it writes anything.
+StreamingGDSWriter instead writes every device cell as soon as it is finished and hands
+back a geometry-free stand-in with the same name and bounds, which can be placed in the
+GridLayout like the original. The top cell is written last, when close() is called, and
+refers to the already written cells by name.
+
+Cells are written with labels.cell_to_gdsii_binary, which adds the TEXT elements of text mode
+labels. save_gds writes a complete cell the same way, in place of Cell.save().
+"""
+
+import datetime
+import os
+import shutil
+from struct import pack
+from tempfile import NamedTemporaryFile
+
+from gdshelpers.geometry.chip import Cell
+from gdshelpers.export.gdsii_export import _real_to_8byte
+
+from labels import cell_to_gdsii_binary
+
+
+class WrittenCell(Cell):
+    """
+    Stand-in for a cell which has already been written to a GDSII stream.
+    Only the name and the outer bounds of the original cell are kept.
+    """
+
+    def __init__(self, name, bounds):
+        super().__init__(name)
+        self._written_bounds = bounds
+
+    def get_bounds(self, layers=None):
+        # Per-layer bounds are not kept, the geometry is gone
+        return self._written_bounds if layers is None else None
+
+
+class StreamingGDSWriter:
+    """
+    Writes a GDSII library cell by cell.
+
+    Usage::
+
+        with StreamingGDSWriter('layout.gds') as writer:
+            layout.add_to_row(writer.write_cell(device))
+            ...
+            writer.close(top_cell)
+    """
+
+    def __init__(self, filename, unit=1e-6, grid_steps_per_unit=1000, max_points=4000, max_line_points=4000,
+                 timestamp=None, library_name='gdshelpers_exported_library'):
+        """
+        :param filename: Name of the GDS file, it only appears once close() has been called
+        :param unit: Size of one user unit in metres
+        :param grid_steps_per_unit: Resolution of the stored coordinates
+        :param max_points: Maximum number of points per polygon
+        :param max_line_points: Maximum number of points per path
+        :param timestamp: Modification time stored in the file, defaults to now
+        :param library_name: Name of the GDSII library
+        """
+        self.filename = filename
+        self.grid_steps_per_unit = grid_steps_per_unit
+        self.max_points = max_points
+        self.max_line_points = max_line_points
+        self.timestamp = datetime.datetime.now() if timestamp is None else timestamp
+        self._written = set()
+
+        # Write to a temporary file, so a failed build never leaves a truncated GDS behind
+        self._file = NamedTemporaryFile('wb', delete=False,
+                                        dir=os.path.dirname(os.path.abspath(filename)))
+
+        name = library_name + '\0' * (len(library_name) % 2)  # Strings always have even length
+        grid_step_unit = unit / grid_steps_per_unit
+        self._file.write(pack('>3H', 6, 0x0002, 0x258))  # HEADER v6.0
+        self._file.write(pack('>14H', 28, 0x0102, *self.timestamp.timetuple()[:6] * 2))  # BGNLIB
+        self._file.write(pack('>2H', 4 + len(name), 0x0206) + name.encode('ascii'))  # LIBNAME
+        self._file.write(pack('>2H', 20, 0x0305) + _real_to_8byte(grid_step_unit / unit)
+                         + _real_to_8byte(grid_step_unit))  # UNITS
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self._file.closed:
+            # close() was not reached, throw the partial file away
+            self._file.close()
+            os.remove(self._file.name)
+
+    def _write_structure(self, cell):
+        for ref in cell.cells:
+            # Cells which are already in the stream (e.g. shared gratings) are only referenced
+            if ref['cell'].name not in self._written:
+                self._write_structure(ref['cell'])
+
+        self._file.write(cell_to_gdsii_binary(cell, self.grid_steps_per_unit, self.max_points, self.max_line_points,
+                                              self.timestamp))
+        self._written.add(cell.name)
+
+    def write_cell(self, cell):
+        """
+        Writes cell and all cells it references which are not in the stream yet.
+
+        :param cell: Finished device cell, it must not be changed afterwards
+        :return: A WrittenCell with the same name and bounds, to be placed instead of cell
+        """
+        if cell.name in self._written:
+            raise AssertionError('Each cell name must be unique, "{}" is used more than once'.format(cell.name))
+
+        bounds = cell.bounds
+        self._write_structure(cell)
+        return WrittenCell(cell.name, bounds)
+
+    def close(self, top_cell):
+        """
+        Writes the top cell and finishes the file.
+
+        :param top_cell: Cell holding the references to the written cells
+        """
+        self._write_structure(top_cell)
+        self._file.write(pack('>2H', 4, 0x0400))  # ENDLIB
+        self._file.close()
+        shutil.move(self._file.name, self.filename)
+
+
+def save_gds(cell, filename, **kwargs):
+    """
+    Writes cell and everything it references to a GDS file, including the TEXT elements of
+    text mode labels, which Cell.save() leaves out.
+
+    :param kwargs: Arguments of StreamingGDSWriter
+    """
+    with StreamingGDSWriter(filename, **kwargs) as writer:
+        writer.close(cell)
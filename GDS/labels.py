@@ -0,0 +1,181 @@
+"""
+Device labels.
+
+A label is drawn in one of three modes (LABEL_MODE in parameters.py):
+    polygons - a gdshelpers Text, every label polygonized on its own
+    glyphs   - every character is built once as a cell (per font, height and layer) and labels
+               are assembled from references to those cells. Each glyph is stored and polygonized
+               only once per layout. The shapes are those of Text, but not identical once written:
+               the vertices of a glyph and the origin of its reference are rounded to the database
+               grid separately, so edges may move by one grid step (a few 0.1 um^2 of XOR per label).
+    text     - GDSII TEXT elements, one per line. They carry the label without any polygons,
+               so they are not written on the mask and take no space in the layout.
+
+Text mode labels are kept on the cell as text_elements, which survive pickling (worker processes,
+build cache). gdshelpers can not write them, cell_to_gdsii_binary adds them to the structure of
+a cell and is used by gds_stream.py, so populate_gds writes them in any case.
+"""
+
+import numpy as np
+import shapely.geometry
+import shapely.ops
+from struct import pack
+
+from gdshelpers.export import gdsii_export
+from gdshelpers.geometry.chip import Cell
+from gdshelpers.parts import _fonts
+from gdshelpers.parts.text import Text
+
+from parameters import *
+from profiling import profiled
+
+LABEL_MODES = ('polygons', 'glyphs', 'text')
+
+GLYPH_CELL_PREFIX = 'GLYPH_'
+
+# Glyph cells built so far, keyed on their name. Each glyph is drawn centred on x = 0, baseline y = 0.
+_GLYPH_CELL_CACHE = {}
+
+# gdshelpers' cell writer, before install_text_export replaces it
+_cell_to_gdsii_binary = gdsii_export._cell_to_gdsii_binary
+
+
+def _glyph_cell(char, height, layer, font):
+    """
+    The shared cell drawing one character.
+    """
+    name = '{}{}_{}_{}_{}_{}'.format(GLYPH_CELL_PREFIX, font, height, *(layer if isinstance(layer, tuple)
+                                                                        else (layer, 0)), ord(char))
+    if name not in _GLYPH_CELL_CACHE:
+        cell = Cell(name)
+        cell.add_to_layer(layer, shapely.ops.unary_union(
+            [shapely.geometry.Polygon(np.array(line).T * height) for line in _fonts.FONTS[font][char]['lines']]))
+        _GLYPH_CELL_CACHE[name] = cell
+    return _GLYPH_CELL_CACHE[name]
+
+
+def clear_glyph_cells():
+    """
+    Forgets the cached glyph cells, so that the next labels draw their glyphs again.
+    """
+    _GLYPH_CELL_CACHE.clear()
+
+
+def share_glyph_cells(cell):
+    """
+    Makes the glyphs referenced by cell point at the cached glyph cells, see components.share_cached_cells.
+    """
+    for ref in cell.cells:
+        name = ref['cell'].name
+        if name.startswith(GLYPH_CELL_PREFIX):
+            ref['cell'] = _GLYPH_CELL_CACHE.setdefault(name, ref['cell'])
+    return cell
+
+
+def _layout_lines(text, height, font, line_spacing):
+    """
+    Position of every character, laid out like gdshelpers' Text with left-bottom alignment.
+    :return: List of (character, x of its centre, y of its baseline), list of (line, y of its baseline)
+    """
+    glyphs = _fonts.FONTS[font]
+    placed, lines = [], []
+    cursor_y = 0
+    for line in text.split('\n'):
+        cursor_x = 0
+        for i, char in enumerate(line):
+            if char not in glyphs:
+                raise ValueError('Character "{}" is not supported by font "{}"'.format(char, font))
+            cursor_x += glyphs[char]['width'] / 2 * height
+            placed.append((char, cursor_x, cursor_y))
+            if i < len(line) - 1:
+                cursor_x += (glyphs[char]['width'] / 2 + glyphs[char]['kerning'][line[i + 1]]) * height
+        lines.append((line, cursor_y))
+        cursor_y -= line_spacing * height
+
+    # left-bottom alignment: the last line sits on y = 0
+    bottom = lines[-1][1]
+    return ([(char, x, y - bottom) for char, x, y in placed],
+            [(line, y - bottom) for line, y in lines])
+
+
+def _rotate(x, y, origin, angle):
+    c, s = np.cos(angle), np.sin(angle)
+    return origin[0] + c * x - s * y, origin[1] + s * x + c * y
+
+
+@profiled
+def add_label(cell, text, origin=LABEL_ORIGIN, height=LABEL_HEIGHT, angle=LABEL_ANGLE_VERTICAL, layer=LABEL_LAYER,
+              mode=None, font='stencil', line_spacing=1.5):
+    """
+    Adds a label to cell, in the same place and shape as a left-bottom aligned gdshelpers Text.
+
+    :param cell: Cell to add the label to
+    :param text: Label text, lines separated by newlines
+    :param mode: One of LABEL_MODES, defaults to LABEL_MODE
+    :return: cell
+    """
+    mode = mode or LABEL_MODE
+    if not text:
+        return cell
+
+    if mode == 'polygons':
+        cell.add_to_layer(layer, Text(origin=origin, height=height, angle=angle, text=text, font=font,
+                                      line_spacing=line_spacing))
+    elif mode == 'glyphs':
+        placed, _ = _layout_lines(text, height, font, line_spacing)
+        for char, x, y in placed:
+            if _fonts.FONTS[font][char]['lines']:
+                cell.add_cell(_glyph_cell(char, height, layer, font), origin=_rotate(x, y, origin, angle),
+                              angle=angle or None)
+    elif mode == 'text':
+        _, lines = _layout_lines(text, height, font, line_spacing)
+        if not hasattr(cell, 'text_elements'):
+            cell.text_elements = []
+        for line, y in lines:
+            cell.text_elements.append((layer, _rotate(0, y, origin, angle), line, height, angle))
+    else:
+        raise ValueError('Unknown label mode "{}", use one of {}'.format(mode, LABEL_MODES))
+
+    return cell
+
+
+def _text_element_records(cell, grid_steps_per_unit):
+    """
+    GDSII TEXT elements of the labels stored on cell in text mode.
+    """
+    records = []
+    for layer, position, string, height, angle in cell.text_elements:
+        layer, texttype = layer if isinstance(layer, tuple) else (layer, 0)
+        string = string + '\0' * (len(string) % 2)
+        xy = np.round(np.array(position) * grid_steps_per_unit).astype('>i4')
+        records.append(pack('>2H', 4, 0x0C00)  # TEXT
+                       + pack('>3H', 6, 0x0D02, layer)  # LAYER
+                       + pack('>3H', 6, 0x1602, texttype)  # TEXTTYPE
+                       + pack('>3H', 6, 0x1701, 0x0008)  # PRESENTATION, left-bottom
+                       + pack('>3H', 6, 0x1A01, 0)  # STRANS
+                       + pack('>2H', 12, 0x1B05) + gdsii_export._real_to_8byte(height)  # MAG
+                       + pack('>2H', 12, 0x1C05) + gdsii_export._real_to_8byte(np.rad2deg(angle) % 360.)  # ANGLE
+                       + pack('>2H', 12, 0x1003) + xy.tobytes()  # XY
+                       + pack('>2H', 4 + len(string), 0x1906) + string.encode('ascii')  # STRING
+                       + pack('>2H', 4, 0x1100))  # ENDEL
+    return b''.join(records)
+
+
+def cell_to_gdsii_binary(cell, grid_steps_per_unit, max_points, max_line_points, timestamp):
+    """
+    gdshelpers' cell writer, plus the TEXT elements of text mode labels before the end of the structure.
+    """
+    binary = _cell_to_gdsii_binary(cell, grid_steps_per_unit, max_points, max_line_points, timestamp)
+    if not getattr(cell, 'text_elements', None):
+        return binary
+    # The structure ends with the 4 byte ENDSTR record
+    return binary[:-4] + _text_element_records(cell, grid_steps_per_unit) + binary[-4:]
+
+
+def install_text_export():
+    """
+    Makes Cell.save write TEXT elements too, in this process. gdshelpers has no support for them, so
+    its cell writer is replaced by cell_to_gdsii_binary, which writes cells without texts unchanged.
+    Not needed with gds_stream.save_gds, which populate_gds uses.
+    """
+    gdsii_export._cell_to_gdsii_binary = cell_to_gdsii_binary
@@ -0,0 +1,275 @@
+"""
+Gridded supermode index tables of directional couplers.
+
+Mode solver sweeps, such as the FDE sweeps of Lumerical/DC_mode, are exported as CSV files with one
+line per solved cross-section, all lengths in um:
+
+    gap,etch_depth,si_thickness,wavelength,n_even,n_odd
+    0.29,0.11,0.22,1.55,2.4671,2.4382
+    ...
+
+The etch_depth and si_thickness columns can be left out of files which hold a single stack, their
+values are then given when the files are read. Together the files must fill a regular grid over
+gap, etch depth, Si thickness and wavelength.
+
+A table is stored as a directory with the grid axes (axes.npz) and the effective indices of the even
+and odd supermodes (n_eff.npy). The indices are memory-mapped when the table is loaded, so a query
+only reads the grid points around it. Queries interpolate multi-linearly and take arrays: the 50:50
+coupling lengths of a whole gap sweep come from one call.
+
+Usage:
+    python mode_table.py build table_dir sweep.csv [sweep.csv ...] [--etch-depth D] [--si-thickness T]
+    python mode_table.py length table_dir gap [gap ...] [--etch-depth D] [--si-thickness T] [--wavelength L]
+"""
+
+import argparse
+import bisect
+import csv
+import itertools
+import os
+
+import numpy as np
+
+from parameters import *
+
+AXES = ('gap', 'etch_depth', 'si_thickness', 'wavelength')
+
+# Queries this close to the edge of the grid are taken to be on it
+GRID_TOLERANCE = 1e-9
+
+# Tables loaded by load_table, keyed on their directory
+_TABLES = {}
+
+
+class ModeTable:
+    """
+    Effective indices of the even and odd supermodes of a directional coupler on a regular grid.
+    """
+
+    def __init__(self, axes, n_eff):
+        """
+        :param axes: Dict of the increasing grid values of every axis in AXES
+        :param n_eff: Array of shape (gaps, etch depths, Si thicknesses, wavelengths, 2) with the
+            indices of the even and odd supermode
+        """
+        self.axes = {name: np.asarray(axes[name], dtype=float) for name in AXES}
+        self._grids = {name: self.axes[name].tolist() for name in AXES}
+        # A plain array view is still backed by the memory map, but indexes much faster
+        self.n_eff = np.asarray(n_eff)
+        shape = tuple(len(self.axes[name]) for name in AXES) + (2,)
+        if n_eff.shape != shape:
+            raise ValueError('Mode table of shape {} does not match its axes, expected {}'.format(n_eff.shape, shape))
+
+    @classmethod
+    def from_csv(cls, paths, etch_depth=None, si_thickness=None):
+        """
+        Builds a table from exported mode solver sweeps.
+
+        :param paths: CSV file or list of CSV files
+        :param etch_depth: Etch depth of files without an etch_depth column
+        :param si_thickness: Si thickness of files without an si_thickness column
+        :return: ModeTable
+        """
+        defaults = {'etch_depth': etch_depth, 'si_thickness': si_thickness}
+        points = {}
+        for path in [paths] if isinstance(paths, str) else paths:
+            with open(path, newline='') as f:
+                for line in csv.DictReader(f):
+                    key = []
+                    for name in AXES:
+                        value = line.get(name, defaults.get(name))
+                        if value is None:
+                            raise ValueError('{} has no {} column, give its value when reading it'.format(path, name))
+                        # Rounded so that grid values written with different precision match
+                        key.append(round(float(value), 9))
+                    points[tuple(key)] = (float(line['n_even']), float(line['n_odd']))
+
+        keys = np.array(list(points))
+        axes = {name: np.unique(keys[:, i]) for i, name in enumerate(AXES)}
+        n_eff = np.full(tuple(len(axes[name]) for name in AXES) + (2,), np.nan)
+        index = tuple(np.searchsorted(axes[name], keys[:, i]) for i, name in enumerate(AXES))
+        n_eff[index] = list(points.values())
+
+        missing = np.isnan(n_eff[..., 0]).sum()
+        if missing:
+            raise ValueError('The sweeps do not fill a regular grid, {} of {} grid points are missing'
+                             .format(missing, n_eff[..., 0].size))
+        return cls(axes, n_eff)
+
+    def save(self, directory):
+        """
+        Stores the table in directory, which is created if needed.
+        """
+        os.makedirs(directory, exist_ok=True)
+        np.savez(os.path.join(directory, 'axes.npz'), **self.axes)
+        np.save(os.path.join(directory, 'n_eff.npy'), np.asarray(self.n_eff))
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Opens a table stored with save, with the indices memory-mapped.
+        """
+        with np.load(os.path.join(directory, 'axes.npz')) as axes:
+            axes = {name: axes[name] for name in AXES}
+        return cls(axes, np.load(os.path.join(directory, 'n_eff.npy'), mmap_mode='r'))
+
+    def _locate(self, name, values):
+        """
+        Grid cell and position in it of every query value along one axis.
+        :return: Index of the lower grid point, fraction of the way to the next one
+        """
+        grid = self.axes[name]
+        values = np.asarray(values, dtype=float)
+        if len(grid) == 1:
+            if not np.allclose(values, grid[0], rtol=0, atol=GRID_TOLERANCE):
+                raise ValueError('The mode table only holds {} = {}'.format(name, grid[0]))
+            return np.zeros(values.shape, dtype=int), np.zeros(values.shape)
+
+        if np.any(values < grid[0] - GRID_TOLERANCE) or np.any(values > grid[-1] + GRID_TOLERANCE):
+            raise ValueError('{} outside of the mode table range {} to {}'.format(name, grid[0], grid[-1]))
+        lower = np.clip(np.searchsorted(grid, values, side='right') - 1, 0, len(grid) - 2)
+        return lower, np.clip((values - grid[lower]) / (grid[lower + 1] - grid[lower]), 0, 1)
+
+    def _locate_scalar(self, name, value):
+        """
+        _locate for a single query value, without the overhead of NumPy.
+        """
+        grid = self._grids[name]
+        if len(grid) == 1:
+            if abs(value - grid[0]) > GRID_TOLERANCE:
+                raise ValueError('The mode table only holds {} = {}'.format(name, grid[0]))
+            return 0, 0.
+
+        if value < grid[0] - GRID_TOLERANCE or value > grid[-1] + GRID_TOLERANCE:
+            raise ValueError('{} outside of the mode table range {} to {}'.format(name, grid[0], grid[-1]))
+        lower = min(max(bisect.bisect_right(grid, value) - 1, 0), len(grid) - 2)
+        return lower, min(max((value - grid[lower]) / (grid[lower + 1] - grid[lower]), 0.), 1.)
+
+    def query_values(self, etch_depth, si_thickness, wavelength):
+        """
+        Query values of the stack axes, where None means the only value of the table or the
+        default of parameters.py.
+        """
+        defaults = {'etch_depth': ETCH_DEPTH, 'si_thickness': SI_THICKNESS, 'wavelength': WAVELENGTH}
+        values = {'etch_depth': etch_depth, 'si_thickness': si_thickness, 'wavelength': wavelength}
+        for name, value in values.items():
+            if value is None:
+                values[name] = self.axes[name][0] if len(self.axes[name]) == 1 else defaults[name]
+        return values
+
+    def supermode_indices(self, gap, etch_depth=None, si_thickness=None, wavelength=None):
+        """
+        Interpolated indices of the even and odd supermode. The arguments broadcast against each other,
+        stack arguments left at None take the only value in the table or the default of parameters.py.
+
+        :return: Array of the broadcast shape of the arguments plus a last axis of (even, odd)
+        """
+        values = dict(self.query_values(etch_depth, si_thickness, wavelength), gap=gap)
+
+        if all(np.ndim(values[name]) == 0 for name in AXES):
+            # Single queries in plain Python, NumPy's overhead would dominate
+            terms = []
+            for name in AXES:
+                lower, fraction = self._locate_scalar(name, float(values[name]))
+                terms.append(((lower, 1.),) if len(self._grids[name]) == 1
+                             else ((lower, 1 - fraction), (lower + 1, fraction)))
+            even = odd = 0.
+            item = self.n_eff.item
+            for (i, a), (j, b), (k, c), (m, d) in itertools.product(*terms):
+                weight = a * b * c * d
+                even += weight * item(i, j, k, m, 0)
+                odd += weight * item(i, j, k, m, 1)
+            return np.array((even, odd))
+
+        # The corners of the grid cell around every query, along single value axes there is only one
+        corners = itertools.product(*[(0,) if len(self._grids[name]) == 1 else (0, 1) for name in AXES])
+        located = [self._locate(name, value) for name, value in zip(AXES, np.broadcast_arrays(
+            *[np.asarray(values[name], dtype=float) for name in AXES]))]
+        result = 0.
+        for corner in corners:
+            weight = 1.
+            for offset, (_, fraction) in zip(corner, located):
+                weight = weight * (fraction if offset else 1 - fraction)
+            index = tuple(lower + offset for offset, (lower, _) in zip(corner, located))
+            result = result + weight[..., np.newaxis] * self.n_eff[index]
+        return result
+
+    def delta_n(self, gap, etch_depth=None, si_thickness=None, wavelength=None):
+        """
+        Index difference of the even and odd supermode, see supermode_indices.
+        """
+        indices = self.supermode_indices(gap, etch_depth, si_thickness, wavelength)
+        return indices[..., 0] - indices[..., 1]
+
+    def decay_length(self, gap, etch_depth=None, si_thickness=None, wavelength=None, step=1e-3):
+        """
+        Length over which the supermode index difference falls by 1/e with the gap, at gap.
+        """
+        if len(self.axes['gap']) == 1:
+            return np.full(np.shape(gap), DC_DECAY_LENGTH)
+        if np.ndim(gap):
+            gap = np.asarray(gap, dtype=float)
+            low = np.maximum(gap - step, self._grids['gap'][0])
+            high = np.minimum(gap + step, self._grids['gap'][-1])
+        else:
+            low = max(gap - step, self._grids['gap'][0])
+            high = min(gap + step, self._grids['gap'][-1])
+        return (high - low) / np.log(self.delta_n(low, etch_depth, si_thickness, wavelength)
+                                     / self.delta_n(high, etch_depth, si_thickness, wavelength))
+
+    def fifty_fifty_length(self, gap, etch_depth=None, si_thickness=None, wavelength=None):
+        """
+        Straight coupling length at which a DirectionalCoupler of the given gap splits 50:50, with the
+        coupling of its bends (see mzi_model.bend_coupling_length) taken into account.
+        """
+        from mzi_model import bend_coupling_length
+
+        values = self.query_values(etch_depth, si_thickness, wavelength)
+        # kappa * L = pi / 4 with kappa = pi * delta_n / wavelength
+        coupled_length = values['wavelength'] / (4 * self.delta_n(gap, **values))
+        return coupled_length - bend_coupling_length(decay_length=self.decay_length(gap, **values))
+
+
+def load_table(directory):
+    """
+    ModeTable.load, each directory opened once.
+    """
+    key = os.path.abspath(directory)
+    if key not in _TABLES:
+        _TABLES[key] = ModeTable.load(directory)
+    return _TABLES[key]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Supermode index tables of directional couplers')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help='Build a table from exported mode solver sweeps')
+    build.add_argument('table', help='Directory to store the table in')
+    build.add_argument('csv', nargs='+', help='Exported sweeps')
+    build.add_argument('--etch-depth', type=float, help='Etch depth of files without an etch_depth column')
+    build.add_argument('--si-thickness', type=float, help='Si thickness of files without an si_thickness column')
+
+    length = commands.add_parser('length', help='50:50 coupling lengths')
+    length.add_argument('table', help='Table directory')
+    length.add_argument('gap', type=float, nargs='+', help='Coupling gaps')
+    length.add_argument('--etch-depth', type=float)
+    length.add_argument('--si-thickness', type=float)
+    length.add_argument('--wavelength', type=float)
+
+    args = parser.parse_args(argv)
+    if args.command == 'build':
+        table = ModeTable.from_csv(args.csv, args.etch_depth, args.si_thickness)
+        table.save(args.table)
+        print('{} grid points, axes: {}'.format(table.n_eff[..., 0].size,
+                                                ', '.join('{} {}'.format(len(table.axes[name]), name)
+                                                          for name in AXES)))
+    else:
+        lengths = load_table(args.table).fifty_fifty_length(args.gap, args.etch_depth, args.si_thickness,
+                                                            args.wavelength)
+        for gap, value in zip(args.gap, lengths):
+            print('gap {:.3f} um: {:.3f} um'.format(gap, value))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+"""
+Monte Carlo of fabrication variation for the asymmetric_spiral_mzi devices of a sweep.
+
+Every sample perturbs the waveguide width, the coupling gap, the etch depth and the Si thickness
+by draws from the distributions in a variation dict, such as
+
+    {'width': {'distribution': 'normal', 'sigma': 0.01, 'scope': 'die'},
+     'gap': {'distribution': 'uniform', 'low': -0.005, 'high': 0.005, 'scope': 'device'}}
+
+Distributions are 'normal' (mean, sigma), 'uniform' (low, high) and 'fixed' (value), or a function
+taking a numpy Generator and a shape. Draws are offsets from the nominal value, in um. A 'die' draw
+is shared by all devices of a sample, like a wafer-to-wafer variation, a 'device' draw is made for
+every device. A wider waveguide narrows the gap by as much, as both edges move.
+
+For every sample and device the split ratio of the couplers follows from
+mzi_model.dc_coupling_phase, with the supermode index difference from a ModeTable if one is
+given, which must cover the varied stacks, or from the analytic model of mzi_model scaled by the
+DC_*_SENSITIVITY parameters otherwise. The extinction of the MZI through ports follows from the
+split ratio and the loss imbalance of the arms. A device passes when its split ratio is within
+split_tolerance of 50:50 and its extinction is at least min_extinction.
+
+The nominal etch depth and Si thickness of a row are those of its "stack" entry (see
+sweeps.row_stack). Samples are drawn in chunks with seeds spawned from one seed, so the results
+only depend on the seed, also when the chunks run in a process pool.
+
+Usage: python monte_carlo.py [sweep_file] [--samples N] [--seed S] [--parallel]
+"""
+
+import argparse
+import sys
+
+import numpy as np
+
+from mzi_model import WAVEGUIDE_LOSS_DB_PER_CM, arm_lengths, dc_coupling_phase, supermode_index_difference
+from parameters import *
+
+DEFAULT_VARIATION = {
+    # Tolerances of the Cornerstone stack taken as one standard deviation
+    'width': {'distribution': 'normal', 'sigma': 0.01, 'scope': 'die'},
+    'gap': {'distribution': 'normal', 'sigma': 0.005, 'scope': 'device'},
+    'etch_depth': {'distribution': 'normal', 'sigma': 0.01, 'scope': 'die'},
+    'si_thickness': {'distribution': 'normal', 'sigma': 0.02, 'scope': 'die'},
+}
+
+VARIED_PARAMETERS = ('width', 'gap', 'etch_depth', 'si_thickness')
+
+SPLIT_TOLERANCE = 0.05
+MIN_EXTINCTION = 20.
+
+# Samples per chunk, the unit of work of the process pool
+CHUNK_SIZE = 4096
+
+MZI_PARAMETERS = ('coupling_length', 'coupling_gap', 'upper_spiral_no', 'lower_spiral_no', 'spiral_gap',
+                  'spiral_inner_gap')
+
+
+def draw(specification, rng, shape):
+    """
+    Offsets drawn from one entry of a variation dict.
+    :param specification: Dict with a 'distribution' and its parameters, or a function(rng, shape)
+    :param rng: numpy Generator
+    :param shape: Shape of the draw
+    """
+    if callable(specification):
+        return np.broadcast_to(specification(rng, shape), shape)
+    distribution = specification.get('distribution', 'normal')
+    if distribution == 'normal':
+        return rng.normal(specification.get('mean', 0.), specification['sigma'], shape)
+    if distribution == 'uniform':
+        return rng.uniform(specification['low'], specification['high'], shape)
+    if distribution == 'fixed':
+        return np.full(shape, float(specification['value']))
+    raise ValueError('Unknown distribution "{}", use normal, uniform or fixed'.format(distribution))
+
+
+def sweep_devices(spec):
+    """
+    Nominal parameters of the asymmetric_spiral_mzi devices of a sweep.
+    :return: Dict of 'name' and 'row' plus one array per parameter of MZI_PARAMETERS, 'etch_depth' and 'si_thickness'
+    """
+    from prescreen import device_names, sweep_table
+    from sweeps import row_stack
+
+    table = sweep_table(spec)
+    mzi = np.flatnonzero(table['device'] == 'asymmetric_spiral_mzi')
+    devices = {key: table[key][mzi] for key in MZI_PARAMETERS}
+    devices['name'] = device_names(spec, table, mzi)
+    devices['row'] = table['row'][mzi]
+    stacks = [row_stack(row) for row in spec['rows']]
+    devices['etch_depth'] = np.array([stacks[row]['etch_depth'] for row in devices['row']], dtype=float)
+    devices['si_thickness'] = np.array([stacks[row]['si_thickness'] for row in devices['row']], dtype=float)
+    return devices
+
+
+def through_extinction(split, lower_amplitude, upper_amplitude):
+    """
+    Extinction of the two through ports of an MZI of identical couplers, the lower of the two, in dB.
+    Port 0 carries c**2 * lower - s**2 * upper, which swings between their sum and their difference.
+
+    :param split: Power cross-coupling of the couplers
+    :param lower_amplitude: Field transmission of the lower arm
+    :param upper_amplitude: Field transmission of the upper arm
+    """
+    bar, cross = 1 - split, split
+    extinction = [(bar * first + cross * second) / np.maximum(np.abs(bar * first - cross * second), 1e-15)
+                  for first, second in ((lower_amplitude, upper_amplitude), (upper_amplitude, lower_amplitude))]
+    return 20 * np.log10(np.minimum(*extinction))
+
+
+def _draw_offsets(variation, rng, samples, devices):
+    """
+    Offsets of every varied parameter, shape (samples, 1) for die scope and (samples, devices) otherwise.
+    Parameters missing from variation are not varied.
+    """
+    offsets = {}
+    for name in VARIED_PARAMETERS:
+        specification = variation.get(name)
+        if specification is None:
+            offsets[name] = np.zeros((samples, 1))
+            continue
+        die = not callable(specification) and specification.get('scope', 'die') == 'die'
+        offsets[name] = draw(specification, rng, (samples, 1) if die else (samples, devices))
+    return offsets
+
+
+def _sample_chunk(devices, variation, seed, samples, table_directory):
+    """
+    Split ratios and extinctions of one chunk of samples.
+    :return: Arrays of shape (samples, devices)
+    """
+    rng = np.random.default_rng(seed)
+    offsets = _draw_offsets(variation, rng, samples, len(devices['coupling_gap']))
+
+    gap = devices['coupling_gap'] + offsets['gap'] - offsets['width']
+    etch_depth = devices['etch_depth'] + offsets['etch_depth']
+    si_thickness = devices['si_thickness'] + offsets['si_thickness']
+    if table_directory is None:
+        delta_n = supermode_index_difference(gap, WAVELENGTH, etch_depth, si_thickness)
+    else:
+        from mode_table import load_table
+        delta_n = load_table(table_directory).delta_n(gap, etch_depth, si_thickness, WAVELENGTH)
+    delta_n = delta_n * np.exp(DC_WIDTH_SENSITIVITY * offsets['width'])
+
+    split = np.sin(dc_coupling_phase(devices['coupling_length'], gap, WAVELENGTH, delta_n)) ** 2
+
+    lower, upper = arm_lengths(devices['upper_spiral_no'], devices['lower_spiral_no'], devices['spiral_gap'],
+                               devices['spiral_inner_gap'])
+    alpha = WAVEGUIDE_LOSS_DB_PER_CM / (20 * np.log10(np.e)) * 1e-4
+    return split, through_extinction(split, np.exp(-alpha * lower), np.exp(-alpha * upper))
+
+
+def run_monte_carlo(spec, samples=10000, seed=0, variation=None, table_directory=None, parallel=False,
+                    max_workers=None, split_tolerance=SPLIT_TOLERANCE, min_extinction=MIN_EXTINCTION):
+    """
+    Monte Carlo of the asymmetric_spiral_mzi devices of a sweep.
+
+    :param spec: Sweep description, see sweeps.py
+    :param samples: Number of samples per device
+    :param seed: Seed of the random numbers
+    :param variation: Variation dict, DEFAULT_VARIATION by default
+    :param table_directory: ModeTable directory for the supermode index difference, the analytic model if None
+    :param parallel: Run the chunks of samples in a pool of worker processes
+    :param max_workers: If parallel is True, limits the number of worker processes
+    :return: Dict with the device 'name' and 'row', the 'split' and 'extinction' of every sample, shape
+        (samples, devices), and the 'yield' of every device
+    """
+    variation = DEFAULT_VARIATION if variation is None else variation
+    devices = sweep_devices(spec)
+    chunks = [min(CHUNK_SIZE, samples - start) for start in range(0, samples, CHUNK_SIZE)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    arguments = [(devices, variation, chunk_seed, chunk, table_directory) for chunk_seed, chunk in zip(seeds, chunks)]
+
+    if parallel:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            results = list(pool.map(_sample_chunk, *zip(*arguments)))
+    else:
+        results = [_sample_chunk(*chunk_arguments) for chunk_arguments in arguments]
+
+    split = np.concatenate([result[0] for result in results])
+    extinction = np.concatenate([result[1] for result in results])
+    passed = (np.abs(split - 0.5) <= split_tolerance) & (extinction >= min_extinction)
+    return {'name': devices['name'], 'row': devices['row'], 'split': split, 'extinction': extinction,
+            'yield': passed.mean(axis=0)}
+
+
+def yield_map(result):
+    """
+    Device yields arranged by layout row.
+    :return: Dict of row index to the array of yields of its devices, in layout order
+    """
+    return {int(row): result['yield'][result['row'] == row] for row in np.unique(result['row'])}
+
+
+def format_yield_map(result, spec):
+    """
+    Human readable yield map, one line of percentages per layout row.
+    """
+    lines = []
+    for row, yields in yield_map(result).items():
+        label = spec['rows'][row].get('row_label') or spec['rows'][row]['name']
+        lines.append('{:>3} {:<45} {}'.format(row, label,
+                                              ' '.join('{:3.0f}'.format(100 * value) for value in yields)))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    from design_space import GRATING_SWEEP_FILE
+    from sweeps import load_sweep
+
+    parser = argparse.ArgumentParser(description='Monte Carlo of fabrication variation')
+    parser.add_argument('sweep', nargs='?', default=GRATING_SWEEP_FILE, help='Sweep file')
+    parser.add_argument('--samples', type=int, default=10000, help='Samples per device')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random numbers')
+    parser.add_argument('--table', help='ModeTable directory')
+    parser.add_argument('--parallel', action='store_true', help='Use a pool of worker processes')
+    parser.add_argument('--split-tolerance', type=float, default=SPLIT_TOLERANCE)
+    parser.add_argument('--min-extinction', type=float, default=MIN_EXTINCTION)
+    args = parser.parse_args(argv)
+
+    spec = load_sweep(args.sweep)
+    result = run_monte_carlo(spec, args.samples, args.seed, table_directory=args.table, parallel=args.parallel,
+                             split_tolerance=args.split_tolerance, min_extinction=args.min_extinction)
+    print('Yield in % per device, split within {} of 50:50 and extinction of at least {} dB, {} samples'
+          .format(args.split_tolerance, args.min_extinction, args.samples))
+    print(format_yield_map(result, spec))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
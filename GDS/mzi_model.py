@@ -0,0 +1,217 @@
+"""
+Compact model of the asymmetric_spiral_mzi transmission.
+
+The MZI is two identical directional couplers joined by the spiral arms. Each coupler follows
+coupled mode theory: the cross-coupled field goes as sin(kappa * L) with kappa = pi * delta_n / wavelength,
+delta_n being the index difference of the even and odd supermodes. delta_n decays exponentially
+with the gap, and the bends into and out of the coupling region add as much coupling as another
+sqrt(pi * R * decay length) of straight coupler. The arm lengths follow in closed form from
+the routing of asymmetric_spiral_mzi and spiral_length, and the phase of each arm from the
+effective index, expanded to first order in the wavelength with the group index.
+
+Every function broadcasts over NumPy arrays. Device parameters of shape (N,) and M wavelengths
+give spectra of shape (N, M, 2, 2), so a whole sweep is evaluated in one go. Ports are numbered
+as the ports of the couplers, the gratings sit on the channels of the fibre array (see fibre_array.py):
+    0 - lower waveguide: input grating on channel 1, lower spiral, output grating on the first channel
+        right of the second coupler, fibre_array.mzi_output_channel (channel 2 at least)
+    1 - upper waveguide: input grating on channel 0, upper spiral, output grating on the channel after that
+
+Usage: python mzi_model.py [sweep_file]
+"""
+
+import sys
+
+import numpy as np
+
+from parameters import *
+
+# Default wavelength grid of the spectra, in um
+WAVELENGTHS = np.linspace(1.5, 1.6, 2001)
+
+
+def effective_index(wavelength, n_eff=WAVEGUIDE_N_EFF, n_group=WAVEGUIDE_N_GROUP):
+    """
+    Effective index of the waveguide, to first order around WAVELENGTH.
+    """
+    return n_eff - (n_group - n_eff) * (np.asarray(wavelength) - WAVELENGTH) / WAVELENGTH
+
+
+def supermode_index_difference(gap, wavelength=WAVELENGTH, etch_depth=ETCH_DEPTH, si_thickness=SI_THICKNESS):
+    """
+    Index difference of the even and odd supermodes of two coupled waveguides. Away from the
+    ETCH_DEPTH and SI_THICKNESS of the stack it scales with the DC_*_SENSITIVITY parameters.
+
+    :param gap: Gap between the waveguides
+    :param wavelength: Wavelength
+    :param etch_depth: Etch depth of the rib waveguides
+    :param si_thickness: Thickness of the Si layer
+    :return: delta_n, broadcast over all arguments
+    """
+    return DC_DELTA_N * np.exp(-(np.asarray(gap) - DC_REFERENCE_GAP) / DC_DECAY_LENGTH
+                               + DC_DISPERSION * (np.asarray(wavelength) - WAVELENGTH)
+                               + DC_ETCH_SENSITIVITY * (np.asarray(etch_depth) - ETCH_DEPTH)
+                               + DC_THICKNESS_SENSITIVITY * (np.asarray(si_thickness) - SI_THICKNESS))
+
+
+def bend_coupling_length(bend_radius=BEND_RADIUS, decay_length=DC_DECAY_LENGTH):
+    """
+    Length of straight coupler which couples as much as the bends at both ends of a DC.
+    Near the coupling region two bends of radius R separate as x**2 / R, so the coupling there adds up
+    to the integral of exp(-x**2 / (R * decay_length)), which is sqrt(pi * R * decay_length).
+    """
+    return np.sqrt(np.pi * bend_radius * decay_length)
+
+
+def dc_coupling_phase(coupling_length, coupling_gap, wavelength=WAVELENGTH, delta_n=None):
+    """
+    kappa * L of a directional coupler, the cross-coupled power is sin(kappa * L)**2.
+
+    :param coupling_length: Length of the straight coupling region
+    :param coupling_gap: Gap between the waveguides
+    :param wavelength: Wavelength
+    :param delta_n: Supermode index difference, supermode_index_difference(coupling_gap, wavelength) by default
+    """
+    if delta_n is None:
+        delta_n = supermode_index_difference(coupling_gap, wavelength)
+    return np.pi * delta_n / wavelength * (np.asarray(coupling_length) + bend_coupling_length())
+
+
+def dc_cross_coupling(coupling_length, coupling_gap, wavelength=WAVELENGTH, delta_n=None):
+    """
+    Fraction of the power a directional coupler couples across, see dc_coupling_phase.
+    """
+    return np.sin(dc_coupling_phase(coupling_length, coupling_gap, wavelength, delta_n)) ** 2
+
+
+def arm_lengths(upper_spiral_no, lower_spiral_no, spiral_gap, spiral_inner_gap, width=WAVEGUIDE_WIDTH):
+    """
+    Waveguide length of the arms of asymmetric_spiral_mzi, from the first DC to the second.
+
+    Both arms start with the same routing into their spiral. After the spirals the upper arm turns
+    back by 180 degrees, runs 3 GRATING_TAPER_ROUTE and turns by 90 degrees, the lower arm turns by 90
+    degrees and runs straight to the end of the upper arm, which is 2 * BEND_RADIUS plus the difference
+    of the spiral diameters further.
+
+    :return: (lower arm length, upper arm length)
+    """
+    from spiral_geometry import spiral_length
+
+    r, t = BEND_RADIUS, GRATING_TAPER_ROUTE
+    outer_up = upper_spiral_no * (width + spiral_gap) + spiral_inner_gap
+    outer_low = lower_spiral_no * (width + spiral_gap) + spiral_inner_gap
+
+    lower = (3 * t + 2 * np.pi * r + 2 * r + 2 * (outer_up - outer_low)
+             + spiral_length(lower_spiral_no, spiral_gap, spiral_inner_gap, width))
+    upper = 5 * t + 3 * np.pi * r + spiral_length(upper_spiral_no, spiral_gap, spiral_inner_gap, width)
+    return lower, upper
+
+
+def arm_length_difference(upper_spiral_no, lower_spiral_no, spiral_gap, spiral_inner_gap):
+    """
+    Upper minus lower arm length of asymmetric_spiral_mzi.
+    """
+    lower, upper = arm_lengths(upper_spiral_no, lower_spiral_no, spiral_gap, spiral_inner_gap)
+    return upper - lower
+
+
+def free_spectral_range(delta_length, wavelength=WAVELENGTH, n_group=WAVEGUIDE_N_GROUP):
+    """
+    Free spectral range of an MZI with arm length difference delta_length.
+    """
+    with np.errstate(divide='ignore'):
+        return wavelength ** 2 / (n_group * np.abs(delta_length))
+
+
+def mzi_transfer(coupling_length, coupling_gap, upper_spiral_no, lower_spiral_no, spiral_gap, spiral_inner_gap,
+                 wavelengths=WAVELENGTHS, n_eff=WAVEGUIDE_N_EFF, n_group=WAVEGUIDE_N_GROUP,
+                 loss_db_per_cm=WAVEGUIDE_LOSS_DB_PER_CM, delta_n=None):
+    """
+    Field transmission of asymmetric_spiral_mzi devices. Takes the arguments of asymmetric_spiral_mzi as
+    scalars or arrays of one shape S. The losses of the gratings and of the routing outside the arms are not
+    included.
+
+    :param wavelengths: Wavelength grid, shape (M,)
+    :param delta_n: Supermode index difference of the couplers, shape S + (M,), supermode_index_difference by default
+    :return: Complex array of shape S + (M, 2, 2), indexed [..., wavelength, output port, input port]
+    """
+    def per_device(value):
+        return np.asarray(value, dtype=float)[..., np.newaxis]
+
+    wavelengths = np.asarray(wavelengths, dtype=float)
+    phase = dc_coupling_phase(per_device(coupling_length), per_device(coupling_gap), wavelengths, delta_n)
+    c, s = np.cos(phase), np.sin(phase)
+
+    lower, upper = arm_lengths(per_device(upper_spiral_no), per_device(lower_spiral_no), per_device(spiral_gap),
+                               per_device(spiral_inner_gap))
+    beta = 2 * np.pi * effective_index(wavelengths, n_eff, n_group) / wavelengths
+    # Field attenuation per um
+    alpha = loss_db_per_cm / (20 * np.log10(np.e)) * 1e-4
+    e_lower = np.exp((-1j * beta - alpha) * lower)
+    e_upper = np.exp((-1j * beta - alpha) * upper)
+
+    # Coupler [[c, -js], [-js, c]], arms diag(e_lower, e_upper), coupler again
+    transfer = np.empty(np.broadcast(phase, e_lower).shape + (2, 2), dtype=complex)
+    transfer[..., 0, 0] = c * c * e_lower - s * s * e_upper
+    transfer[..., 0, 1] = -1j * c * s * (e_lower + e_upper)
+    transfer[..., 1, 0] = transfer[..., 0, 1]
+    transfer[..., 1, 1] = c * c * e_upper - s * s * e_lower
+    return transfer
+
+
+def mzi_spectrum(*args, **kwargs):
+    """
+    Power transmission of asymmetric_spiral_mzi devices, mzi_transfer squared.
+    """
+    return np.abs(mzi_transfer(*args, **kwargs)) ** 2
+
+
+def extinction_ratio(power):
+    """
+    Ratio of the largest to the smallest transmission along the wavelength axis, in dB.
+    :param power: Power spectrum of shape S + (M, 2, 2)
+    :return: Array of shape S + (2, 2)
+    """
+    return 10 * np.log10(power.max(axis=-3) / np.maximum(power.min(axis=-3), 1e-30))
+
+
+def sweep_spectra(spec, wavelengths=WAVELENGTHS, **kwargs):
+    """
+    Power spectra of all asymmetric_spiral_mzi devices of a sweep, without building them.
+
+    :param spec: Sweep description, see sweeps.py
+    :param wavelengths: Wavelength grid
+    :param kwargs: Further arguments of mzi_transfer
+    :return: List of device names and their spectra, shape (N, M, 2, 2)
+    """
+    from prescreen import device_names, sweep_table
+
+    table = sweep_table(spec)
+    mzi = np.flatnonzero(table['device'] == 'asymmetric_spiral_mzi')
+    arguments = [table[key][mzi] for key in ('coupling_length', 'coupling_gap', 'upper_spiral_no', 'lower_spiral_no',
+                                             'spiral_gap', 'spiral_inner_gap')]
+    return device_names(spec, table, mzi), mzi_spectrum(*arguments, wavelengths=wavelengths, **kwargs)
+
+
+if __name__ == '__main__':
+    import time
+    from design_space import GRATING_SWEEP_FILE
+    from prescreen import sweep_table
+    from sweeps import load_sweep
+
+    sweep = load_sweep(sys.argv[1] if len(sys.argv) > 1 else GRATING_SWEEP_FILE)
+    start = time.perf_counter()
+    names, spectra = sweep_spectra(sweep)
+    elapsed = time.perf_counter() - start
+
+    table = sweep_table(sweep)
+    mzi = table['device'] == 'asymmetric_spiral_mzi'
+    delta_length = arm_length_difference(*[table[key][mzi] for key in ('upper_spiral_no', 'lower_spiral_no',
+                                                                       'spiral_gap', 'spiral_inner_gap')])
+    cross = dc_cross_coupling(table['coupling_length'][mzi], table['coupling_gap'][mzi])
+    extinction = extinction_ratio(spectra)
+
+    print('{} devices x {} wavelengths in {:.3f} s'.format(len(names), len(WAVELENGTHS), elapsed))
+    print('{:<45} {:>8} {:>9} {:>9} {:>10}'.format('device', 'DC cross', 'dL [um]', 'FSR [nm]', 'ER [dB]'))
+    for i, name in enumerate(names):
+        print('{:<45} {:>8.3f} {:>9.2f} {:>9.2f} {:>10.1f}'.format(
+            name, cross[i], delta_length[i], free_spectral_range(delta_length[i]) * 1e3, extinction[i, 0, 0]))
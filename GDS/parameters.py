@@ -13,6 +13,48 @@ LABEL_LAYER = (100, 0)
 CELL_VERTICAL_SPACING = 20
 CELL_HORIZONTAL_SPACING = 10
 
+###########################
+# DESIGN RULES
+###########################
+DRC_MIN_SPACING = 0.2
+DRC_MIN_BEND_RADIUS = BEND_RADIUS
+
+###########################
+# OPTICAL MODEL PARAMETERS
+###########################
+WAVELENGTH = 1.55
+SI_THICKNESS = 0.22
+ETCH_DEPTH = 0.12
+# TE0 mode of the WAVEGUIDE_WIDTH rib waveguide at WAVELENGTH
+WAVEGUIDE_N_EFF = 2.55
+WAVEGUIDE_N_GROUP = 3.95
+WAVEGUIDE_LOSS_DB_PER_CM = 2.0
+# Index difference of the even and odd DC supermodes at DC_REFERENCE_GAP and WAVELENGTH. It decays
+# exponentially with the gap over DC_DECAY_LENGTH and grows with the wavelength by DC_DISPERSION
+# (d ln(delta n) / d wavelength, 1/um). Gives 50:50 at a 12.2 um coupling length for a 0.3 um gap.
+DC_REFERENCE_GAP = 0.3
+DC_DELTA_N = 0.0269
+DC_DECAY_LENGTH = 0.155
+DC_DISPERSION = 2.0
+# First order sensitivity of ln(delta n) to the waveguide width, etch depth and Si thickness, in 1/um.
+# The etch depth and Si thickness values follow from the hand-tuned 50:50 lengths of the DC sweeps.
+DC_WIDTH_SENSITIVITY = -4.0
+DC_ETCH_SENSITIVITY = -10.0
+DC_THICKNESS_SENSITIVITY = 3.0
+
+###########################
+# THERMO-OPTIC PARAMETERS
+###########################
+BOX_THICKNESS = 2.0
+# Oxide between the top of the Si and the heater
+CLADDING_THICKNESS = 1.0
+HEATER_WIDTH = 2.0
+HEATER_LENGTH = 100.0
+OXIDE_THERMAL_CONDUCTIVITY = 1.4
+# d n_eff / dT of the waveguide mode in 1/K, and its second derivative in 1/K^2
+THERMO_OPTIC_COEFFICIENT = 1.8e-4
+THERMO_OPTIC_SECOND_ORDER = 0.
+
 ###########################
 # GRATING COUPLER PARAMETERS
 ###########################
@@ -50,3 +92,5 @@ LABEL_ORIGIN_HORIZONTAL = [-280, -110]
 LABEL_HEIGHT = 10
 LABEL_ANGLE_VERTICAL = np.pi / 2
 LABEL_ANGLE_HORIZONTAL = 0
+# 'polygons', 'glyphs' (shared glyph cells) or 'text' (GDS TEXT elements), see labels.py
+LABEL_MODE = 'glyphs'
@@ -0,0 +1,126 @@
+"""
+Layout-wide check of the grating coupler positions.
+
+grating_checker in components.py compares one pair of gratings while a device is built.
+This module collects the port of every grating placed in a layout into one array and
+checks all of them at once: within a device, every grating has to sit on the same y as the
+first one, at a multiple of GRATING_PITCH from it and within the channels of the fibre array.
+Problems are returned as rows of a report, which can be written to CSV.
+"""
+
+import csv
+from collections import namedtuple
+
+import numpy as np
+
+from parameters import *
+
+# Positions are compared to within a nanometre
+TOLERANCE = 1e-3
+
+# One row of the report. first and second are the indices of the gratings in the device,
+# in the order they were added, kind is 'y_offset', 'pitch' or 'channels'
+AlignmentError = namedtuple('AlignmentError', ['device', 'first', 'second', 'first_origin', 'second_origin',
+                                               'kind', 'error'])
+
+
+def pitch_error(x_diff, pitch=GRATING_PITCH):
+    """
+    Distance of x_diff from the nearest multiple of pitch, works on arrays.
+    """
+    return x_diff - np.round(x_diff / pitch) * pitch
+
+
+def _collect(cell, origin, angle, found):
+    # Every placement of a cell is a separate device, even if the cell is placed more than once
+    instance = found['count']
+    found['count'] += 1
+    rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    for ref in cell.cells:
+        position = origin + rotation.dot(np.asarray(ref['origin'], dtype=float))
+        if ref['cell'].name.startswith('GC_period_'):
+            # Grating cells are drawn with their port at (0, 0)
+            found['devices'].append(cell.name)
+            found['instances'].append(instance)
+            found['positions'].append(position)
+        else:
+            _collect(ref['cell'], position, angle + (ref['angle'] or 0), found)
+
+
+def collect_grating_ports(cells):
+    """
+    Finds every grating placed in the given cells and the cells they reference.
+
+    :param cells: A cell (e.g. the generated design space) or a list of cells
+    :return: (names of the cells the gratings are placed in, placement index of those cells,
+        (N, 2) array of port origins), in the order the gratings were added
+    """
+    if not isinstance(cells, (list, tuple)):
+        cells = [cells]
+
+    found = {'count': 0, 'devices': [], 'instances': [], 'positions': []}
+    for cell in cells:
+        _collect(cell, np.zeros(2), 0., found)
+
+    return (np.array(found['devices']), np.array(found['instances'], dtype=int),
+            np.array(found['positions']).reshape(-1, 2))
+
+
+def check_grating_alignment(cells, pitch=GRATING_PITCH, channels=VGA_NUM_CHANNELS, tolerance=TOLERANCE):
+    """
+    Checks the gratings of every device against the first grating of that device.
+
+    :param cells: A cell or list of cells, see collect_grating_ports
+    :param pitch: Pitch of the fibre array
+    :param channels: Number of channels of the fibre array
+    :param tolerance: Largest position error which is accepted
+    :return: List of AlignmentError, empty if all gratings are placed correctly
+    """
+    devices, instances, positions = collect_grating_ports(cells)
+    if not len(devices):
+        return []
+
+    # Group the gratings by device placement, keeping the order they were added in
+    order = np.argsort(instances, kind='stable')
+    group_ids, first, counts = np.unique(instances[order], return_index=True, return_counts=True)
+    group = np.repeat(np.arange(len(group_ids)), counts)
+    devices, positions = devices[order], positions[order]
+    reference = first[group]
+    index_in_device = np.arange(len(devices)) - reference
+    diff = positions - positions[reference]
+
+    # Fibre array channel of every grating, counted from the first one of its device
+    channel = np.round(diff[:, 0] / pitch)
+    highest = np.full(len(group_ids), -np.inf)
+    lowest = np.full(len(group_ids), np.inf)
+    np.maximum.at(highest, group, channel)
+    np.minimum.at(lowest, group, channel)
+    overflow = (highest - lowest + 1 - channels)[group]
+
+    errors = {
+        'y_offset': diff[:, 1],
+        'pitch': pitch_error(diff[:, 0], pitch),
+        # Reported once per device, at its outermost grating, as the distance beyond the array
+        'channels': np.where((overflow > 0) & (channel == highest[group]), overflow * pitch, 0),
+    }
+
+    report = []
+    for kind, error in errors.items():
+        for i in np.flatnonzero(np.abs(error) > tolerance):
+            report.append(AlignmentError(str(devices[i]), 0, int(index_in_device[i]), tuple(positions[reference[i]]),
+                                         tuple(positions[i]), kind, float(error[i])))
+
+    return sorted(report, key=lambda row: (row.device, row.second))
+
+
+def write_report_csv(report, filename):
+    """
+    Writes a report of check_grating_alignment to a CSV file, one row per problem.
+    """
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['device', 'first', 'second', 'first_x', 'first_y', 'second_x', 'second_y', 'kind',
+                         'error'])
+        for row in report:
+            writer.writerow([row.device, row.first, row.second, *row.first_origin, *row.second_origin, row.kind,
+                             row.error])
@@ -0,0 +1,486 @@
+"""
+Pre-screening of a sweep before any geometry is generated.
+
+The bounding box of every device is computed from its parameters with NumPy, using the
+same routing as the component functions in components.py. The GridLayout row packing of
+design_space.py is then simulated on those boxes, which tells whether the sweep fits in the
+design space, how much of it is used and which devices are the largest. This takes
+milliseconds where building the layout takes minutes.
+
+Usage: python prescreen.py [sweep_file]
+"""
+
+import sys
+
+import numpy as np
+
+from fibre_array import FibreArrayPacker, mzi_output_channel, row_fibre_array, spiral_winding_channel
+from parameters import *
+from spiral_geometry import spiral_footprint
+from sweeps import load_sweep, row_arrays, row_device, row_points
+
+# DirectionalCoupler default bend angle in gdshelpers
+DC_BEND_ANGLE = np.pi / 5
+
+# Spacing, alignment and title of the GridLayout made by design_space.generate_blank_gds
+LAYOUT_SETTINGS = {
+    'vertical_spacing': 10,
+    'vertical_alignment': 1,
+    'horizontal_spacing': 10,
+    'horizontal_alignment': 10,
+    'text_size': LABEL_HEIGHT,
+    'row_text_size': 15,
+    'line_width': 1,
+    'title': 'JMO_YTY_Nanofab_2024',
+    'align_title_line': True,
+}
+
+
+def grating_extent(params=coupler_parameters, teeth_params=teeth_coupler_parameters):
+    """
+    Size of a CornerstoneGratingCoupler, from the coupler parameters.
+    :return: (half width of the fan, length from the port to the last tooth)
+    """
+    length = params['taper_length'] + params['n_gratings'] * params['grating_period']
+    half_angle = max(params['full_opening_angle'], teeth_params['full_opening_angle']) / 2
+    return length * np.sin(half_angle), length
+
+
+def text_lengths(texts, height=LABEL_HEIGHT, font='stencil'):
+    """
+    Length of the longest line and number of lines of each text, as gdshelpers' Text
+    would render it, from the font's character widths and kerning only.
+
+    :param texts: List of strings
+    :return: (longest line length array, line count array)
+    """
+    from gdshelpers.parts._fonts import FONTS
+
+    font = FONTS[font]
+    widths = np.zeros(128)
+    kerning = np.zeros((128, 128))
+    for char, glyph in font.items():
+        widths[ord(char)] = glyph['width']
+        for other, value in glyph['kerning'].items():
+            kerning[ord(char), ord(other)] = value
+
+    lines = [line for text in texts for line in text.split('\n')]
+    line_counts = np.array([text.count('\n') + 1 for text in texts])
+    if not lines:
+        return np.zeros(0), line_counts
+
+    codes = np.frombuffer(''.join(lines).encode('ascii', 'replace'), dtype=np.uint8) & 127
+    line_lengths = np.array([len(line) for line in lines])
+    line_starts = np.concatenate(([0], np.cumsum(line_lengths)[:-1]))
+
+    # Kerning applies between neighbouring characters of the same line only
+    pair_kerning = np.append(kerning[codes[:-1], codes[1:]], 0)
+    pair_kerning[np.cumsum(line_lengths)[line_lengths > 0] - 1] = 0
+    advance = widths[codes] + pair_kerning
+
+    per_line = np.zeros(len(lines))
+    non_empty = line_lengths > 0
+    per_line[non_empty] = np.add.reduceat(advance, line_starts[non_empty]) * height
+
+    first_line = np.concatenate(([0], np.cumsum(line_counts)[:-1]))
+    return np.maximum.reduceat(per_line, first_line), line_counts
+
+
+def label_bounds(texts):
+    """
+    Bounds of labels placed like the device labels (LABEL_ORIGIN, LABEL_HEIGHT, LABEL_ANGLE_VERTICAL).
+    :return: (N, 4) array of (min_x, min_y, max_x, max_y)
+    """
+    lengths, counts = text_lengths(texts)
+    # Text is rotated by 90 degrees: lines run upwards and stack towards -x
+    thickness = (counts - 1) * 1.5 * LABEL_HEIGHT + LABEL_HEIGHT
+    return np.stack([LABEL_ORIGIN[0] - thickness, np.full(len(texts), LABEL_ORIGIN[1]),
+                     np.full(len(texts), LABEL_ORIGIN[0]), LABEL_ORIGIN[1] + lengths], axis=1)
+
+
+def _spiral_half_along(number, gap_size, inner_gap_size):
+    return spiral_footprint(number, gap_size, inner_gap_size)[1] / 2
+
+
+def asymmetric_spiral_mzi_channels(coupling_length, upper_spiral_no, spiral_gap, spiral_inner_gap):
+    """
+    Fibre array channel of the first output grating of asymmetric_spiral_mzi devices, see
+    fibre_array.mzi_output_channel. All arguments are arrays of the same length.
+    """
+    w, r, t, pitch = WAVEGUIDE_WIDTH, BEND_RADIUS, GRATING_TAPER_ROUTE, GRATING_PITCH
+    dc_run = 4 * r * np.sin(DC_BEND_ANGLE) + coupling_length
+    outer_up = upper_spiral_no * (w + spiral_gap) + spiral_inner_gap
+
+    # Both spirals start 3 bends and 1 straight after the first DC
+    spiral_x = pitch + r + t + dc_run + t + 3 * r
+    return mzi_output_channel(spiral_x + 2 * outer_up + 3 * r + dc_run)
+
+
+def asymmetric_spiral_mzi_bounds(coupling_length, coupling_gap, upper_spiral_no, lower_spiral_no, spiral_gap,
+                                 spiral_inner_gap):
+    """
+    Bounds of asymmetric_spiral_mzi devices (without label), from their parameters.
+    All arguments are arrays of the same length.
+
+    :return: (N, 4) bounds array and a boolean array which is False where the routing of
+        asymmetric_spiral_mzi fails, i.e. the lower spiral is too large or the device needs
+        more fibre array channels than there are
+    """
+    w, r, t, pitch = WAVEGUIDE_WIDTH, BEND_RADIUS, GRATING_TAPER_ROUTE, GRATING_PITCH
+    half_width, length = grating_extent()
+    dc_offset = 4 * r * (1 - np.cos(DC_BEND_ANGLE)) + w + coupling_gap
+
+    outer_up = upper_spiral_no * (w + spiral_gap) + spiral_inner_gap
+    outer_low = lower_spiral_no * (w + spiral_gap) + spiral_inner_gap
+    channel = asymmetric_spiral_mzi_channels(coupling_length, upper_spiral_no, spiral_gap, spiral_inner_gap)
+
+    upper_spiral_y = t + r + dc_offset + t + 3 * r
+    top = upper_spiral_y + np.maximum(r, _spiral_half_along(upper_spiral_no, spiral_gap, spiral_inner_gap)) + w / 2
+    bottom = -np.maximum(np.maximum(r, _spiral_half_along(lower_spiral_no, spiral_gap, spiral_inner_gap)) + w / 2,
+                         length)
+
+    feasible = (channel + 1 < VGA_NUM_CHANNELS) & (2 * outer_low <= 2 * outer_up + 2 * r)
+
+    n = len(top)
+    return np.stack([np.full(n, -half_width), bottom, (channel + 1) * pitch + half_width, top], axis=1), feasible
+
+
+def spiral_winding_channels(number, gap_size, inner_gap_size):
+    """
+    Fibre array channel of the output grating of spiral_winding devices, see fibre_array.spiral_winding_channel.
+    """
+    # The spiral is centred on the x of its input port, a bend radius left of the input grating
+    right = -BEND_RADIUS + _spiral_half_along(number, gap_size, inner_gap_size) + WAVEGUIDE_WIDTH / 2
+    return spiral_winding_channel(right)
+
+
+def spiral_winding_bounds(number, gap_size, inner_gap_size):
+    """
+    Bounds of spiral_winding devices (without label), from their parameters.
+    :return: (N, 4) bounds array and a boolean array which is False where the device needs more
+        fibre array channels than there are
+    """
+    w, r, t, pitch = WAVEGUIDE_WIDTH, BEND_RADIUS, GRATING_TAPER_ROUTE, GRATING_PITCH
+    half_width, length = grating_extent()
+    outer = number * (w + gap_size) + inner_gap_size
+    half_along = _spiral_half_along(number, gap_size, inner_gap_size)
+
+    channels = spiral_winding_channels(number, gap_size, inner_gap_size)
+    feasible = channels < VGA_NUM_CHANNELS
+
+    left = np.minimum(np.minimum(-half_width, -t - r - r - w / 2), -t - half_along - w / 2)
+    top = t + r + 2 * outer + 2 * r + w / 2
+    return np.stack([left, np.full(len(top), -length), channels * pitch + half_width, top], axis=1), feasible
+
+
+def grating_coupler_bounds(n):
+    """
+    Bounds of n grating_coupler loopbacks (without label), which do not depend on parameters.
+    """
+    w, r, pitch = WAVEGUIDE_WIDTH, BEND_RADIUS, GRATING_PITCH
+    half_width, length = grating_extent()
+    right = r + (pitch - 2 * r + 19) + r
+    return np.tile([-half_width, -length, right + half_width, 10 + r + w / 2], (n, 1)), np.ones(n, dtype=bool)
+
+
+def _has_text(row):
+    """
+    Whether the devices of a row carry text: a label of the sweep, or the one spiral_winding
+    and grating_coupler add themselves.
+    """
+    if 'label' in row or row['device'] in ('spiral_winding', 'grating_coupler'):
+        return True
+    sweep = row.get('sweep', {})
+    return sweep.get('mode') == 'list' and any('label' in point for point in sweep['points'])
+
+
+def _device_texts(device, kwargs, name, label):
+    """
+    Texts placed on a device: its sweep label and the label spiral_winding and grating_coupler add.
+    """
+    texts = [label] if label else []
+    if device == 'grating_coupler':
+        texts.append(name)
+    elif device == 'spiral_winding':
+        texts.append(name + '\nNo_loops_' + str(kwargs['number']) + '\nGapbetween_waveguides_'
+                     + str(kwargs['gap_size']) + '\nInner_circle_radius_' + str(kwargs['inner_gap_size']))
+    return texts
+
+
+def sweep_table(spec):
+    """
+    Flattens a sweep description into columns, without building anything. The parameters of
+    every row come from sweeps.row_arrays. Text is only formatted for the rows whose bounds
+    depend on it, see device_names for the names of the devices.
+
+    :return: dict of 'row', 'index' (in its row) and 'device' arrays, one float array per parameter
+        (NaN for devices which do not take it), and the 'text' of every label on the devices with
+        the device index of each in 'text_owner'
+    """
+    sizes, devices, columns = [], [], []
+    texts, owners = [], []
+    start = 0
+    for row in spec['rows']:
+        n, row_columns = row_arrays(row)
+        sizes.append(n)
+        devices.append(row['device'])
+        columns.append(row_columns)
+
+        if _has_text(row):
+            for i, point in enumerate(row_points(row)):
+                kwargs, name, label = row_device(row, i, point)
+                for text in _device_texts(row['device'], kwargs, name, label):
+                    texts.append(text)
+                    owners.append(start + i)
+        start += n
+
+    sizes = np.array(sizes, dtype=int)
+    row_ids = np.repeat(np.arange(len(sizes)), sizes)
+    table = {'row': row_ids, 'index': np.arange(start) - np.repeat(np.cumsum(sizes) - sizes, sizes),
+             'device': np.repeat(np.array(devices, dtype=str), sizes),
+             'text': texts, 'text_owner': np.array(owners, dtype=int)}
+    for key in {key for row_columns in columns for key in row_columns}:
+        table[key] = np.concatenate([row_columns.get(key, np.full(n, np.nan))
+                                     for n, row_columns in zip(sizes, columns)])
+    return table
+
+
+def device_names(spec, table, indices=None):
+    """
+    Names of devices of a sweep table, only those asked for are formatted.
+    :param indices: Table indices of the devices, all devices if None
+    :return: List of names, in the order of indices
+    """
+    indices = np.arange(len(table['row'])) if indices is None else np.asarray(indices, dtype=int)
+    points = {}
+    names = []
+    for k in indices:
+        row_id, i = int(table['row'][k]), int(table['index'][k])
+        if row_id not in points:
+            points[row_id] = row_points(spec['rows'][row_id])
+        names.append(row_device(spec['rows'][row_id], i, points[row_id][i])[1])
+    return names
+
+
+def device_bounds(table):
+    """
+    Bounds of every device in a sweep table, including the labels.
+    :return: (N, 4) bounds array and feasibility array, see asymmetric_spiral_mzi_bounds
+    """
+    n = len(table['row'])
+    bounds = np.zeros((n, 4))
+    feasible = np.ones(n, dtype=bool)
+
+    for device, function, columns in (
+            ('asymmetric_spiral_mzi', asymmetric_spiral_mzi_bounds,
+             ('coupling_length', 'coupling_gap', 'upper_spiral_no', 'lower_spiral_no', 'spiral_gap',
+              'spiral_inner_gap')),
+            ('spiral_winding', spiral_winding_bounds, ('number', 'gap_size', 'inner_gap_size'))):
+        mask = table['device'] == device
+        if mask.any():
+            bounds[mask], feasible[mask] = function(*[table[column][mask] for column in columns])
+
+    mask = table['device'] == 'grating_coupler'
+    if mask.any():
+        bounds[mask], feasible[mask] = grating_coupler_bounds(mask.sum())
+
+    if table['text']:
+        owners = table['text_owner']
+        text_box = label_bounds(table['text'])
+        np.minimum.at(bounds[:, 0], owners, text_box[:, 0])
+        np.minimum.at(bounds[:, 1], owners, text_box[:, 1])
+        np.maximum.at(bounds[:, 2], owners, text_box[:, 2])
+        np.maximum.at(bounds[:, 3], owners, text_box[:, 3])
+
+    return bounds, feasible
+
+
+def device_channels(table):
+    """
+    Fibre array channel of the last grating of every device in a sweep table, counted from its first one.
+    """
+    channels = np.ones(len(table['row']), dtype=int)
+    for device, function, columns in (
+            ('asymmetric_spiral_mzi', asymmetric_spiral_mzi_channels,
+             ('coupling_length', 'upper_spiral_no', 'spiral_gap', 'spiral_inner_gap')),
+            ('spiral_winding', spiral_winding_channels, ('number', 'gap_size', 'inner_gap_size'))):
+        mask = table['device'] == device
+        if mask.any():
+            channels[mask] = function(*[table[column][mask] for column in columns])
+    # The second output grating of the MZI is on the next channel
+    channels[table['device'] == 'asymmetric_spiral_mzi'] += 1
+    return channels
+
+
+def fibre_array_items(spec, bounds, rows, channels):
+    """
+    Groups the devices of rows with a "fibre_array" entry into the array cells design_space makes of them,
+    see fibre_array.py.
+
+    :param bounds: (N, 4) device bounds, relative to the first grating of every device
+    :param rows: Row index of every device
+    :param channels: Channel of the last grating of every device, see device_channels
+    :return: Bounds and row index of every item of the layout
+    """
+    items, item_rows = [], []
+    for row_id in np.unique(rows):
+        members = np.flatnonzero(rows == row_id)
+        settings = row_fibre_array(spec['rows'][row_id], row_id)
+        if settings is None:
+            items.extend(bounds[members])
+            item_rows.extend([row_id] * len(members))
+            continue
+
+        packer = FibreArrayPacker(**settings[1])
+        first_item = len(items)
+        for i in members:
+            array, channel = packer.place(bounds[i, 0], bounds[i, 2], channels[i])
+            box = bounds[i] + [channel * packer.pitch, 0, channel * packer.pitch, 0]
+            if first_item + array == len(items):
+                items.append(box)
+                item_rows.append(row_id)
+            else:
+                items[-1] = np.concatenate([np.minimum(items[-1][:2], box[:2]), np.maximum(items[-1][2:], box[2:])])
+    return np.array(items).reshape(-1, 4), np.array(item_rows, dtype=int)
+
+
+def _next_align(x, alignment):
+    """
+    Vectorised GridLayout._next_x_align / _next_y_align.
+    """
+    if not alignment:
+        return x
+    x = np.asarray(x, dtype=float)
+    return np.where(np.isclose(x % alignment, 0), x, (x // alignment + 1) * alignment)
+
+
+def simulate_grid_layout(bounds, rows, settings=LAYOUT_SETTINGS, row_labels=None):
+    """
+    Places devices like GridLayout(tight=True).generate_layout, using only their bounds.
+    Every row starts with the label item that GridLayout.begin_new_row adds.
+
+    :param bounds: (N, 4) device bounds
+    :param rows: Row index of every device, devices of a row must be consecutive
+    :param row_labels: Optional row label (or None) of every row
+    :return: dict with the 'origin' (N, 2) of every device box, the 'row_extent' (rows, 2) of
+        every row and the total 'width' and 'height' of the layout
+    """
+    hs, vs = settings['horizontal_spacing'], settings['vertical_spacing']
+    ha, va = settings['horizontal_alignment'], settings['vertical_alignment']
+
+    # add_to_row: the box is moved so that its lower left corner is within the first alignment cell,
+    # which uses the vertical alignment for both axes
+    offset = (bounds[:, :2] % va + va) % va if va else np.zeros((len(bounds), 2))
+    size = bounds[:, 2:] - bounds[:, :2] + offset
+
+    origins = np.zeros((len(bounds), 2))
+    row_ids, starts = np.unique(rows, return_index=True)
+    ends = np.append(starts[1:], len(rows))
+    row_extent = np.zeros((len(row_ids), 2))
+
+    # Row labels are left-center aligned text boxes starting at the origin
+    label_size = np.zeros((len(row_ids), 2))
+    if row_labels is not None:
+        labelled = [k for k, row_id in enumerate(row_ids) if row_labels[row_id]]
+        if labelled:
+            label_size[labelled, 0] = text_lengths([row_labels[row_ids[k]] for k in labelled],
+                                                   height=settings['row_text_size'])[0]
+            label_size[labelled, 1] = settings['row_text_size'] / 2
+
+    y = vs
+    limit_x = limit_y = 0.
+    for k, (start, end) in enumerate(zip(starts, ends)):
+        y = float(_next_align(y, va))
+        widths = size[start:end, 0]
+
+        # The label item, then every position is the aligned end of the previous item plus spacing
+        x = np.empty(end - start)
+        x[0] = _next_align(hs + label_size[k, 0] + hs, ha)
+        x[1:] = x[0] + np.cumsum(_next_align(widths[:-1] + hs, ha)) if ha else x[0] + np.cumsum(widths[:-1] + hs)
+        origins[start:end, 0] = x
+        origins[start:end, 1] = y
+
+        max_height = max(size[start:end, 1].max(), label_size[k, 1])
+        row_extent[k] = (x[-1] + widths[-1] + hs, y + max_height + vs)
+        limit_x = max(limit_x, row_extent[k, 0])
+        y = y + max_height + vs
+        limit_y = max(limit_y, y)
+
+    # Title line on top, as in GridLayout.generate_layout
+    lw, ts = settings['line_width'], settings['text_size']
+    if settings['title']:
+        # A single short text, its exact ink bounds are cheap enough
+        from gdshelpers.parts.text import Text
+        title_bounds = Text([0, 0], ts, settings['title']).get_shapely_object().bounds
+        title_vertical_space = title_bounds[3] + 0.7 * ts + lw
+        limit_x = max(limit_x, title_bounds[2] + ts + lw)
+        if settings['align_title_line']:
+            title_vertical_space = _next_align(title_vertical_space, va) - lw / 2.
+        if _next_align(y, va) - limit_y < title_vertical_space:
+            y = _next_align(limit_y + title_vertical_space, va)
+    else:
+        y = _next_align(y + lw, va)
+
+    return {'origin': origins, 'row_extent': row_extent,
+            'width': float(_next_align(limit_x, ha)), 'height': float(y)}
+
+
+def prescreen(spec, d_width=6000, d_height=3000, settings=LAYOUT_SETTINGS, n_largest=5):
+    """
+    Checks whether a sweep fits in the design space of generate_blank_gds, without building it.
+
+    :param spec: Sweep description, see sweeps.py
+    :param d_width: Width of the design space
+    :param d_height: Height of the design space
+    :param n_largest: Number of largest devices to report
+    :return: Report dict
+    """
+    table = sweep_table(spec)
+    bounds, feasible = device_bounds(table)
+    items, item_rows = fibre_array_items(spec, bounds, table['row'], device_channels(table))
+    layout = simulate_grid_layout(items, item_rows, settings, [row.get('row_label') for row in spec['rows']])
+
+    sizes = bounds[:, 2:] - bounds[:, :2]
+    areas = sizes[:, 0] * sizes[:, 1]
+    largest = np.argsort(areas)[::-1][:n_largest]
+    unroutable = np.flatnonzero(~feasible)
+    names = device_names(spec, table, np.concatenate([unroutable, largest]))
+
+    return {
+        'fits': bool(layout['width'] <= d_width and layout['height'] <= d_height and feasible.all()),
+        'devices': len(table['row']),
+        'width': layout['width'],
+        'height': layout['height'],
+        'utilisation': float(areas.sum() / (d_width * d_height)),
+        'rows_too_wide': [int(k) for k in np.flatnonzero(layout['row_extent'][:, 0] > d_width)],
+        'rows_too_high': [int(k) for k in np.flatnonzero(layout['row_extent'][:, 1] > d_height)],
+        'unroutable': names[:len(unroutable)],
+        'largest': [(name, float(sizes[i, 0]), float(sizes[i, 1]))
+                    for name, i in zip(names[len(unroutable):], largest)],
+    }
+
+
+def format_report(report, d_width=6000, d_height=3000):
+    """
+    Human readable version of a prescreen report.
+    """
+    lines = ['{} - {} devices, layout {:.0f} x {:.0f} um in a {} x {} um design space, {:.1%} filled'.format(
+        'FITS' if report['fits'] else 'DOES NOT FIT', report['devices'], report['width'], report['height'],
+        d_width, d_height, report['utilisation'])]
+    if report['rows_too_wide']:
+        lines.append('Rows wider than the design space: {}'.format(report['rows_too_wide']))
+    if report['rows_too_high']:
+        lines.append('Rows beyond the top of the design space: {}'.format(report['rows_too_high']))
+    if report['unroutable']:
+        lines.append('Devices whose routing fails: {}'.format(', '.join(report['unroutable'])))
+    lines.append('Largest devices:')
+    lines += ['    {} ({:.1f} x {:.1f} um)'.format(*entry) for entry in report['largest']]
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    from design_space import GRATING_SWEEP_FILE
+
+    sweep_report = prescreen(load_sweep(sys.argv[1] if len(sys.argv) > 1 else GRATING_SWEEP_FILE))
+    print(format_report(sweep_report))
+    sys.exit(0 if sweep_report['fits'] else 1)
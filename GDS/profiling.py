@@ -0,0 +1,306 @@
+"""
+Opt-in profiling of the GDS build.
+
+While a Profiler is active it records, per stage, the wall time, number of calls, the
+polygons and vertices produced and the peak memory. Stages are
+    - the steps of populate_gds (device sweep, layout generation, checks, saving),
+    - every device and every component function of components.py,
+    - the gdshelpers calls the time usually goes into (grating construction,
+      DirectionalCoupler.make_at_port, polygonization of spirals, waveguides and labels,
+      GridLayout.generate_layout, Cell.save).
+Nothing is recorded, and the gdshelpers functions are left alone, when no Profiler is active.
+Only the main process is profiled, so profile serial builds (parallel=False).
+
+The results are written as a JSON report and as collapsed stacks (one "a;b;c <microseconds>"
+line per call path), which flamegraph.pl and speedscope read directly.
+
+Usage::
+
+    with Profiler() as profiler:
+        populate_gds(layout_cell, polygon)
+    profiler.write_json('profile.json')
+    profiler.write_collapsed('profile.collapsed')
+
+or ``python profiling.py [output prefix]`` to profile design_space.py.
+"""
+
+import functools
+import json
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# The active Profiler, if any
+_ACTIVE = None
+
+
+def _max_rss():
+    """
+    Peak resident memory of the process in bytes, None where it is not available.
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def _geometry_counts(geometry):
+    """
+    (polygons, vertices) of a shapely geometry, Cell or list of those.
+    """
+    if hasattr(geometry, 'layer_dict'):
+        geometry = [item for items in geometry.layer_dict.values() for item in items]
+    if isinstance(geometry, (list, tuple)):
+        counts = [_geometry_counts(item) for item in geometry]
+        return sum(c[0] for c in counts), sum(c[1] for c in counts)
+    if hasattr(geometry, 'geoms'):
+        return _geometry_counts(list(geometry.geoms))
+    if hasattr(geometry, 'exterior'):
+        return 1, len(geometry.exterior.coords) + sum(len(ring.coords) for ring in geometry.interiors)
+    # gdshelpers parts which have not been polygonized yet are counted when they are
+    return 0, 0
+
+
+class _Stage:
+    """
+    Totals of one call path.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.
+        self.children_wall = 0.
+        self.polygons = 0
+        self.vertices = 0
+        self.peak_bytes = 0
+
+    def as_dict(self):
+        return {'calls': self.calls, 'wall_s': self.wall, 'self_s': self.wall - self.children_wall,
+                'polygons': self.polygons, 'vertices': self.vertices,
+                'peak_bytes': self.peak_bytes or None}
+
+
+class Profiler:
+    """
+    Collects stage and device statistics while it is active (inside a with block).
+    """
+
+    def __init__(self, trace_memory=False):
+        """
+        :param trace_memory: Measure the peak Python memory of every stage with tracemalloc.
+            This slows the build down noticeably, without it only the peak resident memory
+            of the whole process is reported.
+        """
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self.devices = []
+        self.wall = 0.
+        self._stack = []
+        self._patches = []
+        self._geometry_depth = 0
+        self._start = None
+
+    def __enter__(self):
+        global _ACTIVE
+        if _ACTIVE is not None:
+            raise AssertionError('Only one Profiler can be active at a time')
+        _ACTIVE = self
+        if self.trace_memory:
+            tracemalloc.start()
+        self._patch_gdshelpers()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _ACTIVE
+        self.wall += time.perf_counter() - self._start
+        for owner, name, original in reversed(self._patches):
+            setattr(owner, name, original)
+        self._patches = []
+        if self.trace_memory:
+            tracemalloc.stop()
+        _ACTIVE = None
+
+    def _patch(self, owner, name, stage_name, count_result=False):
+        """
+        Replaces owner.name by a wrapper which runs it as a stage, until the profiler exits.
+        """
+        original = owner.__dict__[name]
+        is_classmethod = isinstance(original, classmethod)
+        function = original.__func__ if is_classmethod else original
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with self.stage(stage_name):
+                self._geometry_depth += count_result
+                try:
+                    result = function(*args, **kwargs)
+                finally:
+                    self._geometry_depth -= count_result
+                # Parts polygonize their sub-parts, count the outermost result only
+                if count_result and not self._geometry_depth:
+                    self.count_geometry(result)
+                return result
+
+        setattr(owner, name, classmethod(wrapper) if is_classmethod else wrapper)
+        self._patches.append((owner, name, original))
+
+    def _patch_gdshelpers(self):
+        from gdshelpers.geometry.chip import Cell
+        from gdshelpers.layout import GridLayout
+        from gdshelpers.parts.coupler import GratingCoupler
+        from gdshelpers.parts.spiral import Spiral
+        from gdshelpers.parts.splitter import DirectionalCoupler
+        from gdshelpers.parts.text import Text
+        from gdshelpers.parts.waveguide import Waveguide
+
+        self._patch(GratingCoupler, 'make_traditional_coupler', 'GratingCoupler.make_traditional_coupler')
+        self._patch(GratingCoupler, 'get_shapely_object', 'GratingCoupler.get_shapely_object', True)
+        self._patch(DirectionalCoupler, 'make_at_port', 'DirectionalCoupler.make_at_port')
+        self._patch(DirectionalCoupler, 'get_shapely_object', 'DirectionalCoupler.get_shapely_object', True)
+        self._patch(Spiral, 'get_shapely_object', 'Spiral.get_shapely_object', True)
+        self._patch(Waveguide, 'get_shapely_object', 'Waveguide.get_shapely_object', True)
+        self._patch(Text, 'get_shapely_object', 'Text.get_shapely_object', True)
+        self._patch(GridLayout, 'generate_layout', 'GridLayout.generate_layout')
+        self._patch(Cell, 'save', 'Cell.save')
+
+    @contextmanager
+    def stage(self, name, device=None):
+        """
+        Context manager timing one call of a stage, nested in the stages already running.
+        :param name: Name of the stage
+        :param device: Name of the device built in this stage, it is then also added to devices
+        """
+        path = ';'.join([frame['name'] for frame in self._stack] + [name])
+        frame = {'name': name, 'polygons': 0, 'vertices': 0, 'peak': 0}
+        if self.trace_memory:
+            # The peak so far belongs to the parent, the peak of this stage starts from here
+            self._take_peak()
+            tracemalloc.reset_peak()
+        self._stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            self._stack.pop()
+            if self.trace_memory:
+                self._take_peak(frame)
+                tracemalloc.reset_peak()
+
+            stats = self.stages.setdefault(path, _Stage())
+            stats.calls += 1
+            stats.wall += wall
+            stats.polygons += frame['polygons']
+            stats.vertices += frame['vertices']
+            stats.peak_bytes = max(stats.peak_bytes, frame['peak'])
+
+            if self._stack:
+                parent = self._stack[-1]
+                parent_path = ';'.join(f['name'] for f in self._stack)
+                self.stages.setdefault(parent_path, _Stage()).children_wall += wall
+                parent['peak'] = max(parent['peak'], frame['peak'])
+
+            if device is not None:
+                self.devices.append({'name': device, 'stage': name, 'wall_s': wall, 'polygons': frame['polygons'],
+                                     'vertices': frame['vertices'],
+                                     'peak_bytes': frame['peak'] if self.trace_memory else None})
+
+    def _take_peak(self, frame=None):
+        frame = frame or (self._stack[-1] if self._stack else None)
+        if frame is not None:
+            frame['peak'] = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+
+    def count_geometry(self, geometry):
+        """
+        Adds the polygons and vertices of geometry to the running stage and the stages around it.
+        """
+        polygons, vertices = _geometry_counts(geometry)
+        for frame in self._stack:
+            frame['polygons'] += polygons
+            frame['vertices'] += vertices
+
+    def report(self):
+        """
+        :return: Dict with the total wall time and peak memory, the statistics of every
+            call path and of every device
+        """
+        by_name = {}
+        for path, stats in self.stages.items():
+            totals = by_name.setdefault(path.rsplit(';', 1)[-1], {'calls': 0, 'self_s': 0.})
+            totals['calls'] += stats.calls
+            totals['self_s'] += stats.wall - stats.children_wall
+
+        return {
+            'wall_s': self.wall,
+            'max_rss_bytes': _max_rss(),
+            'stages': {path: stats.as_dict() for path, stats in self.stages.items()},
+            'self_time_by_stage': dict(sorted(by_name.items(), key=lambda item: -item[1]['self_s'])),
+            'devices': self.devices,
+        }
+
+    def write_json(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+    def write_collapsed(self, filename):
+        """
+        Writes the self time of every call path in microseconds, in the collapsed stack format.
+        """
+        with open(filename, 'w') as f:
+            for path, stats in sorted(self.stages.items()):
+                microseconds = int(round((stats.wall - stats.children_wall) * 1e6))
+                if microseconds > 0:
+                    f.write('{} {}\n'.format(path.replace(' ', '_'), microseconds))
+
+
+def stage(name, device=None):
+    """
+    Profiler.stage of the active profiler, or a context which does nothing.
+    """
+    return _ACTIVE.stage(name, device) if _ACTIVE is not None else nullcontext()
+
+
+def count_geometry(geometry):
+    """
+    Profiler.count_geometry of the active profiler, does nothing otherwise.
+    """
+    if _ACTIVE is not None:
+        _ACTIVE.count_geometry(geometry)
+
+
+def profiled(function):
+    """
+    Decorator which runs function as a stage of the active profiler.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if _ACTIVE is None:
+            return function(*args, **kwargs)
+        with _ACTIVE.stage(function.__name__):
+            return function(*args, **kwargs)
+
+    return wrapper
+
+
+if __name__ == '__main__':
+    # design_space talks to the imported module, not to this script's copy of it
+    from profiling import Profiler as ImportedProfiler
+    from design_space import generate_blank_gds, populate_gds
+
+    prefix = sys.argv[1] if len(sys.argv) > 1 else 'profile'
+    with ImportedProfiler() as profiler:
+        blank_design_space, bounding_box = generate_blank_gds()
+        populate_gds(blank_design_space, bounding_box)
+    profiler.write_json(prefix + '.json')
+    profiler.write_collapsed(prefix + '.collapsed')
+
+    print('Total {:.2f} s, largest self times:'.format(profiler.wall))
+    for name, totals in list(profiler.report()['self_time_by_stage'].items())[:10]:
+        print('    {:<45} {:>6} calls {:>8.3f} s'.format(name, totals['calls'], totals['self_s']))
@@ -0,0 +1,43 @@
+"""
+Shapely helpers shared by the layout checks (drc.py, ebeam.py, gds_diff.py).
+"""
+
+import warnings
+
+from shapely.strtree import STRtree
+
+
+def shapely_object(geometry):
+    """
+    Shapely geometry of a gdshelpers part, or geometry itself if it already is one.
+    """
+    return geometry.get_shapely_object() if hasattr(geometry, 'get_shapely_object') else geometry
+
+
+def polygons(geometry):
+    """
+    Polygons of a Polygon, MultiPolygon or empty geometry, or of a gdshelpers part.
+    """
+    geometry = shapely_object(geometry)
+    if geometry.is_empty:
+        return []
+    return list(geometry.geoms) if hasattr(geometry, 'geoms') else [geometry]
+
+
+def strtree(geometries):
+    """
+    STRtree of geometries, to be searched with query.
+    """
+    with warnings.catch_warnings():
+        # Shapely 1.8 announces the Shapely 2 interface change, query handles both
+        warnings.simplefilter('ignore')
+        return STRtree(geometries)
+
+
+def query(tree, geometry):
+    """
+    Indices of the tree geometries whose envelope intersects geometry, with Shapely 1.8 and 2.
+    """
+    if hasattr(tree, 'query_items'):
+        return sorted(tree.query_items(geometry))
+    return sorted(tree.query(geometry))
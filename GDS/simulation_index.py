@@ -0,0 +1,423 @@
+"""
+Index of Lumerical simulation runs and their exported results.
+
+The results tree (Lumerical/ by default) is walked for solver logs (*.log) and exported
+results (.csv, .txt, .npy, .npz and, with SciPy installed, .mat files). From every log the
+solver, its version, the host, start time, mesh size, timings and final state are taken, see
+parse_log. Exported results are read into arrays, see parse_result.
+
+Everything goes into a columnar store, a directory with
+    runs.npz     one array per log field, one entry per log
+    results.npz  one entry per result file, its arrays are in results/<key>.npz
+Updates are incremental: only files which are new or whose size or modification time changed
+are parsed again, and entries of deleted files are dropped. Files which cannot be read are kept
+as entries with status "unreadable" (runs) or without a key (results), so they are not retried
+until they change.
+
+Runs and results belong to a project, the first directory below the root (e.g. Thermooptic_Effect),
+and to a parameter set, the name=value pairs in their path, such as
+DC_mode/gap=0.3/length=12_p0.log. Every parameter also gets a column of its own, "param.gap".
+
+Usage:
+    python simulation_index.py [--store DIR] update [root]
+    python simulation_index.py [--store DIR] query [root] [--project P] [--param gap=0.3 ...] [--columns ...]
+"""
+
+import argparse
+import csv
+import hashlib
+import os
+import re
+import time
+
+import numpy as np
+
+DEFAULT_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Lumerical')
+STORE_NAME = '.simulation_index'
+
+RESULT_EXTENSIONS = ('.csv', '.txt', '.npy', '.npz', '.mat')
+
+# Fields of a parsed log, with the value of a field the log does not mention
+RUN_FIELDS = {
+    'path': '', 'project': '', 'params': '', 'process': -1,
+    'product': '', 'solver': '', 'version': '', 'platform': '', 'host': '', 'license_host': '',
+    'license_expires': '', 'project_file': '', 'start_time': np.nan, 'mesh_only': False,
+    'vertices': -1, 'elements': -1, 'mesh_time_s': np.nan, 'run_time_s': np.nan,
+    'status': '', 'errors': '', 'mtime': np.nan, 'size': -1,
+}
+
+RESULT_FIELDS = {'path': '', 'project': '', 'params': '', 'key': '', 'arrays': '', 'mtime': np.nan, 'size': -1}
+
+_SOLVER = re.compile(r'^(?P<product>.*?Lumerical \S+(?: \S+)?) (?P<solver>.+?) Version (?P<version>\S+)'
+                     r'(?: \((?P<platform>[^)]*)\))?')
+_PARAMETER = re.compile(r'([A-Za-z_][A-Za-z0-9_]*)=([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)')
+_PROCESS = re.compile(r'_p(\d+)$')
+_DURATION = re.compile(r'(\d+(?:\.\d*)?)\s*(s|sec|secs|seconds|min|mins|minutes|h|hr|hrs|hours)\b')
+_UNITS = {'s': 1, 'sec': 1, 'secs': 1, 'seconds': 1, 'min': 60, 'mins': 60, 'minutes': 60,
+          'h': 3600, 'hr': 3600, 'hrs': 3600, 'hours': 3600}
+
+
+def _seconds(text):
+    """
+    Sum of the durations in text such as "1 min 12 s" or "(0s)", NaN if there are none.
+    """
+    durations = _DURATION.findall(text)
+    return sum(float(value) * _UNITS[unit] for value, unit in durations) if durations else np.nan
+
+
+def _parse_time(text):
+    """
+    Seconds since the epoch of a Lumerical time stamp like "Mon Feb 19 03:03:30 2024", NaN if it is not one.
+    """
+    try:
+        return time.mktime(time.strptime(text.strip(), '%a %b %d %H:%M:%S %Y'))
+    except ValueError:
+        return np.nan
+
+
+def path_parameters(path):
+    """
+    The name=value pairs in a path.
+    :return: Dict of parameter name to float, in the order they appear
+    """
+    return {name: float(value) for name, value in _PARAMETER.findall(path.replace('\\', '/'))}
+
+
+def _describe(path, root):
+    """
+    Project, parameter set and parameters of a file below root.
+    :return: Dict of the project and parameter set fields, dict of the parameters
+    """
+    relative = os.path.relpath(path, root)
+    parts = relative.split(os.sep)
+    parameters = path_parameters(os.path.splitext(relative)[0])
+    description = {'project': parts[0] if len(parts) > 1 else '',
+                   'params': ','.join('{}={:g}'.format(name, value) for name, value in sorted(parameters.items()))}
+    return description, parameters
+
+
+def parse_log(path):
+    """
+    Reads the fields of RUN_FIELDS from a Lumerical solver log. Understood are the version banner,
+    license, "current time", "Running on host", the ldev/fsp file run, mesh statistics, "complete (...)"
+    and elapsed time lines and error messages.
+
+    :param path: Log file
+    :return: Dict of the fields found
+    """
+    run = {}
+    errors = []
+    run_time = 0.
+    with open(path, errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            lower = line.lower()
+            banner = _SOLVER.match(line)
+            if banner and 'version' not in run:
+                run.update({key: value or '' for key, value in banner.groupdict().items()})
+            elif lower.startswith('expires'):
+                run['license_expires'] = line.split(':', 1)[1].strip()
+            elif lower.startswith('license host:'):
+                run['license_host'] = line.split(':', 1)[1].strip()
+            elif lower.startswith('current time:'):
+                run['start_time'] = _parse_time(line.split(':', 1)[1])
+            elif lower.startswith('running on host:'):
+                run['host'] = line.split(':', 1)[1].strip()
+            elif lower.startswith('running ') and ' file: ' in lower:
+                # "Running ldev file: <engine> <project file> <options>", the license blob is left out
+                words = line.split(' file: ', 1)[1].split()
+                project_files = [word for word in words if re.search(r'\.(ldev|fsp|lms|lsf|lme|icp)$', word)]
+                run['project_file'] = project_files[0] if project_files else ''
+                run['mesh_only'] = '-mesh-only' in words
+            elif lower.startswith('+ vertices:'):
+                run['vertices'] = int(line.split(':', 1)[1])
+            elif lower.startswith('+ elements:'):
+                run['elements'] = int(line.split(':', 1)[1])
+            elif lower.startswith('mesh generation complete'):
+                run['mesh_time_s'] = _seconds(line)
+                run['status'] = 'meshed'
+            elif 'elapsed time' in lower or 'simulation time' in lower or 'total time' in lower:
+                seconds = _seconds(line)
+                if not np.isnan(seconds):
+                    run_time = max(run_time, seconds)
+            elif 'completed successfully' in lower or lower.startswith('simulation complete'):
+                run['status'] = 'completed'
+            elif 'error' in lower:
+                errors.append(line)
+
+    if run_time:
+        run['run_time_s'] = run_time
+    elif not np.isnan(run.get('mesh_time_s', np.nan)):
+        run['run_time_s'] = run['mesh_time_s']
+    if errors:
+        run['status'] = 'error'
+        run['errors'] = ' | '.join(errors)
+    run.setdefault('status', 'incomplete')
+
+    process = _PROCESS.search(os.path.splitext(os.path.basename(path))[0])
+    if process:
+        run['process'] = int(process.group(1))
+    return run
+
+
+def _read_table(path):
+    """
+    Columns of a delimited text export, named by its header line if it has one.
+    """
+    with open(path, newline='', errors='replace') as f:
+        lines = [line for line in f if line.strip() and not line.lstrip().startswith('#')]
+    if not lines:
+        raise ValueError('{} holds no data'.format(path))
+    delimiter = ',' if ',' in lines[0] else ('\t' if '\t' in lines[0] else None)
+    rows = list(csv.reader(lines, delimiter=delimiter) if delimiter else (line.split() for line in lines))
+
+    def numeric(row):
+        try:
+            return [float(value) for value in row]
+        except ValueError:
+            return None
+
+    header = None if numeric(rows[0]) else [name.strip() for name in rows[0]]
+    values = [numeric(row) for row in (rows[1:] if header else rows)]
+    if not values or any(row is None for row in values):
+        raise ValueError('{} is not a numeric table'.format(path))
+    data = np.array(values)
+    names = header if header and len(header) == data.shape[1] else ['column_{}'.format(i)
+                                                                      for i in range(data.shape[1])]
+    return {name: data[:, i] for i, name in enumerate(names)}
+
+
+def parse_result(path):
+    """
+    Arrays of an exported result file.
+    :return: Dict of array name to array
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.npz':
+        with np.load(path) as data:
+            return {name: data[name] for name in data.files}
+    if extension == '.npy':
+        return {'data': np.load(path)}
+    if extension == '.mat':
+        try:
+            from scipy.io import loadmat
+        except ImportError:
+            raise ImportError('SciPy is required to read .mat results')
+        return {name: np.asarray(value) for name, value in loadmat(path).items()
+                if not name.startswith('__') and np.asarray(value).dtype.kind in 'biufc'}
+    if extension in ('.csv', '.txt'):
+        return _read_table(path)
+    raise ValueError('Unknown result file type "{}"'.format(path))
+
+
+def _load_columns(filename, fields):
+    """
+    Columns stored in filename, or empty columns of fields if there is no such file.
+    """
+    if not os.path.exists(filename):
+        return {name: np.array([], dtype=np.asarray(default).dtype) for name, default in fields.items()}
+    with np.load(filename) as data:
+        return {name: data[name] for name in data.files}
+
+
+def _to_columns(records, fields):
+    """
+    Column arrays of a list of dicts. Missing fields take their default, parameter columns NaN.
+    """
+    names = list(fields) + sorted({name for record in records for name in record if name.startswith('param.')})
+    columns = {}
+    for name in names:
+        default = fields.get(name, np.nan)
+        columns[name] = np.array([record.get(name, default) for record in records],
+                                 dtype=str if isinstance(default, str) else np.asarray(default).dtype)
+    return columns
+
+
+def _to_records(columns):
+    """
+    List of dicts of column arrays, the inverse of _to_columns.
+    """
+    names = list(columns)
+    count = len(columns[names[0]]) if names else 0
+    return [{name: columns[name][i].item() for name in names} for i in range(count)]
+
+
+class SimulationIndex:
+    """
+    Columnar store of the runs and results of a results tree.
+    """
+
+    def __init__(self, store=None, root=DEFAULT_ROOT):
+        """
+        :param store: Store directory, STORE_NAME inside root by default
+        :param root: Results tree, for update and for the project and parameters of its files
+        """
+        self.root = os.path.abspath(root)
+        self.store = os.path.abspath(store or os.path.join(self.root, STORE_NAME))
+        self.runs = _load_columns(os.path.join(self.store, 'runs.npz'), RUN_FIELDS)
+        self.results = _load_columns(os.path.join(self.store, 'results.npz'), RESULT_FIELDS)
+        self._groups = None
+
+    def _scan(self):
+        """
+        Logs and result files below the root, without the store itself.
+        """
+        logs, results = [], []
+        for directory, subdirectories, files in os.walk(self.root):
+            subdirectories[:] = sorted(d for d in subdirectories
+                                       if os.path.join(directory, d) != self.store and not d.startswith('.'))
+            for name in sorted(files):
+                extension = os.path.splitext(name)[1].lower()
+                if extension == '.log':
+                    logs.append(os.path.join(directory, name))
+                elif extension in RESULT_EXTENSIONS:
+                    results.append(os.path.join(directory, name))
+        return logs, results
+
+    def update(self):
+        """
+        Parses the new and changed files of the results tree and stores the index.
+        :return: Dict with the number of files parsed, unchanged, removed and unreadable
+        """
+        logs, result_files = self._scan()
+        counts = {'parsed': 0, 'unchanged': 0, 'removed': 0, 'unreadable': 0}
+
+        def refresh(records, paths, parse, unreadable):
+            known = {record['path']: record for record in records}
+            updated = []
+            for path in paths:
+                stat = os.stat(path)
+                record = known.pop(path, None)
+                if record is not None and record['mtime'] == stat.st_mtime and record['size'] == stat.st_size:
+                    counts['unchanged'] += 1
+                    updated.append(record)
+                    continue
+                try:
+                    fields = parse(path)
+                except (ValueError, OSError):
+                    counts['unreadable'] += 1
+                    fields = dict(unreadable)
+                else:
+                    counts['parsed'] += 1
+                description, parameters = _describe(path, self.root)
+                fields.update(description, path=path, mtime=stat.st_mtime, size=stat.st_size)
+                fields.update({'param.' + name: value for name, value in parameters.items()})
+                updated.append(fields)
+            # Entries of files which are gone, only those below this root are ours to drop
+            for path, record in known.items():
+                if os.path.commonpath([path, self.root]) == self.root:
+                    counts['removed'] += 1
+                else:
+                    updated.append(record)
+            return updated
+
+        runs = refresh(_to_records(self.runs), logs, parse_log, {'status': 'unreadable'})
+        results = refresh(_to_records(self.results), result_files, self._store_result, {'key': ''})
+        self.runs = _to_columns(runs, RUN_FIELDS)
+        self.results = _to_columns(results, RESULT_FIELDS)
+        self._groups = None
+        self._remove_orphans()
+
+        os.makedirs(self.store, exist_ok=True)
+        np.savez(os.path.join(self.store, 'runs.npz'), **self.runs)
+        np.savez(os.path.join(self.store, 'results.npz'), **self.results)
+        return counts
+
+    def _store_result(self, path):
+        """
+        Parses a result file into results/<key>.npz.
+        :return: Index fields of the result
+        """
+        arrays = parse_result(path)
+        key = hashlib.sha1(path.encode()).hexdigest()
+        os.makedirs(os.path.join(self.store, 'results'), exist_ok=True)
+        np.savez(os.path.join(self.store, 'results', key + '.npz'), **arrays)
+        return {'key': key, 'arrays': ','.join(arrays)}
+
+    def _remove_orphans(self):
+        directory = os.path.join(self.store, 'results')
+        if os.path.isdir(directory):
+            keys = set(self.results['key'])
+            for name in os.listdir(directory):
+                if os.path.splitext(name)[0] not in keys:
+                    os.remove(os.path.join(directory, name))
+
+    def _mask(self, columns, project=None, **parameters):
+        """
+        Entries of columns matching project and the parameter values.
+        """
+        mask = np.ones(len(columns['path']), dtype=bool)
+        if project is not None:
+            mask &= columns['project'] == project
+        for name, value in parameters.items():
+            column = columns.get('param.' + name)
+            if column is None:
+                return np.zeros_like(mask)
+            mask &= np.isclose(column, value)
+        return mask
+
+    def query_runs(self, project=None, columns=None, **parameters):
+        """
+        Runs of a project and parameter values, e.g. query_runs('DC_mode', gap=0.3).
+        :param columns: Names of the columns to return, all by default
+        :return: Dict of column arrays
+        """
+        mask = self._mask(self.runs, project, **parameters)
+        return {name: self.runs[name][mask] for name in (columns or self.runs)}
+
+    def query_results(self, project=None, **parameters):
+        """
+        Result files of a project and parameter values, with their arrays loaded lazily.
+        :return: Generator over (path, dict of arrays)
+        """
+        for i in np.flatnonzero(self._mask(self.results, project, **parameters) & (self.results['key'] != '')):
+            filename = os.path.join(self.store, 'results', self.results['key'][i] + '.npz')
+            with np.load(filename) as data:
+                yield str(self.results['path'][i]), {name: data[name] for name in data.files}
+
+    def groups(self):
+        """
+        Runs grouped by project and parameter set.
+        :return: Dict of (project, parameter set) to the indices of its runs
+        """
+        if self._groups is None:
+            self._groups = {}
+            for i, key in enumerate(zip(self.runs['project'], self.runs['params'])):
+                self._groups.setdefault((str(key[0]), str(key[1])), []).append(i)
+        return self._groups
+
+
+def _parse_parameter(text):
+    name, value = text.split('=', 1)
+    return name, float(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Index of Lumerical simulation runs and results')
+    parser.add_argument('--store', help='Store directory, {} in the root by default'.format(STORE_NAME))
+    commands = parser.add_subparsers(dest='command', required=True)
+    update = commands.add_parser('update', help='Index new and changed files')
+    update.add_argument('root', nargs='?', default=DEFAULT_ROOT, help='Results tree')
+    query = commands.add_parser('query', help='List indexed runs')
+    query.add_argument('root', nargs='?', default=DEFAULT_ROOT, help='Results tree')
+    query.add_argument('--project', help='Project directory')
+    query.add_argument('--param', type=_parse_parameter, action='append', default=[], help='name=value')
+    query.add_argument('--columns', nargs='+', default=['project', 'params', 'solver', 'host', 'vertices',
+                                                        'elements', 'run_time_s', 'status'])
+    args = parser.parse_args(argv)
+
+    index = SimulationIndex(args.store, args.root)
+    if args.command == 'update':
+        start = time.perf_counter()
+        counts = index.update()
+        print('{parsed} parsed, {unchanged} unchanged, {removed} removed, {unreadable} unreadable'.format(**counts)
+              + ' in {:.2f} s'.format(time.perf_counter() - start))
+    else:
+        runs = index.query_runs(args.project, args.columns, **dict(args.param))
+        print('\t'.join(args.columns))
+        for row in zip(*runs.values()):
+            print('\t'.join(str(value) for value in row))
+
+
+if __name__ == '__main__':
+    main()
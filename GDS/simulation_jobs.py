@@ -0,0 +1,410 @@
+"""
+Batch runs of parameter-swept simulations on local worker processes.
+
+A job file describes one project (e.g. DC_mode) and the parameter sets to solve it for:
+
+    {"project": "DC_mode",
+     "backend": {"name": "stub"},
+     "fixed": {"si_thickness": 0.22, "wavelength": 1.55},
+     "layout": {"sweep_file": "grating_sweep.json", "rows": ["*DC_sweep*"],
+                "parameters": {"gap": "coupling_gap"}},
+     "sweep": {"mode": "grid", "parameters": {"etch_depth": [0.11, 0.12, 0.13]}}}
+
+"sweep" takes the modes and ranges of the GDS sweep files (see sweeps.iter_points). "layout" takes
+parameters from the devices of a GDS sweep file instead, as in sweeps.iter_sweep_devices, renamed
+from device arguments to solver parameters, which lets the simulations follow the layout. The
+etch_depth and si_thickness of a row come from its "stack" entry, see sweeps.row_stack. Every
+layout point is combined with every sweep point, identical points are solved once.
+
+Jobs go to a pool of worker processes, every core busy by default, through a solver backend:
+    stub    - results of the compact models (mzi_model.py, thermo_optic.py), no licence needed.
+              It can be slowed down and made to fail, to try out the scheduler
+    command - runs a command, such as a Lumerical solver, in a work directory per job and reads the
+              result files it leaves there with simulation_index.parse_result
+Other backends are given as "module:Class", see StubBackend for the interface.
+
+Failed jobs are retried. Results are cached in a directory, keyed on a hash of the project, the
+backend and the parameters, so no parameter set is solved twice. Results can be written to CSV; the
+DC_mode results have the columns mode_table.py builds tables from.
+
+Usage:
+    python simulation_jobs.py points jobs.json
+    python simulation_jobs.py run jobs.json [--serial] [--workers N] [--retries N] [--cache DIR]
+                                            [--csv FILE]
+"""
+
+import argparse
+import csv
+import hashlib
+import importlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import deque, namedtuple
+
+import numpy as np
+
+from parameters import *
+
+CACHE_DIR = '.simulation_cache'
+RUN_DIR = '.simulation_runs'
+
+# Bump when the way results are stored changes
+CACHE_VERSION = 1
+
+RETRIES = 2
+
+# Outcome of one parameter set. status is 'done', 'cached' or 'failed', values a dict of arrays
+JobResult = namedtuple('JobResult', ['params', 'key', 'status', 'attempts', 'error', 'values'])
+
+
+def _normalise(value):
+    return round(float(value), 9) if isinstance(value, (float, np.floating)) else value
+
+
+def _unit_hash(*parts):
+    """
+    Number in [0, 1) which only depends on parts.
+    """
+    return int(hashlib.sha256(repr(parts).encode()).hexdigest()[:12], 16) / 16 ** 12
+
+
+class StubBackend:
+    """
+    Solver stand-in which answers from the compact models. A backend has a name, a fingerprint
+    which identifies its results, and run(project, params, attempt) which returns a dict of arrays
+    or raises an exception if the job failed. Backends are sent to the worker processes, so they
+    have to be picklable.
+    """
+    name = 'stub'
+    version = 1
+
+    def __init__(self, delay=0., failure_rate=0.):
+        """
+        :param delay: Time every job takes, in s
+        :param failure_rate: Fraction of the attempts which fail
+        """
+        self.delay = delay
+        self.failure_rate = failure_rate
+
+    def fingerprint(self):
+        return '{}|{}'.format(self.name, self.version)
+
+    def run(self, project, params, attempt=0):
+        if self.delay:
+            time.sleep(self.delay)
+        if _unit_hash(project, sorted(params.items()), attempt) < self.failure_rate:
+            raise RuntimeError('Stub failure')
+
+        wavelength = params.get('wavelength', WAVELENGTH)
+        stack = {'etch_depth': params.get('etch_depth', ETCH_DEPTH),
+                 'si_thickness': params.get('si_thickness', SI_THICKNESS)}
+        if project == 'DC_mode':
+            from mzi_model import effective_index, supermode_index_difference
+            delta_n = supermode_index_difference(params['gap'], wavelength, **stack)
+            n_eff = effective_index(wavelength)
+            return {'n_even': np.asarray(n_eff + delta_n / 2), 'n_odd': np.asarray(n_eff - delta_n / 2)}
+        if project == 'DC_beam_splitter':
+            from mzi_model import dc_cross_coupling, supermode_index_difference
+            delta_n = supermode_index_difference(params['gap'], wavelength, **stack)
+            return {'cross': np.asarray(dc_cross_coupling(params['length'], params['gap'], wavelength, delta_n))}
+        if project in ('Thermal_waveguide', 'Thermooptic_Effect'):
+            from thermo_optic import phase_shift, temperature_per_watt
+            offset = params.get('offset', 0.)
+            return {'delta_t': np.asarray(params.get('power', 0.) * temperature_per_watt(offset)),
+                    'phase': np.asarray(phase_shift(params.get('power', 0.), offset, wavelength=wavelength))}
+        return {'value': np.asarray(_unit_hash(project, sorted(params.items())))}
+
+
+class CommandBackend:
+    """
+    Runs a command per job in a directory of its own, RUN_DIR/<project>/<name=value>/..., and
+    collects the result files the command writes there (see simulation_index.parse_result).
+    """
+    name = 'command'
+    version = 1
+
+    def __init__(self, command, run_dir=RUN_DIR, timeout=None):
+        """
+        :param command: List of arguments, formatted with the parameters, project and run directory,
+            e.g. ["fde-solutions", "-nw", "-run", "/path/to/{project}.lsf"]
+        :param run_dir: Directory the job directories are made in
+        :param timeout: Longest time a job may take, in s
+        """
+        self.command = list(command)
+        self.run_dir = run_dir
+        self.timeout = timeout
+
+    def fingerprint(self):
+        return '{}|{}|{!r}'.format(self.name, self.version, self.command)
+
+    def run(self, project, params, attempt=0):
+        from simulation_index import RESULT_EXTENSIONS, parse_result
+
+        # name=value directories, which simulation_index reads the parameters back from
+        directory = os.path.join(self.run_dir, project,
+                                 *['{}={}'.format(name, _normalise(value)) for name, value in sorted(params.items())])
+        os.makedirs(directory, exist_ok=True)
+        fields = dict(params, project=project, run_dir=os.path.abspath(directory))
+        with open(os.path.join(directory, 'job_{}.log'.format(attempt)), 'w') as log:
+            subprocess.run([argument.format(**fields) for argument in self.command], cwd=directory, stdout=log,
+                           stderr=subprocess.STDOUT, timeout=self.timeout, check=True)
+
+        values = {}
+        for filename in sorted(os.listdir(directory)):
+            if os.path.splitext(filename)[1].lower() in RESULT_EXTENSIONS:
+                values.update(parse_result(os.path.join(directory, filename)))
+        if not values:
+            raise RuntimeError('{} left no results in {}'.format(self.command[0], directory))
+        return values
+
+
+BACKENDS = {'stub': StubBackend, 'command': CommandBackend}
+
+
+def make_backend(settings):
+    """
+    Backend of the "backend" entry of a job file.
+    :param settings: Dict of the backend "name" and its arguments, or just the name. Names not in BACKENDS
+        are taken as "module:Class"
+    """
+    settings = {'name': settings} if isinstance(settings, str) else dict(settings)
+    name = settings.pop('name')
+    if name in BACKENDS:
+        return BACKENDS[name](**settings)
+    if ':' not in name:
+        raise ValueError('Unknown backend "{}", use one of {} or "module:Class"'.format(name, list(BACKENDS)))
+    module, attribute = name.split(':', 1)
+    return getattr(importlib.import_module(module), attribute)(**settings)
+
+
+class ResultCache:
+    """
+    Directory of job results, one .npz file per parameter set.
+    """
+
+    def __init__(self, directory=CACHE_DIR):
+        """
+        :param directory: Directory holding the cache, created if needed
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(project, backend, params):
+        """
+        :return: Hex digest identifying the results of params
+        """
+        description = repr((CACHE_VERSION, backend.fingerprint(), project,
+                            sorted((name, _normalise(value)) for name, value in params.items())))
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def load(self, key):
+        """
+        :return: The cached values of key, None if they were never stored
+        """
+        try:
+            with np.load(self._path(key)) as data:
+                return {name: data[name] for name in data.files}
+        except (OSError, ValueError, EOFError):
+            return None
+
+    def store(self, key, values):
+        """
+        Writes the values of a job. The file is moved into place so a crash never leaves a partial entry.
+        """
+        with tempfile.NamedTemporaryFile('wb', dir=self.directory, suffix='.npz', delete=False) as tmp:
+            np.savez(tmp, **values)
+        os.replace(tmp.name, self._path(key))
+
+
+def _run_job(backend, project, params, attempt):
+    """
+    Runs one job, at module level so that it can be sent to worker processes.
+    """
+    return {name: np.asarray(value) for name, value in backend.run(project, params, attempt).items()}
+
+
+def layout_points(settings):
+    """
+    Parameter sets of the devices of a GDS sweep, see the "layout" entry of a job file.
+    """
+    from sweeps import iter_sweep_devices, load_sweep, row_stack
+
+    spec = load_sweep(settings.get('sweep_file', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                              'grating_sweep.json')))
+    points = []
+    for row_id, kwargs, name, _ in iter_sweep_devices(spec, settings.get('rows'), settings.get('devices')):
+        fields = dict(row_stack(spec['rows'][row_id]), **kwargs)
+        missing = [argument for argument in settings['parameters'].values() if argument not in fields]
+        if missing:
+            raise ValueError('"{}" has no {}'.format(name, ', '.join(missing)))
+        points.append({parameter: fields[argument] for parameter, argument in settings['parameters'].items()})
+    return points
+
+
+def job_points(spec):
+    """
+    Parameter sets of a job file, without duplicates and in the order they were first given.
+    """
+    from sweeps import iter_points
+
+    layout = layout_points(spec['layout']) if 'layout' in spec else [{}]
+    sweep = list(iter_points(spec['sweep'])) if 'sweep' in spec else [{}]
+    fixed = spec.get('fixed', {})
+
+    points = {}
+    for first in layout:
+        for second in sweep:
+            point = {name: _normalise(value) for name, value in dict(fixed, **first, **second).items()}
+            points.setdefault(tuple(sorted(point.items())), point)
+    return list(points.values())
+
+
+def run_jobs(project, points, backend, cache=None, parallel=True, max_workers=None, retries=RETRIES, log=None):
+    """
+    Solves project for every parameter set, taking what it can from the cache.
+
+    :param project: Project name, e.g. DC_mode
+    :param points: List of parameter dicts
+    :param backend: Solver backend, see StubBackend
+    :param cache: Optional ResultCache, new results are added to it
+    :param parallel: Run the jobs in a pool of worker processes
+    :param max_workers: If parallel is True, limits the number of worker processes
+    :param retries: Number of times a failed job is run again
+    :param log: Optional function called with a message for every failed attempt
+    :return: List of JobResult, in the order of points
+    """
+    keys = [ResultCache.key(project, backend, params) for params in points]
+    outcomes = {}
+    queue = deque()
+    for key, params in zip(keys, points):
+        if key in outcomes:
+            continue
+        values = cache.load(key) if cache is not None else None
+        if values is not None:
+            outcomes[key] = ('cached', 0, '', values)
+        else:
+            outcomes[key] = None
+            queue.append(key)
+    queue = deque((key, 0) for key in queue)
+    parameters_of = dict(zip(keys, points))
+
+    def finish(key, attempt, values, error):
+        if error is None:
+            if cache is not None:
+                cache.store(key, values)
+            outcomes[key] = ('done', attempt + 1, '', values)
+            return
+        if log is not None:
+            log('Attempt {} of {} {} failed: {}'.format(attempt + 1, project, parameters_of[key], error))
+        if attempt < retries:
+            queue.append((key, attempt + 1))
+        else:
+            outcomes[key] = ('failed', attempt + 1, repr(error), {})
+
+    if not parallel:
+        while queue:
+            key, attempt = queue.popleft()
+            try:
+                values = _run_job(backend, project, parameters_of[key], attempt)
+            except Exception as error:
+                finish(key, attempt, None, error)
+            else:
+                finish(key, attempt, values, None)
+    elif queue:
+        from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+        from concurrent.futures.process import BrokenProcessPool
+
+        # Enough jobs in flight to keep every worker busy, without submitting thousands at once
+        max_in_flight = 4 * (max_workers or os.cpu_count() or 1)
+        pool = ProcessPoolExecutor(max_workers=max_workers)
+        in_flight = {}
+        try:
+            while queue or in_flight:
+                while queue and len(in_flight) < max_in_flight:
+                    key, attempt = queue.popleft()
+                    in_flight[pool.submit(_run_job, backend, project, parameters_of[key], attempt)] = (key, attempt)
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                broken = False
+                for future in done:
+                    key, attempt = in_flight.pop(future)
+                    error = future.exception()
+                    finish(key, attempt, None if error else future.result(), error)
+                    broken = broken or isinstance(error, BrokenProcessPool)
+                if broken:
+                    # A worker died, the jobs still in flight are lost with the pool
+                    for future, (key, attempt) in in_flight.items():
+                        finish(key, attempt, None, BrokenProcessPool('worker process died'))
+                    in_flight.clear()
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool = ProcessPoolExecutor(max_workers=max_workers)
+        finally:
+            pool.shutdown(cancel_futures=True)
+
+    return [JobResult(params, key, *outcomes[key]) for key, params in zip(keys, points)]
+
+
+def write_results_csv(results, filename):
+    """
+    Writes the parameters and scalar values of the jobs which succeeded to a CSV file, one row per job.
+    """
+    results = [result for result in results if result.status != 'failed']
+    parameter_names = list(dict.fromkeys(name for result in results for name in result.params))
+    value_names = list(dict.fromkeys(name for result in results for name, value in result.values.items()
+                                     if np.size(value) == 1))
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(parameter_names + value_names)
+        for result in results:
+            writer.writerow([result.params.get(name, '') for name in parameter_names]
+                            + [np.asarray(result.values[name]).item() if name in result.values else ''
+                               for name in value_names])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Batch runs of parameter-swept simulations')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    points = commands.add_parser('points', help='List the parameter sets of a job file')
+    points.add_argument('jobs', help='Job file')
+
+    run = commands.add_parser('run', help='Run the jobs of a job file')
+    run.add_argument('jobs', help='Job file')
+    run.add_argument('--serial', action='store_true', help='Run the jobs in this process')
+    run.add_argument('--workers', type=int, help='Number of worker processes, one per core by default')
+    run.add_argument('--retries', type=int, default=RETRIES, help='Runs of a failed job after the first')
+    run.add_argument('--cache', default=CACHE_DIR, help='Result cache directory')
+    run.add_argument('--csv', help='CSV file for the results')
+
+    args = parser.parse_args(argv)
+    with open(args.jobs) as f:
+        spec = json.load(f)
+    parameter_sets = job_points(spec)
+
+    if args.command == 'points':
+        for params in parameter_sets:
+            print(' '.join('{}={}'.format(name, _normalise(value)) for name, value in params.items()))
+        print('{} parameter sets of {}'.format(len(parameter_sets), spec['project']))
+        return 0
+
+    start = time.perf_counter()
+    results = run_jobs(spec['project'], parameter_sets, make_backend(spec.get('backend', 'stub')),
+                       ResultCache(args.cache), parallel=not args.serial, max_workers=args.workers,
+                       retries=args.retries, log=lambda message: print(message, file=sys.stderr))
+    counts = {status: sum(result.status == status for result in results) for status in ('done', 'cached', 'failed')}
+    print('{} jobs of {} in {:.1f} s: {done} run, {cached} cached, {failed} failed'.format(
+        len(results), spec['project'], time.perf_counter() - start, **counts))
+    if args.csv:
+        write_results_csv(results, args.csv)
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
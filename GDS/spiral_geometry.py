@@ -0,0 +1,81 @@
+"""
+Closed-form geometry of the gdshelpers Spiral used by spiral_winding and asymmetric_spiral_mzi.
+
+These only need NumPy, so the sweep models (prescreen.py, mzi_model.py) can size and route spirals
+without importing gdshelpers. components.py uses them for the spirals it builds.
+"""
+
+from parameters import *
+
+
+def spiral_outer_radius(number, gap_size, inner_gap_size, width):
+    """
+    Radius of the centre line of the outermost turn of a gdshelpers Spiral.
+    """
+    return number * (width + gap_size) + inner_gap_size
+
+
+def spiral_footprint(number, gap_size, inner_gap_size, width=WAVEGUIDE_WIDTH):
+    """
+    Size of a gdshelpers Spiral without building it. Works on scalars or NumPy arrays.
+
+    Each arm of the spiral is an Archimedean spiral r = R - k*theta, with R the outer radius and
+    k = (width + gap_size) / pi, which starts at the input port. Across the port the spiral
+    spans the full outer diameter. Along the port it spans twice the largest r*sin(theta),
+    which is reached in the first half turn where tan(theta) = r / k.
+
+    :param number: Number of turns
+    :param gap_size: Gap between two waveguides
+    :param inner_gap_size: Inner radius of the spiral
+    :param width: Width of the waveguide
+    :return: (size across the port direction, size along the port direction)
+    """
+    number, gap_size, inner_gap_size = np.broadcast_arrays(*[np.asarray(v, dtype=float)
+                                                             for v in (number, gap_size, inner_gap_size)])
+    outer_radius = spiral_outer_radius(number, gap_size, inner_gap_size, width)
+    k = (width + gap_size) / np.pi
+
+    # Bisect k*sin(t) - (R - k*t)*cos(t) = 0 on [0, pi/2], where it goes from -R to k
+    low = np.zeros_like(outer_radius)
+    high = np.full_like(outer_radius, np.pi / 2)
+    for _ in range(40):
+        middle = (low + high) / 2
+        positive = k * np.sin(middle) - (outer_radius - k * middle) * np.cos(middle) > 0
+        high = np.where(positive, middle, high)
+        low = np.where(positive, low, middle)
+
+    # The arm ends after number half turns, which can be before the maximum
+    theta = np.minimum(low, np.pi * number)
+    half_along = np.maximum((outer_radius - k * theta) * np.sin(theta), inner_gap_size)
+
+    return 2 * outer_radius + width, 2 * half_along + width
+
+
+def spiral_length(number, gap_size, inner_gap_size, width=WAVEGUIDE_WIDTH):
+    """
+    Length of a gdshelpers Spiral without building it. Works on scalars or NumPy arrays.
+
+    Both arms are Archimedean spirals from the outer radius R down to the inner gap, whose
+    arc length has a closed form. The two circles joining the arms in the centre are
+    approximated by a circle of diameter inner_gap_size, which is the only source of error, so
+    it is largest for few turns around a small inner gap. Against Spiral.length, for gap_size
+    0.5 to 10 and inner_gap_size 2 to 80, the error is at most 4.1 % for half a turn, 1.7 % for
+    one turn and 1 % from one and a half turns on, or for inner_gap_size of 10 and more.
+
+    :param number: Number of turns
+    :param gap_size: Gap between two waveguides
+    :param inner_gap_size: Inner radius of the spiral
+    :param width: Width of the waveguide
+    :return: Estimated waveguide length of the spiral
+    """
+    number, gap_size, inner_gap_size = [np.asarray(v, dtype=float) for v in (number, gap_size, inner_gap_size)]
+    outer_radius = spiral_outer_radius(number, gap_size, inner_gap_size, width)
+    k = (width + gap_size) / np.pi
+
+    def integral(r):
+        root = np.sqrt(r ** 2 + k ** 2)
+        return r * root + k ** 2 * np.log(r + root)
+
+    arm_length = (integral(outer_radius) - integral(inner_gap_size)) / (2 * k)
+
+    return 2 * arm_length + np.pi * inner_gap_size
@@ -0,0 +1,383 @@
+"""
+Declarative device sweeps.
+
+A sweep file describes the rows of a layout. Every row names a device factory from
+components.py, the parameters that stay fixed, the parameters that are swept and
+templates for the device name and label. JSON example:
+
+    {"rows": [{"device": "asymmetric_spiral_mzi",
+               "name": "DC_sweep_{i}",
+               "label": "{name}\\nDC_Length_{coupling_length}um Gap_{coupling_gap}um",
+               "fixed": {"upper_spiral_no": 3, "lower_spiral_no": 1,
+                         "spiral_gap": 5, "spiral_inner_gap": 5},
+               "sweep": {"mode": "zip",
+                         "parameters": {"coupling_length": [10.3, 10.4],
+                                        "coupling_gap": [0.290, 0.292]}}}]}
+
+Sweep modes:
+    grid - every combination of the parameter values, the last parameter varying fastest
+    zip  - the i-th value of every parameter, all value lists must have the same length
+    list - explicit list of parameter dicts under "points"
+
+Parameter values are either a list or a range {"start": 1, "step": 0.5, "num": 11}.
+Ranges are accumulated with repeated addition, as in the hand-written loops they replace.
+
+A "stack" entry gives the etch depth and Si thickness a row is made for, in um:
+
+    "stack": {"etch_depth": 0.11, "si_thickness": 0.22}
+
+It leaves the layout unchanged, but the models of the row use it (monte_carlo.py, simulation_jobs.py),
+see row_stack. ETCH_DEPTH and SI_THICKNESS stand in for values left out.
+
+Rows of asymmetric_spiral_mzi devices can take their coupling lengths from a coupler model (see
+dc_design.py) instead of listing them:
+
+    "dc_length": {"table": "dc_modes", "split": 0.5, "decimals": 1}
+
+sets the coupling_length of every device to the length which splits as "split" (0.5 by default)
+at its coupling_gap. "table" is a mode table directory (see mode_table.py), relative to the working
+directory, without it the analytic model of mzi_model is used. The model is evaluated for the row's
+"stack", which "etch_depth" and "si_thickness" in "dc_length" override. Stack values given in neither
+take the only value in the table or the default of parameters.py, decimals defaults to 3 (the 1 nm
+layout grid).
+
+A "fibre_array" entry places the devices of a row side by side on shared fibre arrays, see fibre_array.py.
+
+Templates are formatted with str.format, using the swept and fixed parameters, the device
+index in the row ``i`` and, for labels, the device ``name``. Rows without a "label" add no
+extra label, which suits spiral_winding and grating_coupler as they label themselves.
+
+Rows and devices can be selected with shell-style patterns (see iter_sweep_devices): a row matches by
+its index, name template or row_label, a device by its name.
+
+YAML files take the same structure (PyYAML needs to be installed). CSV files hold one device
+per line, with the columns ``row``, ``device``, ``name``, an optional ``label`` template and one column
+per parameter. Consecutive lines with the same ``row`` value form one layout row.
+"""
+
+import csv
+import fnmatch
+import itertools
+import json
+import os
+import string
+
+import numpy as np
+
+from dc_design import coupling_lengths
+from mode_table import load_table
+from parameters import ETCH_DEPTH, SI_THICKNESS, coupler_parameters
+
+# Device factories of components.py which can be used in a sweep file. components.py, and with it
+# gdshelpers, is only imported once a factory is needed, so listing a sweep stays fast
+DEVICE_FACTORIES = ('asymmetric_spiral_mzi', 'spiral_winding', 'grating_coupler')
+
+SWEEP_MODES = ('grid', 'zip', 'list')
+
+
+class _LabelFormatter(string.Formatter):
+    """
+    str.format, except that floats without a format spec are rounded to 9 decimals,
+    so that accumulated ranges print as 5.9 rather than 5.8999999999999995.
+    """
+
+    def format_field(self, value, format_spec):
+        if isinstance(value, float) and not format_spec:
+            return str(round(value, 9))
+        return super().format_field(value, format_spec)
+
+
+_formatter = _LabelFormatter()
+
+
+def load_sweep(path):
+    """
+    Reads a sweep description from a .json, .yaml/.yml or .csv file.
+    :param path: Path of the sweep file
+    :return: Sweep description dict, with a "rows" list
+    """
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension == '.json':
+        with open(path) as f:
+            return json.load(f)
+
+    if extension in ('.yaml', '.yml'):
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError('PyYAML is required to read YAML sweep files, use JSON or CSV otherwise')
+        with open(path) as f:
+            return yaml.safe_load(f)
+
+    if extension == '.csv':
+        return _load_csv_sweep(path)
+
+    raise ValueError('Sweep files must be .json, .yaml, .yml or .csv, not "{}"'.format(path))
+
+
+def _parse_csv_value(value):
+    """
+    Converts a CSV cell to an int or float where possible.
+    """
+    for kind in (int, float):
+        try:
+            return kind(value)
+        except ValueError:
+            pass
+    return value
+
+
+def _load_csv_sweep(path):
+    """
+    Turns a one-device-per-line CSV file into a sweep description of "list" rows.
+    """
+    rows = []
+    with open(path, newline='') as f:
+        for line in csv.DictReader(f):
+            row_key = line.pop('row')
+            device = line.pop('device')
+            name = line.pop('name')
+            label = line.pop('label', None)
+            point = {key: _parse_csv_value(value) for key, value in line.items() if value != ''}
+            point['name'] = name
+            if label:
+                point['label'] = label
+
+            if not rows or rows[-1]['_key'] != row_key or rows[-1]['device'] != device:
+                rows.append({'_key': row_key, 'device': device, 'name': '{name}',
+                             'sweep': {'mode': 'list', 'points': []}})
+            rows[-1]['sweep']['points'].append(point)
+
+    for row in rows:
+        del row['_key']
+    return {'rows': rows}
+
+
+def _expand_values(values):
+    """
+    Generator over the values of a parameter, given as a list or a start/step/num range.
+    """
+    if isinstance(values, dict):
+        value = values['start']
+        for _ in range(values['num']):
+            yield value
+            value += values['step']
+    else:
+        yield from values
+
+
+def iter_points(sweep):
+    """
+    Generator over the parameter dicts of a row's sweep.
+    :param sweep: The "sweep" entry of a row
+    :return: One dict of swept parameter values per device
+    """
+    mode = sweep.get('mode', 'grid')
+
+    if mode == 'list':
+        for point in sweep['points']:
+            yield dict(point)
+        return
+
+    names = list(sweep['parameters'])
+    values = [_expand_values(sweep['parameters'][name]) for name in names]
+
+    if mode == 'grid':
+        # product() needs to restart the inner generators, so only these are materialised
+        combinations = itertools.product(*[list(v) for v in values])
+    elif mode == 'zip':
+        values = [list(v) for v in values]
+        if len(set(len(v) for v in values)) > 1:
+            raise ValueError('All parameters of a zip sweep need the same number of values, got {}'
+                             .format({name: len(v) for name, v in zip(names, values)}))
+        combinations = zip(*values)
+    else:
+        raise ValueError('Unknown sweep mode "{}", use one of {}'.format(mode, SWEEP_MODES))
+
+    for combination in combinations:
+        yield dict(zip(names, combination))
+
+
+def dc_lengths(settings, gaps):
+    """
+    Coupling lengths of a row's "dc_length" settings.
+    :param settings: The "dc_length" entry of a row
+    :param gaps: Coupling gaps of the devices
+    :return: List of coupling lengths
+    """
+    table = load_table(settings['table']) if 'table' in settings else None
+    lengths = coupling_lengths(gaps, settings.get('split', 0.5), settings.get('etch_depth'),
+                               settings.get('si_thickness'), settings.get('wavelength'), table)
+    return [round(float(length), settings.get('decimals', 3)) for length in lengths]
+
+
+def row_stack(row):
+    """
+    Stack a row is made for, from its "stack" entry.
+    :return: Dict of etch_depth and si_thickness
+    """
+    return dict({'etch_depth': ETCH_DEPTH, 'si_thickness': SI_THICKNESS}, **row.get('stack', {}))
+
+
+def device_factory(device):
+    """
+    Component function of a device name in a sweep file.
+    """
+    if device not in DEVICE_FACTORIES:
+        raise ValueError('Unknown device "{}", use one of {}'.format(device, list(DEVICE_FACTORIES)))
+    import components
+    return getattr(components, device)
+
+
+def row_points(row):
+    """
+    Swept parameters of the devices of one sweep row, with the coupling lengths of a "dc_length" entry.
+    :param row: Row description
+    :return: List of parameter dicts, to be combined with the fixed parameters by row_device
+    """
+    if row['device'] not in DEVICE_FACTORIES:
+        raise ValueError('Unknown device "{}", use one of {}'.format(row['device'], list(DEVICE_FACTORIES)))
+
+    fixed = row.get('fixed', {})
+    points = list(iter_points(row.get('sweep', {'mode': 'list', 'points': [{}]})))
+    if 'dc_length' in row:
+        # All lengths of the row from one table query
+        for point, length in zip(points, dc_lengths(dict(row.get('stack', {}), **row['dc_length']),
+                                                    [dict(fixed, **point)['coupling_gap'] for point in points])):
+            point['coupling_length'] = length
+    return points
+
+
+def row_device(row, i, point):
+    """
+    Device i of a sweep row.
+    :param row: Row description
+    :param point: Its entry of row_points(row)
+    :return: (keyword arguments, device name, label text or None)
+    """
+    fields = dict(row.get('fixed', {}), **point)
+    name = _formatter.format(row['name'], i=i, **fields)
+    # CSV sweeps carry a label template per device rather than per row
+    label = point.get('label', row.get('label'))
+    if label:
+        label = _formatter.format(label, **dict(fields, i=i, name=name))
+
+    kwargs = {key: value for key, value in fields.items() if key not in ('name', 'label')}
+    kwargs.setdefault('coupler_parameters', coupler_parameters)
+    return kwargs, name, label
+
+
+def iter_row_devices(row):
+    """
+    Generator over the devices of one sweep row, without their component functions.
+    :param row: Row description
+    :return: Tuples of (keyword arguments, device name, label text or None)
+    """
+    for i, point in enumerate(row_points(row)):
+        yield row_device(row, i, point)
+
+
+def _value_array(values):
+    """
+    Values of a parameter as an array, see _expand_values. Ranges are accumulated by cumsum,
+    which adds in the same order as the repeated addition.
+    """
+    if isinstance(values, dict):
+        steps = np.full(values['num'], values['step'], dtype=float)
+        steps[:1] = values['start']
+        return np.cumsum(steps)
+    return np.asarray(values)
+
+
+def row_arrays(row):
+    """
+    Numeric parameters of the devices of one sweep row as arrays, like row_points and the fixed
+    parameters give them, without a dict per device.
+    :param row: Row description
+    :return: (number of devices, dict of one float array per parameter, NaN where a device of a
+        "list" row does not take it)
+    """
+    if row['device'] not in DEVICE_FACTORIES:
+        raise ValueError('Unknown device "{}", use one of {}'.format(row['device'], list(DEVICE_FACTORIES)))
+
+    sweep = row.get('sweep', {'mode': 'list', 'points': [{}]})
+    mode = sweep.get('mode', 'grid')
+    if mode == 'list':
+        points = sweep['points']
+        keys = {key for point in points for key, value in point.items() if isinstance(value, (int, float))}
+        columns = {key: np.array([point.get(key, np.nan) for point in points], dtype=float) for key in keys}
+        n = len(points)
+    else:
+        names = list(sweep['parameters'])
+        values = [_value_array(sweep['parameters'][name]) for name in names]
+        if mode == 'grid':
+            values = [v.ravel() for v in np.meshgrid(*values, indexing='ij')] if values else []
+        elif mode == 'zip':
+            if len(set(len(v) for v in values)) > 1:
+                raise ValueError('All parameters of a zip sweep need the same number of values, got {}'
+                                 .format({name: len(v) for name, v in zip(names, values)}))
+        else:
+            raise ValueError('Unknown sweep mode "{}", use one of {}'.format(mode, SWEEP_MODES))
+        columns = {name: v.astype(float) for name, v in zip(names, values) if v.dtype.kind in 'biuf'}
+        # Without parameters, a grid has one (empty) combination and a zip none
+        n = len(values[0]) if values else int(mode == 'grid')
+
+    for key, value in row.get('fixed', {}).items():
+        if not isinstance(value, (int, float)):
+            continue
+        if key in columns:
+            # Swept values take precedence, fixed ones fill in for the points which leave them out
+            columns[key][np.isnan(columns[key])] = value
+        else:
+            columns[key] = np.full(n, value, dtype=float)
+
+    if 'dc_length' in row:
+        columns['coupling_length'] = np.array(dc_lengths(dict(row.get('stack', {}), **row['dc_length']),
+                                                         columns['coupling_gap']))
+    return n, columns
+
+
+def iter_row_jobs(row):
+    """
+    Generator over the device jobs of one sweep row.
+    :param row: Row description
+    :return: Jobs of (factory, keyword arguments, device name, label text or None)
+    """
+    factory = device_factory(row['device'])
+    for kwargs, name, label in iter_row_devices(row):
+        yield factory, kwargs, name, label
+
+
+def _matches(values, patterns):
+    return any(fnmatch.fnmatchcase(str(value), pattern) for value in values if value is not None
+               for pattern in patterns)
+
+
+def iter_sweep_devices(spec, rows=None, devices=None):
+    """
+    Generator over the devices of a sweep, in layout order, without their component functions.
+
+    :param spec: Sweep description, as returned by load_sweep
+    :param rows: Optional shell-style patterns, only rows whose index, name template or row_label match one are used
+    :param devices: Optional shell-style patterns, only devices whose name matches one are used
+    :return: Tuples of (row index, keyword arguments, device name, label text or None)
+    """
+    for row_id, row in enumerate(spec['rows']):
+        if rows and not _matches((row_id, row['name'], row.get('row_label')), rows):
+            continue
+        for kwargs, name, label in iter_row_devices(row):
+            if not devices or _matches((name,), devices):
+                yield row_id, kwargs, name, label
+
+
+def iter_sweep_jobs(spec, rows=None, devices=None):
+    """
+    Generator over all device jobs of a sweep, in layout order.
+    :param spec: Sweep description, as returned by load_sweep
+    :param rows: Optional row patterns, see iter_sweep_devices
+    :param devices: Optional device name patterns, see iter_sweep_devices
+    :return: Tuples of (row index, job)
+    """
+    for row_id, kwargs, name, label in iter_sweep_devices(spec, rows, devices):
+        yield row_id, (device_factory(spec['rows'][row_id]['device']), kwargs, name, label)
@@ -0,0 +1,87 @@
+from gdshelpers.geometry.chip import Cell
+from shapely.geometry import box
+from shapely.ops import unary_union
+
+from drc import DesignRuleChecker
+from parameters import *
+
+
+def _straight(name, length=20):
+    cell = Cell(name)
+    cell.add_to_layer(WAVEGUIDE_LAYER, box(0, -WAVEGUIDE_WIDTH / 2, length, WAVEGUIDE_WIDTH / 2))
+    return cell
+
+
+def _fibre_array(name, gap):
+    """
+    Geometry-free group of two straights gap apart, like the array cells of fibre_array.FibreArrayCells.
+    """
+    array = Cell(name)
+    array.add_cell(_straight(name + '_lower'), origin=(0, 0))
+    array.add_cell(_straight(name + '_upper'), origin=(0, WAVEGUIDE_WIDTH + gap))
+    return array
+
+
+def test_spacing_inside_fibre_array():
+    top = Cell('top')
+    top.add_cell(_fibre_array('array_0', DRC_MIN_SPACING / 2), origin=(100, 50))
+
+    violations = DesignRuleChecker().check_layout(top)
+
+    assert [violation.rule for violation in violations] == ['spacing']
+    violation = violations[0]
+    assert violation.cell == 'array_0_lower'
+    assert abs(violation.value - DRC_MIN_SPACING / 2) < 1e-9
+    # Reported in top cell coordinates, between the two straights
+    assert 100 <= violation.x <= 120
+    assert abs(violation.y - (50 + (WAVEGUIDE_WIDTH + DRC_MIN_SPACING / 2) / 2)) < 1e-9
+
+
+def test_fibre_array_apart_is_clean():
+    top = Cell('top')
+    top.add_cell(_fibre_array('array_0', 2 * DRC_MIN_SPACING), origin=(100, 50))
+
+    assert DesignRuleChecker().check_layout(top) == []
+
+
+def test_fibre_array_against_placed_device():
+    top = Cell('top')
+    top.add_cell(_fibre_array('array_0', 2 * DRC_MIN_SPACING), origin=(0, 0))
+    top.add_cell(_straight('single'), origin=(0, -WAVEGUIDE_WIDTH - DRC_MIN_SPACING / 2))
+
+    violations = DesignRuleChecker().check_layout(top)
+
+    assert [(violation.rule, violation.cell) for violation in violations] == [('spacing', 'array_0_lower')]
+
+
+def test_spacing_at_both_couplers():
+    # An upper waveguide coming down to the lower one twice, like the two couplers of an MZI
+    gap = DRC_MIN_SPACING / 2
+    upper = unary_union([box(0, 2, 60, 2 + WAVEGUIDE_WIDTH),
+                         box(10, WAVEGUIDE_WIDTH / 2 + gap, 20, 2 + WAVEGUIDE_WIDTH),
+                         box(40, WAVEGUIDE_WIDTH / 2 + gap, 50, 2 + WAVEGUIDE_WIDTH)])
+    cell = _straight('mzi', length=60)
+    cell.add_to_layer(WAVEGUIDE_LAYER, upper)
+
+    violations = DesignRuleChecker().check_layout(cell)
+
+    assert [violation.rule for violation in violations] == ['spacing', 'spacing']
+    assert sorted(10 <= violation.x <= 20 for violation in violations) == [False, True]
+    assert all(abs(violation.value - gap) < 1e-9 for violation in violations)
+
+
+def test_spacing_inside_hairpin():
+    # One polygon whose arms come back DRC_MIN_SPACING / 2 from each other
+    gap = DRC_MIN_SPACING / 2
+    hairpin = unary_union([box(0, 0, 20, WAVEGUIDE_WIDTH),
+                           box(0, WAVEGUIDE_WIDTH + gap, 20, 2 * WAVEGUIDE_WIDTH + gap),
+                           box(20 - WAVEGUIDE_WIDTH, 0, 20, 2 * WAVEGUIDE_WIDTH + gap)])
+    cell = Cell('hairpin')
+    cell.add_to_layer(WAVEGUIDE_LAYER, hairpin)
+
+    violations = DesignRuleChecker().check_layout(cell)
+
+    assert [violation.rule for violation in violations] == ['spacing']
+    violation = violations[0]
+    assert abs(violation.value - gap) < 1e-9
+    assert abs(violation.y - (WAVEGUIDE_WIDTH + gap / 2)) < 1e-9
@@ -0,0 +1,148 @@
+"""
+Thermo-optic phase shifters.
+
+A heater is a strip of width HEATER_WIDTH on top of the cladding, CLADDING_THICKNESS above the Si.
+The heat it dissipates flows through the oxide into the substrate below the BOX, which stays at
+ambient temperature. For a heater much longer than it is wide this is a 2D problem, solved with
+the method of images: the strip is a row of line sources in an infinite oxide, mirrored in the
+substrate plane with the opposite sign. Averaged over the strip width the temperature rise at
+lateral offset x and depth d below the heater is
+
+    dT = P / (4 pi k L) * mean over the strip of ln(((x - s)**2 + b**2) / ((x - s)**2 + a**2))
+
+with a the distance between heater and waveguide, b the distance between the waveguide and the
+image of the heater, k the oxide conductivity and L the heater length, which has a closed form.
+The heat spreading through the Si slab of rib waveguides is neglected, so the results are upper
+bounds on the temperature of neighbouring waveguides.
+
+The effective index changes by THERMO_OPTIC_COEFFICIENT * dT + THERMO_OPTIC_SECOND_ORDER * dT**2 / 2,
+which can be taken from the Lumerical/Thermal_waveguide FDE runs. A waveguide which passes under
+the heater several times, like a spiral arm, has a heated length longer than the heater.
+
+All functions broadcast over NumPy arrays of powers and geometries.
+Lengths are in um, powers in W and temperatures in K.
+"""
+
+import numpy as np
+
+from parameters import *
+
+# Heights above the substrate, i.e. the bottom of the BOX
+WAVEGUIDE_HEIGHT = BOX_THICKNESS + SI_THICKNESS / 2
+HEATER_HEIGHT = BOX_THICKNESS + SI_THICKNESS + CLADDING_THICKNESS
+
+
+def _strip_log_integral(u, c):
+    """
+    Integral of ln(u**2 + c**2) over u.
+    """
+    return u * np.log(u ** 2 + c ** 2) - 2 * u + 2 * c * np.arctan2(u, c)
+
+
+def temperature_per_watt(offset=0., heater_width=HEATER_WIDTH, heater_length=HEATER_LENGTH,
+                         heater_height=HEATER_HEIGHT, waveguide_height=WAVEGUIDE_HEIGHT,
+                         conductivity=OXIDE_THERMAL_CONDUCTIVITY):
+    """
+    Temperature rise of a waveguide per watt of heater power.
+
+    :param offset: Lateral distance between the centres of heater and waveguide
+    :param heater_width: Width of the heater strip, larger than 0
+    :param heater_length: Length of the heater
+    :param heater_height: Height of the heater above the substrate
+    :param waveguide_height: Height of the waveguide centre above the substrate
+    :param conductivity: Thermal conductivity of the oxide in W/(m K)
+    :return: Temperature rise in K/W
+    """
+    offset, heater_width = np.asarray(offset, dtype=float), np.asarray(heater_width, dtype=float)
+    a = heater_height - waveguide_height
+    b = heater_height + waveguide_height
+    high, low = offset + heater_width / 2, offset - heater_width / 2
+    mean_log = (_strip_log_integral(high, b) - _strip_log_integral(low, b)
+                - _strip_log_integral(high, a) + _strip_log_integral(low, a)) / heater_width
+    # Line power density in W/m
+    return mean_log / (4 * np.pi * conductivity * np.asarray(heater_length) * 1e-6)
+
+
+def index_change(delta_t, dn_dt=THERMO_OPTIC_COEFFICIENT, d2n_dt2=THERMO_OPTIC_SECOND_ORDER):
+    """
+    Change of the effective index for a temperature rise delta_t.
+    """
+    return dn_dt * delta_t + d2n_dt2 * np.asarray(delta_t) ** 2 / 2
+
+
+def phase_shift(power, offset=0., heated_length=None, wavelength=WAVELENGTH, heater_length=HEATER_LENGTH,
+                dn_dt=THERMO_OPTIC_COEFFICIENT, d2n_dt2=THERMO_OPTIC_SECOND_ORDER, **geometry):
+    """
+    Phase shift of a waveguide at a lateral offset from a heater.
+
+    :param power: Heater power in W
+    :param offset: Lateral distance between heater and waveguide
+    :param heated_length: Length of waveguide under the heater, heater_length by default
+    :param geometry: Further arguments of temperature_per_watt
+    :return: Phase shift in rad
+    """
+    heated_length = heater_length if heated_length is None else heated_length
+    delta_t = np.asarray(power) * temperature_per_watt(offset, heater_length=heater_length, **geometry)
+    return 2 * np.pi / wavelength * index_change(delta_t, dn_dt, d2n_dt2) * heated_length
+
+
+def thermal_crosstalk(separation, **geometry):
+    """
+    Temperature rise of a waveguide at lateral distance separation from a heater, relative to the
+    waveguide under it.
+
+    :param geometry: Further arguments of temperature_per_watt
+    """
+    return temperature_per_watt(separation, **geometry) / temperature_per_watt(0., **geometry)
+
+
+def p_pi(arm_separation=None, heated_length=None, wavelength=WAVELENGTH, heater_length=HEATER_LENGTH,
+         dn_dt=THERMO_OPTIC_COEFFICIENT, d2n_dt2=THERMO_OPTIC_SECOND_ORDER, **geometry):
+    """
+    Heater power for a phase shift of pi, between the heated arm and the other arm of an MZI if
+    arm_separation is given, which the heat reaches as well.
+
+    :param arm_separation: Lateral distance between the heated and the other arm, None for an unheated reference
+    :param heated_length: Length of waveguide under the heater, heater_length by default
+    :param geometry: Further arguments of temperature_per_watt
+    :return: Power in W
+    """
+    heated_length = heater_length if heated_length is None else heated_length
+    heated = temperature_per_watt(0., heater_length=heater_length, **geometry)
+    other = 0. if arm_separation is None else temperature_per_watt(arm_separation, heater_length=heater_length,
+                                                                   **geometry)
+    # Phase difference = 2 pi L / wavelength * (linear * P + quadratic * P**2)
+    linear = dn_dt * (heated - other)
+    quadratic = d2n_dt2 * (heated ** 2 - other ** 2) / 2
+    target = wavelength / (2 * np.asarray(heated_length, dtype=float))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        root = (np.sqrt(linear ** 2 + 4 * quadratic * target) - linear) / (2 * quadratic)
+        return np.where(quadratic == 0, target / linear, root)
+
+
+def crosstalk_matrix(positions, **geometry):
+    """
+    Temperature rise of every waveguide per watt in every heater, for heaters on top of parallel
+    waveguides. As heat conduction is linear, the temperatures of several heaters add up.
+
+    :param positions: Lateral positions of the waveguides, shape (..., N)
+    :param geometry: Further arguments of temperature_per_watt
+    :return: Array of shape (..., N, N), [..., waveguide, heater] in K/W
+    """
+    positions = np.asarray(positions, dtype=float)
+    return temperature_per_watt(positions[..., :, np.newaxis] - positions[..., np.newaxis, :], **geometry)
+
+
+def arm_phases(powers, positions, heated_lengths=HEATER_LENGTH, wavelength=WAVELENGTH,
+               dn_dt=THERMO_OPTIC_COEFFICIENT, d2n_dt2=THERMO_OPTIC_SECOND_ORDER, **geometry):
+    """
+    Phase shifts of parallel waveguides with a heater on each, including the heat of their neighbours.
+
+    :param powers: Heater powers, shape (..., N)
+    :param positions: Lateral positions of the waveguides, shape (..., N)
+    :param heated_lengths: Length of every waveguide under its heater
+    :param geometry: Further arguments of temperature_per_watt
+    :return: Phase shifts, shape (..., N)
+    """
+    delta_t = np.einsum('...ij,...j->...i', crosstalk_matrix(positions, **geometry), np.asarray(powers, dtype=float))
+    return 2 * np.pi / wavelength * index_change(delta_t, dn_dt, d2n_dt2) * heated_lengths